@@ -19,6 +19,7 @@
 # Authors:  Alvaro del Castillo <acs@bitergia.com>
 #
 
+from bicho import http, pool
 from bicho.config import Config
 
 from bicho.backends import Backend
@@ -35,7 +36,6 @@ import os
 import pprint
 import random
 import sys
-import time
 import traceback
 import urllib
 import feedparser
@@ -134,12 +134,60 @@ class DBAlluraIssueExtMySQL(DBAlluraIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBAlluraIssueExtSQLite(DBAlluraIssueExt):
+    """
+    SQLite subclass of L{DBAlluraIssueExt}
+    """
+
+    # If the table is changed you need to remove old from database
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_allura ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     labels TEXT, \
+                     private BOOLEAN, \
+                     ticket_num INTEGER NOT NULL, \
+                     discussion_thread_url TEXT, \
+                     related_artifacts TEXT, \
+                     custom_fields TEXT, \
+                     mod_date DATETIME, \
+                     issue_id INTEGER NOT NULL, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBAlluraIssueExtPostgreSQL(DBAlluraIssueExt):
+    """
+    PostgreSQL subclass of L{DBAlluraIssueExt}
+    """
+
+    # If the table is changed you need to remove old from database
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_allura ( \
+                     id SERIAL PRIMARY KEY, \
+                     labels TEXT, \
+                     private BOOLEAN, \
+                     ticket_num INTEGER NOT NULL, \
+                     discussion_thread_url TEXT, \
+                     related_artifacts TEXT, \
+                     custom_fields TEXT, \
+                     mod_date TIMESTAMP, \
+                     issue_id INTEGER NOT NULL, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
 class DBAlluraBackend(DBBackend):
     """
     Adapter for Allura backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBAlluraIssueExtMySQL]
+        self.SQLITE_EXT = [DBAlluraIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBAlluraIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -158,30 +206,26 @@ class DBAlluraBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBAlluraIssueExt,
-                                      DBAlluraIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBAlluraIssueExt(issue_id)
-                #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
-
-            db_issue_ext.labels = unicode(issue.labels)
-            db_issue_ext.private = bool(issue.private)
-            db_issue_ext.ticket_num = int(issue.ticket_num)
-            db_issue_ext.discussion_thread_url = unicode(issue.discussion_thread_url)
-            db_issue_ext.related_artifacts = unicode(issue.related_artifacts)
-            db_issue_ext.custom_fields = unicode(issue.custom_fields)
-            db_issue_ext.mod_date = issue.mod_date
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBAlluraIssueExt,
+                                  DBAlluraIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBAlluraIssueExt(issue_id)
+            #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
+
+        db_issue_ext.labels = unicode(issue.labels)
+        db_issue_ext.private = bool(issue.private)
+        db_issue_ext.ticket_num = int(issue.ticket_num)
+        db_issue_ext.discussion_thread_url = unicode(issue.discussion_thread_url)
+        db_issue_ext.related_artifacts = unicode(issue.related_artifacts)
+        db_issue_ext.custom_fields = unicode(issue.custom_fields)
+        db_issue_ext.mod_date = issue.mod_date
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def insert_change_ext(self, store, change, change_id):
         """
@@ -243,9 +287,9 @@ class Allura():
         bug_number = bug_url.split('/')[-1]
 
         try:
-            f = urllib.urlopen(bug_url)
+            f = http.urlopen(bug_url)
 
-            # f = urllib.urlopen(bug_url)
+            # f = http.urlopen(bug_url)
             json_ticket = f.read()
             # print json_ticket
             try:
@@ -301,7 +345,7 @@ class Allura():
 
         printdbg("Analyzing issue changes" + changes_url)
 
-        d = feedparser.parse(changes_url)
+        d = feedparser.parse(http.get(changes_url).content)
         changes = self.parse_changes(d)
 
         return changes
@@ -380,7 +424,7 @@ class Allura():
         self.url_issues += urllib.quote("mod_date_dt:[" + time_window + "]")
         printdbg("URL for getting metadata " + self.url_issues)
 
-        f = urllib.urlopen(self.url_issues)
+        f = http.urlopen(self.url_issues)
         ticketTotal = json.loads(f.read())
 
         total_issues = int(ticketTotal['count'])
@@ -394,17 +438,17 @@ class Allura():
 
         print "ETA ", (total_issues * Config.delay) / (60), "m (", (total_issues * Config.delay) / (60 * 60), "h)"
 
-        while start_page <= total_pages:
-            self.url_issues = Config.url + "/search/?limit=" + str(issues_per_query)
-            self.url_issues += "&page=" + str(start_page) + "&q="
+        def fetch_tickets(page):
+            url_issues = Config.url + "/search/?limit=" + str(issues_per_query)
+            url_issues += "&page=" + str(page) + "&q="
             # A time range with all the tickets
-            self.url_issues += urllib.quote("mod_date_dt:[" + time_window + "]")
+            url_issues += urllib.quote("mod_date_dt:[" + time_window + "]")
             # Order by mod_date_dt desc
-            self.url_issues += "&sort=mod_date_dt+asc"
+            url_issues += "&sort=mod_date_dt+asc"
 
-            printdbg("URL for next issues " + self.url_issues)
+            printdbg("URL for next issues " + url_issues)
 
-            f = urllib.urlopen(self.url_issues)
+            f = http.urlopen(url_issues)
 
             ticketList = json.loads(f.read())
 
@@ -412,23 +456,35 @@ class Allura():
             for ticket in ticketList["tickets"]:
                 bugs.append(ticket["ticket_num"])
 
-            for bug in bugs:
+            if page < total_pages:
+                next_page = page + 1
+            else:
+                next_page = None
+
+            return bugs, next_page
+
+        # The next page of tickets is fetched while
+        # the tickets of the current one are stored
+        for bugs in pool.pages(fetch_tickets, start_page):
+            # Bugs are fetched by the workers of the pool
+            # and stored in order
+            issue_urls = [Config.url + "/" + str(bug) for bug in bugs]
+            results = pool.imap(self.analyze_bug, issue_urls)
+
+            for issue_url in issue_urls:
                 try:
-                    issue_url = Config.url + "/" + str(bug)
-                    issue_data = self.analyze_bug(issue_url)
+                    issue_data = results.next()
                     if issue_data is None:
                         continue
                     bugsdb.insert_issue(issue_data, dbtrk.id)
                     remaining -= 1
                     print "Remaining time: ", (remaining) * Config.delay / 60, "m"
-                    time.sleep(self.delay)
                 except Exception, e:
                     printerr("Error in function analyze_bug " + issue_url)
                     traceback.print_exc(file=sys.stdout)
                 except UnicodeEncodeError:
                     printerr("UnicodeEncodeError: the issue %s couldn't be stored"
                              % (issue_data.issue))
-            start_page += 1
 
         printout("Done. Bugs analyzed:" + str(total_issues - remaining))
 
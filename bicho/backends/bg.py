@@ -22,28 +22,44 @@
 #          Santiago Dueñas <sduenas@libresoft.es>
 #          Alvaro del Castillo <acs@bitergia.com>
 
-import string
-import time
+import HTMLParser
+import re
+import sys
 import urllib
-import urllib2
 import urlparse
 import xml.sax.handler
+import xmlrpclib
 
 from datetime import datetime, timedelta
+from dateutil import tz
 from dateutil.parser import parse
+from xml.parsers.expat import ExpatError
 
-from storm.locals import DateTime, Int, Reference, Unicode, Desc
-
-from BeautifulSoup import BeautifulSoup, Comment as BFComment
+from storm.locals import DateTime, Int, Reference, Unicode, Desc, Max
 
+from bicho import http, pool
 from bicho.config import Config
 from bicho.backends import Backend
 from bicho.common import Tracker, People, Issue, Comment, Change
-from bicho.db.database import DBIssue, DBBackend, DBTracker, get_database
-from bicho.utils import printerr, printdbg, printout, valid_XML_char_ordinal
+from bicho.db.database import DBIssue, DBBackend, DBChange, DBTracker, \
+    get_database
+from bicho.db.writer import DBWriter
+from bicho.utils import printerr, printdbg, printout, \
+     remove_invalid_XML_chars, iter_valid_XML_chunks
 
 BUGZILLA = "bugzilla"
 
+# Buglists with a number of bugs multiple of this one might have been
+# cut by a limit of the server lower than the one given
+ROUND_SEARCH_RESULTS = 100
+
+# Starting date of the first window
+EPOCH = datetime(1970, 1, 1)
+
+# First major version whose webservice is used to retrieve
+# the activity of the issues
+WEBSERVICE_VERSION = 4
+
 
 class DBBugzillaIssueExt(object):
     """
@@ -129,12 +145,171 @@ class DBBugzillaIssueExtMySQL(DBBugzillaIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBBugzillaIssueExtSQLite(DBBugzillaIssueExt):
+    """
+    SQLite subclass of L{DBBugzillaIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_bugzilla ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     alias VARCHAR(64) DEFAULT NULL, \
+                     delta_ts DATETIME NOT NULL, \
+                     reporter_accessible VARCHAR(32) DEFAULT NULL, \
+                     cclist_accessible VARCHAR(32) DEFAULT NULL, \
+                     classification_id VARCHAR(32) DEFAULT NULL, \
+                     classification VARCHAR(32) DEFAULT NULL, \
+                     product VARCHAR(64) DEFAULT NULL, \
+                     component VARCHAR(64) DEFAULT NULL, \
+                     version VARCHAR(64) DEFAULT NULL, \
+                     rep_platform VARCHAR(64) DEFAULT NULL, \
+                     op_sys VARCHAR(64) DEFAULT NULL, \
+                     dup_id INTEGER DEFAULT NULL, \
+                     bug_file_loc TEXT DEFAULT NULL, \
+                     status_whiteboard TEXT DEFAULT NULL, \
+                     target_milestone VARCHAR(64) DEFAULT NULL, \
+                     votes INTEGER DEFAULT NULL, \
+                     everconfirmed VARCHAR(32) DEFAULT NULL, \
+                     qa_contact VARCHAR(64) DEFAULT NULL, \
+                     estimated_time VARCHAR(32) DEFAULT NULL, \
+                     remaining_time VARCHAR(32) DEFAULT NULL, \
+                     actual_time VARCHAR(32) DEFAULT NULL, \
+                     deadline DATETIME DEFAULT NULL, \
+                     keywords VARCHAR(256) DEFAULT NULL, \
+                     flag VARCHAR(128) DEFAULT NULL, \
+                     cc VARCHAR(64) DEFAULT NULL, \
+                     group_bugzilla VARCHAR(32) DEFAULT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBBugzillaIssueExtPostgreSQL(DBBugzillaIssueExt):
+    """
+    PostgreSQL subclass of L{DBBugzillaIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_bugzilla ( \
+                     id SERIAL PRIMARY KEY, \
+                     alias TEXT DEFAULT NULL, \
+                     delta_ts TIMESTAMP NOT NULL, \
+                     reporter_accessible TEXT DEFAULT NULL, \
+                     cclist_accessible TEXT DEFAULT NULL, \
+                     classification_id TEXT DEFAULT NULL, \
+                     classification TEXT DEFAULT NULL, \
+                     product TEXT DEFAULT NULL, \
+                     component TEXT DEFAULT NULL, \
+                     version TEXT DEFAULT NULL, \
+                     rep_platform TEXT DEFAULT NULL, \
+                     op_sys TEXT DEFAULT NULL, \
+                     dup_id INTEGER DEFAULT NULL, \
+                     bug_file_loc TEXT DEFAULT NULL, \
+                     status_whiteboard TEXT DEFAULT NULL, \
+                     target_milestone TEXT DEFAULT NULL, \
+                     votes INTEGER DEFAULT NULL, \
+                     everconfirmed TEXT DEFAULT NULL, \
+                     qa_contact TEXT DEFAULT NULL, \
+                     estimated_time TEXT DEFAULT NULL, \
+                     remaining_time TEXT DEFAULT NULL, \
+                     actual_time TEXT DEFAULT NULL, \
+                     deadline TIMESTAMP DEFAULT NULL, \
+                     keywords TEXT DEFAULT NULL, \
+                     flag TEXT DEFAULT NULL, \
+                     cc TEXT DEFAULT NULL, \
+                     group_bugzilla TEXT DEFAULT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBBugzillaWindow(object):
+    """
+    Range of modification dates whose bugs were completely retrieved
+    """
+    __storm_table__ = 'windows_bugzilla'
+
+    id = Int(primary=True)
+    date_from = DateTime()
+    date_to = DateTime()
+    tracker_id = Int()
+
+    tracker = Reference(tracker_id, DBTracker.id)
+
+    def __init__(self, date_from, date_to, tracker_id):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.tracker_id = tracker_id
+
+
+class DBBugzillaWindowMySQL(DBBugzillaWindow):
+    """
+    MySQL subclass of L{DBBugzillaWindow}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS windows_bugzilla ( \
+                     id INTEGER NOT NULL AUTO_INCREMENT, \
+                     date_from DATETIME NOT NULL, \
+                     date_to DATETIME NOT NULL, \
+                     tracker_id INTEGER NOT NULL, \
+                     PRIMARY KEY(id), \
+                     INDEX windows_tracker_idx(tracker_id), \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ) ENGINE=MYISAM;'
+
+
+class DBBugzillaWindowSQLite(DBBugzillaWindow):
+    """
+    SQLite subclass of L{DBBugzillaWindow}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS windows_bugzilla ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     date_from DATETIME NOT NULL, \
+                     date_to DATETIME NOT NULL, \
+                     tracker_id INTEGER NOT NULL, \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBBugzillaWindowPostgreSQL(DBBugzillaWindow):
+    """
+    PostgreSQL subclass of L{DBBugzillaWindow}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS windows_bugzilla ( \
+                     id SERIAL PRIMARY KEY, \
+                     date_from TIMESTAMP NOT NULL, \
+                     date_to TIMESTAMP NOT NULL, \
+                     tracker_id INTEGER NOT NULL, \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
 class DBBugzillaBackend(DBBackend):
     """
     Adapter for Bugzilla backend.
     """
     def __init__(self):
-        self.MYSQL_EXT = [DBBugzillaIssueExtMySQL]
+        self.MYSQL_EXT = [DBBugzillaIssueExtMySQL, DBBugzillaWindowMySQL]
+        self.SQLITE_EXT = [DBBugzillaIssueExtSQLite, DBBugzillaWindowSQLite]
+        self.POSTGRESQL_EXT = [DBBugzillaIssueExtPostgreSQL,
+                               DBBugzillaWindowPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -153,47 +328,43 @@ class DBBugzillaBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBBugzillaIssueExt,
-                                      DBBugzillaIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBBugzillaIssueExt(issue_id)
-
-            db_issue_ext.alias = self.__return_unicode(issue.alias)
-            db_issue_ext.delta_ts = issue.delta_ts
-            db_issue_ext.reporter_accessible = issue.reporter_accessible
-            db_issue_ext.cclist_accessible = issue.cclist_accessible
-            db_issue_ext.classification_id = issue.classification_id
-            db_issue_ext.classification = self.__return_unicode(issue.classification)
-            db_issue_ext.product = self.__return_unicode(issue.product)
-            db_issue_ext.component = self.__return_unicode(issue.component)
-            db_issue_ext.version = self.__return_unicode(issue.version)
-            db_issue_ext.rep_platform = self.__return_unicode(issue.rep_platform)
-            db_issue_ext.op_sys = self.__return_unicode(issue.op_sys)
-            db_issue_ext.dup_id = issue.dup_id
-            db_issue_ext.bug_file_loc = self.__return_unicode(issue.bug_file_loc)
-            db_issue_ext.status_whiteboard = self.__return_unicode(issue.status_whiteboard)
-            db_issue_ext.target_milestone = self.__return_unicode(issue.target_milestone)
-            db_issue_ext.votes = self.__return_int(issue.votes)
-            db_issue_ext.everconfirmed = self.__return_unicode(issue.everconfirmed)
-            db_issue_ext.qa_contact = self.__return_unicode(issue.qa_contact)
-            db_issue_ext.estimated_time = self.__return_unicode(issue.estimated_time)
-            db_issue_ext.remaining_time = self.__return_unicode(issue.remaining_time)
-            db_issue_ext.actual_time = self.__return_unicode(issue.actual_time)
-            db_issue_ext.deadline = issue.deadline
-            db_issue_ext.keywords = self.__return_unicode(issue.keywords)
-            db_issue_ext.group = self.__return_unicode(issue.group)
-            db_issue_ext.flag = self.__return_unicode(issue.flag)
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBBugzillaIssueExt,
+                                  DBBugzillaIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBBugzillaIssueExt(issue_id)
+
+        db_issue_ext.alias = self.__return_unicode(issue.alias)
+        db_issue_ext.delta_ts = issue.delta_ts
+        db_issue_ext.reporter_accessible = issue.reporter_accessible
+        db_issue_ext.cclist_accessible = issue.cclist_accessible
+        db_issue_ext.classification_id = issue.classification_id
+        db_issue_ext.classification = self.__return_unicode(issue.classification)
+        db_issue_ext.product = self.__return_unicode(issue.product)
+        db_issue_ext.component = self.__return_unicode(issue.component)
+        db_issue_ext.version = self.__return_unicode(issue.version)
+        db_issue_ext.rep_platform = self.__return_unicode(issue.rep_platform)
+        db_issue_ext.op_sys = self.__return_unicode(issue.op_sys)
+        db_issue_ext.dup_id = issue.dup_id
+        db_issue_ext.bug_file_loc = self.__return_unicode(issue.bug_file_loc)
+        db_issue_ext.status_whiteboard = self.__return_unicode(issue.status_whiteboard)
+        db_issue_ext.target_milestone = self.__return_unicode(issue.target_milestone)
+        db_issue_ext.votes = self.__return_int(issue.votes)
+        db_issue_ext.everconfirmed = self.__return_unicode(issue.everconfirmed)
+        db_issue_ext.qa_contact = self.__return_unicode(issue.qa_contact)
+        db_issue_ext.estimated_time = self.__return_unicode(issue.estimated_time)
+        db_issue_ext.remaining_time = self.__return_unicode(issue.remaining_time)
+        db_issue_ext.actual_time = self.__return_unicode(issue.actual_time)
+        db_issue_ext.deadline = issue.deadline
+        db_issue_ext.keywords = self.__return_unicode(issue.keywords)
+        db_issue_ext.group = self.__return_unicode(issue.group)
+        db_issue_ext.flag = self.__return_unicode(issue.flag)
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def __return_int(self, str):
         """
@@ -247,21 +418,162 @@ class DBBugzillaBackend(DBBackend):
         delta_ts = db_issue_ext.delta_ts
         return delta_ts
 
+    def get_issues_activity_dates(self, store, trk_id, issues):
+        """
+        Return the delta_ts and the date of the last change stored
+        for each one of the given bugs.
+
+        @param store: database connection
+        @type store: L{storm.locals.Store}
+        @param trk_id: identifier of the tracker
+        @type trk_id: C{int}
+        @param issues: bug identifiers
+        @type issues: C{list}
+
+        @return: pairs of (delta_ts, last change date) by bug
+            identifier; the date of the last change is C{None}
+            when the bug has no changes
+        @rtype: C{dict}
+        """
+        issues = [unicode(issue) for issue in issues]
+        if not issues:
+            return {}
+
+        result = store.find((DBIssue.issue, DBBugzillaIssueExt.delta_ts),
+                            DBBugzillaIssueExt.issue_id == DBIssue.id,
+                            DBIssue.tracker_id == trk_id,
+                            DBIssue.issue.is_in(issues))
+        dates = dict([(issue, (delta_ts, None)) for issue, delta_ts in result])
+
+        result = store.find((DBIssue.issue, Max(DBChange.changed_on)),
+                            DBChange.issue_id == DBIssue.id,
+                            DBIssue.tracker_id == trk_id,
+                            DBIssue.issue.is_in(issues))
+        for issue, changed_on in result.group_by(DBIssue.issue):
+            # SQLite returns the aggregated dates as strings
+            if isinstance(changed_on, basestring):
+                changed_on = parse(changed_on)
+            if issue in dates:
+                dates[issue] = (dates[issue][0], changed_on)
+
+        return dates
 
-class SoupHtmlParser():
+    def get_windows(self, store, trk_id):
+        """
+        Return the windows of modification dates completely retrieved
+        from the tracker, sorted by their starting date.
+
+        @param store: database connection
+        @type store: L{storm.locals.Store}
+        @param trk_id: identifier of the tracker
+        @type trk_id: C{int}
+
+        @return: pairs of (from, to) dates
+        @rtype: C{list}
+        """
+        result = store.find((DBBugzillaWindow.date_from, DBBugzillaWindow.date_to),
+                            DBBugzillaWindow.tracker_id == trk_id)
+        return list(result.order_by(DBBugzillaWindow.date_from))
+
+    def insert_window(self, store, trk_id, date_from, date_to):
+        """
+        Record the window of modification dates as completely
+        retrieved from the tracker.
+
+        @param store: database connection
+        @type store: L{storm.locals.Store}
+        @param trk_id: identifier of the tracker
+        @type trk_id: C{int}
+        @param date_from: first modification date of the window
+        @type date_from: L{datetime.datetime}
+        @param date_to: last modification date of the window
+        @type date_to: L{datetime.datetime}
+        """
+        store.add(DBBugzillaWindow(date_from, date_to, trk_id))
+        store.flush()
+
+    def merge_windows(self, store, trk_id):
+        """
+        Replace the windows of the tracker with a single window from
+        the first to the last date. It must be called only when there
+        are no gaps between the windows.
+
+        @param store: database connection
+        @type store: L{storm.locals.Store}
+        @param trk_id: identifier of the tracker
+        @type trk_id: C{int}
+        """
+        windows = self.get_windows(store, trk_id)
+        if len(windows) < 2:
+            return
+
+        store.find(DBBugzillaWindow,
+                   DBBugzillaWindow.tracker_id == trk_id).remove()
+        date_to = max([date_to for date_from, date_to in windows])
+        store.add(DBBugzillaWindow(windows[0][0], date_to, trk_id))
+        store.flush()
+
+
+class HtmlElement(object):
+    """
+    Element of an HTML document. Its contents are a list of
+    strings and other elements.
+    """
+
+    __slots__ = ('name', 'contents')
+
+    def __init__(self, name):
+        self.name = name
+        self.contents = []
+
+    def find_all(self, name):
+        """
+        Return the descendants with the given tag name,
+        in document order.
+        """
+        found = []
+        for child in self.contents:
+            if isinstance(child, HtmlElement):
+                if child.name == name:
+                    found.append(child)
+                found.extend(child.find_all(name))
+        return found
+
+    def get_text(self):
+        """
+        Return the stripped strings of the descendants, joined.
+        """
+        strings = []
+        for child in self.contents:
+            if isinstance(child, HtmlElement):
+                strings.append(child.get_text())
+            else:
+                strings.append(child.strip())
+        return u''.join(strings)
+
+    def flatten(self, names):
+        """
+        Replace the descendants with any of the given tag names
+        by their text.
+        """
+        for i, child in enumerate(self.contents):
+            if not isinstance(child, HtmlElement):
+                continue
+            if child.name in names:
+                self.contents[i] = child.get_text()
+            else:
+                child.flatten(names)
+
+
+class BugzillaChangesParser:
     """
-    Parses HTML to get 5 different fields from a table
+    Base class of the parsers of the changes of the issues.
     """
 
-    field_map = {}
+    field_map = {'Status': u'status', 'Resolution': u'resolution'}
     status_map = {}
     resolution_map = {}
 
-    def __init__(self, html, idBug):
-        self.html = html
-        self.idBug = idBug
-        self.field_map = {'Status': u'status', 'Resolution': u'resolution'}
-
     def sanityze_change(self, field, old_value, new_value):
         field = self.field_map.get(field, field)
         old_value = old_value.strip()
@@ -275,40 +587,196 @@ class SoupHtmlParser():
 
         return field, old_value, new_value
 
-    def remove_comments(self, soup):
-        cmts = soup.findAll(text=lambda text: isinstance(text, BFComment))
-        [comment.extract() for comment in cmts]
+
+class BugzillaActivityParser(BugzillaChangesParser, HTMLParser.HTMLParser):
+    """
+    Parses the HTML of the activity page of an issue to get the changes
+    listed on the table of 5 columns (who, when, what, removed, added).
+
+    Only tables are kept in memory while the page is parsed. Text is
+    split, whitespace collapsed and tags nested as BeautifulSoup 3 did,
+    so the changes are the same ones the parser based on it returned.
+    """
+
+    # Tags without contents
+    VOID_TAGS = ('br', 'hr', 'input', 'img', 'meta',
+                 'spacer', 'link', 'frame', 'base', 'col')
+
+    # Tags that can contain tags of their same type, with the
+    # tags that stop looking for an open one
+    NESTABLE_TAGS = {'span': [], 'font': [], 'q': [], 'object': [],
+                     'bdo': [], 'sub': [], 'sup': [], 'center': [],
+                     'blockquote': [], 'div': [], 'fieldset': [],
+                     'ins': [], 'del': [],
+                     'ol': [], 'ul': [], 'li': ['ul', 'ol'],
+                     'dl': [], 'dd': ['dl'], 'dt': ['dl'],
+                     'table': [], 'tr': ['table', 'tbody', 'tfoot', 'thead'],
+                     'td': ['tr'], 'th': ['tr'], 'thead': ['table'],
+                     'tbody': ['table'], 'tfoot': ['table']}
+
+    # Tags that stop looking for an open tag of the same type
+    RESET_NESTING_TAGS = ('blockquote', 'div', 'fieldset', 'ins', 'del',
+                          'noscript', 'address', 'form', 'p', 'pre',
+                          'ol', 'ul', 'li', 'dl', 'dd', 'dt',
+                          'table', 'tr', 'td', 'th', 'thead', 'tbody', 'tfoot')
+
+    PRESERVE_WHITESPACE_TAGS = ('pre', 'textarea')
+
+    # Tags replaced by their text in the table of changes
+    REMOVE_TAGS = ('a', 'span', 'i')
+
+    ASCII_SPACES = {9: None, 10: None, 12: None, 13: None, 32: None}
+
+    DATE_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2})(?::(\d{2}))?(?:\s|$)')
+
+    def __init__(self, html, idBug):
+        HTMLParser.HTMLParser.__init__(self)
+        if isinstance(html, str):
+            try:
+                html = html.decode('utf-8')
+            except UnicodeDecodeError:
+                html = html.decode('windows-1252', 'replace')
+        self.html = html
+        self.idBug = idBug
+
+        # Open tags, with their elements when they are kept
+        self.stack = []
+        self.tables = []
+        self.data = []
 
     def _to_datetime_with_secs(self, str_date):
         """
         Returns datetime object from string
         """
+        # Bugzilla dates start with 'YYYY-MM-DD HH:MM[:SS]'; time
+        # zones are discarded, so the rest can be ignored
+        m = self.DATE_RE.match(str_date)
+        if m:
+            return datetime(*[int(v or 0) for v in m.groups()])
         return parse(str_date).replace(tzinfo=None)
 
-    def parse_changes(self):
-        soup = BeautifulSoup(self.html)
-        self.remove_comments(soup)
-        remove_tags = ['a', 'span', 'i']
-        changes = []
-        tables = soup.findAll('table')
+    def handle_starttag(self, tag, attrs):
+        self._end_data()
+
+        void = tag in self.VOID_TAGS
+        if not void:
+            self._smart_pop(tag)
+
+        parent = self.stack[-1][1] if self.stack else None
+        if parent is not None or tag == 'table':
+            element = HtmlElement(tag)
+            if parent is not None:
+                parent.contents.append(element)
+            if tag == 'table':
+                self.tables.append(element)
+        else:
+            element = None
+
+        if not void:
+            self.stack.append((tag, element))
+
+    def handle_startendtag(self, tag, attrs):
+        # As in BeautifulSoup, only void tags are closed
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self._end_data()
+        self._pop_to_tag(tag)
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def handle_entityref(self, name):
+        # Entities are not converted
+        self.data.append(u'&%s;' % name)
 
-        # We look for the first table with 5 cols
+    def handle_charref(self, name):
+        self.data.append(u'&#%s;' % name)
+
+    def handle_comment(self, data):
+        # Comments are removed, but split the text around them
+        self._end_data()
+
+    def handle_decl(self, decl):
+        self._end_data()
+
+    def handle_pi(self, data):
+        self._end_data()
+
+    def unknown_decl(self, data):
+        self._end_data()
+
+    def close(self):
+        HTMLParser.HTMLParser.close(self)
+        self._end_data()
+
+    def _end_data(self):
+        if not self.data:
+            return
+
+        data = u''.join(self.data)
+        self.data = []
+
+        element = self.stack[-1][1] if self.stack else None
+        if element is None:
+            return
+
+        if not data.translate(self.ASCII_SPACES):
+            names = set(name for name, e in self.stack)
+            if not names.intersection(self.PRESERVE_WHITESPACE_TAGS):
+                data = u'\n' if u'\n' in data else u' '
+        element.contents.append(data)
+
+    def _pop_to_tag(self, name, inclusive=True):
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == name:
+                del self.stack[i if inclusive else i + 1:]
+                return
+
+    def _smart_pop(self, name):
+        # Close the open tags that cannot contain the new one
+        triggers = self.NESTABLE_TAGS.get(name)
+        reset = name in self.RESET_NESTING_TAGS
+
+        for i in range(len(self.stack) - 1, -1, -1):
+            open_name = self.stack[i][0]
+            if triggers is None and open_name == name:
+                self._pop_to_tag(name)
+                return
+            if (triggers is not None and open_name in triggers) \
+                    or (triggers is None and reset
+                        and open_name in self.RESET_NESTING_TAGS):
+                self._pop_to_tag(open_name, inclusive=False)
+                return
+
+    def _get_table(self):
+        # We look for the first table with 5 cols; when there is none,
+        # the last table of the page is returned
         table = None
-        for table in tables:
-            if len(table.tr.findAll('th', recursive=False)) == 5:
-                try:
-                    for i in table.findAll(remove_tags):
-                        i.replaceWith(i.text)
-                except:
-                    printerr("error removing HTML tags")
+        for table in self.tables:
+            rows = table.find_all('tr')
+            if not rows:
+                continue
+            ths = [c for c in rows[0].contents
+                   if isinstance(c, HtmlElement) and c.name == 'th']
+            if len(ths) == 5:
+                table.flatten(self.REMOVE_TAGS)
                 break
+        return table
+
+    def parse_changes(self):
+        self.feed(self.html)
+        self.close()
+
+        changes = []
+        table = self._get_table()
 
         if table is None:
             return changes
 
-        rows = list(table.findAll('tr'))
+        rows = table.find_all('tr')
         for row in rows[1:]:
-            cols = list(row.findAll('td'))
+            cols = row.find_all('td')
             if len(cols) == 5:
                 person_email = cols[0].contents[0].strip()
                 person_email = unicode(person_email.replace('&#64;', '@'))
@@ -344,6 +812,57 @@ class SoupHtmlParser():
         return changes
 
 
+class BugzillaHistoryParser(BugzillaChangesParser):
+    """
+    Parses the history of an issue returned by the Bug.history method
+    of the webservice. Fields are named as on the activity pages and
+    dates, returned in UTC, are moved to the time zone of the tracker.
+    The offset of each date is the one the time zone had on that date,
+    so dates on both sides of a daylight saving time change match the
+    ones shown on the activity pages.
+    """
+
+    def __init__(self, history, field_names=None, tzinfo=None):
+        """
+        @param history: changes of the issue, grouped by date and author
+        @type history: C{list} of C{dict}
+        @param field_names: display names of the fields by their names
+        @type field_names: C{dict}
+        @param tzinfo: time zone of the tracker; dates are left
+            in UTC when not given
+        @type tzinfo: L{datetime.tzinfo}
+        """
+        self.history = history
+        self.field_names = field_names or {}
+        self.tzinfo = tzinfo
+
+    def parse_changes(self):
+        changes = []
+
+        for entry in self.history:
+            person_email = unicode(entry['who'])
+            date = entry['when']
+            if self.tzinfo is not None:
+                date = date.replace(tzinfo=tz.tzutc())
+                date = date.astimezone(self.tzinfo).replace(tzinfo=None)
+
+            for c in entry['changes']:
+                name = c['field_name']
+                field = unicode(self.field_names.get(name, name))
+                if c.get('attachment_id'):
+                    field = u"Attachment #%s %s" % (c['attachment_id'], field)
+
+                field, removed, added = self.sanityze_change(field,
+                                                             unicode(c['removed']),
+                                                             unicode(c['added']))
+                by = People(person_email)
+                by.set_email(person_email)
+                change = Change(field, removed, added, by, date)
+                changes.append(change)
+
+        return changes
+
+
 class BugzillaIssue(Issue):
     """
     Ad-hoc Issue extension for bugzilla's issue
@@ -353,6 +872,7 @@ class BugzillaIssue(Issue):
                        submitted_on)
         self.alias = None
         self.delta_ts = None
+        self.utc_offset = None
         self.reporter_accessible = None
         self.cclist_accessible = None
         self.classification_id = None
@@ -399,6 +919,19 @@ class BugzillaIssue(Issue):
 
         self.delta_ts = delta_ts
 
+    def set_utc_offset(self, utc_offset):
+        """
+        Set the offset of the time zone of the dates of the issue
+
+        @param utc_offset: offset of the time zone; C{None} when unknown
+        @type utc_offset: L{datetime.timedelta}
+        """
+        if utc_offset is not None and not isinstance(utc_offset, timedelta):
+            raise ValueError('Parameter "utc_offset" should be a %s instance. %s given.' %
+                             ('timedelta', utc_offset.__class__.__name__))
+
+        self.utc_offset = utc_offset
+
     def set_reporter_accessible(self, reporter_accessible):
         """
         Set the reporter_accesible of the issue
@@ -644,12 +1177,17 @@ class BugsHandler(xml.sax.handler.ContentHandler):
     https://bugzilla.libresoft.es/bugzilla.dtd
     """
 
-    def __init__(self):
+    def __init__(self, on_issue=None):
         """
+        @param on_issue: function called with each issue as soon as
+            it is parsed; when not given, issues are collected and
+            returned by L{get_issues}
+        @type on_issue: C{function}
         """
         # TBD attachments and flag, see bugzilla.dtd
         #self.issues_data = {}
         self.issues_data = []
+        self.on_issue = on_issue
         self.init_bug()
 
     def get_issues(self):
@@ -771,17 +1309,17 @@ class BugsHandler(xml.sax.handler.ContentHandler):
 
     def endElement(self, name):
         if name in self.atags:
-            aux = string.join(self.interestData)
+            aux = u''.join(self.interestData)
             if not self.atags[name]:
                 #delta_ts could be overwritten by delta_ts of attachment
                 self.atags[name] = unicode(aux)
             self.tag_name = None
         elif name in self.long_desc_tags:
-            aux = string.join(self.interestData)
+            aux = u''.join(self.interestData)
             self.long_desc_tags[name] = unicode(aux)
             self.tag_name = None
         elif name in self.btags:
-            aux = string.join(self.interestData)
+            aux = u''.join(self.interestData)
             self.btags[name].append(unicode(aux))
             self.tag_name = None
         elif name in self.ctags:
@@ -794,7 +1332,11 @@ class BugsHandler(xml.sax.handler.ContentHandler):
             self.tag_name = None
         elif name == "bug":
             #self.issues_data[self.atags["bug_id"]] = self.get_issue()
-            self.issues_data.append(self.get_issue())
+            issue = self.get_issue()
+            if self.on_issue:
+                self.on_issue(issue)
+            else:
+                self.issues_data.append(issue)
 
     def print_debug_data(self):
         printdbg("")
@@ -883,7 +1425,9 @@ class BugsHandler(xml.sax.handler.ContentHandler):
         issue.set_resolution(self.atags["resolution"])
 
         issue.set_alias(self.atags["alias"])
-        issue.set_delta_ts(self._to_datetime_with_secs(self.atags["delta_ts"]))
+        delta_ts = parse(self.atags["delta_ts"])
+        issue.set_delta_ts(delta_ts.replace(tzinfo=None))
+        issue.set_utc_offset(delta_ts.utcoffset())
         issue.set_reporter_accessible(self.atags["reporter_accessible"])
         issue.set_cclist_accessible(self.atags["cclist_accessible"])
         issue.set_classification_id(self.atags["classification_id"])
@@ -916,8 +1460,66 @@ class BugsHandler(xml.sax.handler.ContentHandler):
 
         return issue
 
-# length of hibernation in seconds
-HIBERNATION_LENGTH = 100
+
+
+class BuglistLimitError(Exception):
+    """Raised when the limit of the buglists cannot be found out"""
+
+
+class BuglistWindow:
+    """
+    Range of modification dates of the bugs to retrieve, queried
+    with the chfieldfrom and chfieldto parameters of a buglist.
+
+    @ivar date_from: first modification date
+    @type date_from: L{datetime.datetime}
+    @ivar date_to: last modification date; C{None} means up to now
+    @type date_to: L{datetime.datetime}
+    @ivar ids: identifiers of the bugs found on the window
+    @type ids: C{list}
+    @ivar last_ts: last modification date of the bugs found
+    @type last_ts: L{datetime.datetime}
+    @ivar truncated: whether the buglist was cut by the limit of
+        the server
+    @type truncated: C{bool}
+    """
+
+    def __init__(self, date_from, date_to=None):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.ids = []
+        self.last_ts = None
+        self.truncated = False
+
+    def __str__(self):
+        date_to = self.date_to and str(self.date_to) or 'now'
+        return "%s - %s" % (self.date_from, date_to)
+
+    def split(self, resolution):
+        """
+        Split the window into two halves sharing their middle date.
+        Open windows are split by the middle of their dates found.
+
+        @param resolution: minimum length of a window
+        @type resolution: L{datetime.timedelta}
+
+        @return: both halves or C{None} when the window is too short
+        @rtype: C{tuple}
+        """
+        date_to = self.date_to or self.last_ts
+        if date_to is None:
+            return None
+
+        middle = self.date_from + (date_to - self.date_from) / 2
+        if resolution >= timedelta(days=1):
+            middle = datetime(middle.year, middle.month, middle.day)
+        else:
+            middle = middle.replace(microsecond=0)
+
+        if middle - self.date_from < resolution or \
+                (self.date_to is not None and self.date_to - middle < resolution):
+            return None
+        return BuglistWindow(self.date_from, middle), BuglistWindow(middle, self.date_to)
 
 
 class BGBackend(Backend):
@@ -929,7 +1531,13 @@ class BGBackend(Backend):
         self.cookies = {}
         self.version = None
         self.tracker = None
-        self.retrieved = {}  # retrieved issues on this run
+        self.retrieved = 0  # retrieved issues on this run
+        self.webservice = False
+        self.field_names = None
+        self.tzinfo = None
+        # Limit of the buglists; when it is not given, it is found out
+        # from the first buglist cut by the server
+        self.max_results = getattr(Config, 'bg_max_results', None)
 
         try:
             self.backend_password = Config.backend_password
@@ -940,7 +1548,8 @@ class BGBackend(Backend):
             self.backend_password = None
             self.backend_user = None
 
-        self.bugsdb = get_database(DBBugzillaBackend())
+        self.backend = DBBugzillaBackend()
+        self.bugsdb = get_database(self.backend)
 
     def run(self):
         printout("Running Bicho with delay of %s seconds" % str(self.delay))
@@ -949,12 +1558,22 @@ class BGBackend(Backend):
         self._set_version()
         self._set_tracker()
 
-        self._process_issues()
+        self.webservice = self._use_webservice()
+        if self.webservice:
+            printdbg("Activity of the issues will be retrieved using the webservice")
+
+        self.writer = DBWriter(self.bugsdb)
+        try:
+            with self.writer:
+                self._process_issues()
+        except BuglistLimitError, e:
+            printerr("Error: %s" % e)
+            sys.exit(2)
 
         if not self.retrieved:
             printout("No issues found. Did you provide the correct url?")
         else:
-            printout("Done. %d issues retrieved" % len(self.retrieved))
+            printout("Done. %d issues retrieved" % self.retrieved)
 
     def _login(self):
         """
@@ -964,22 +1583,13 @@ class BGBackend(Backend):
             printdbg("No account data provided. Not logged in bugzilla")
             return
 
-        import cookielib
-
-        cookie_j = cookielib.CookieJar()
-        cookie_h = urllib2.HTTPCookieProcessor(cookie_j)
-
         url = self._get_login_url(self.url)
         values = {'Bugzilla_login': self.backend_user,
                   'Bugzilla_password': self.backend_password}
 
-        opener = urllib2.build_opener(cookie_h)
-        urllib2.install_opener(opener)
-        data = urllib.urlencode(values)
-        request = urllib2.Request(url, data)
-        urllib2.urlopen(request)
-        for i, c in enumerate(cookie_j):
-            self.cookies[c.name] = c.value
+        # Session cookies are kept by the HTTP client
+        http.post(url, data=values)
+        self.cookies = http.get_client().get_cookies()
 
         printout("Logged in bugzilla as %s" % self.backend_user)
         printdbg("Bugzilla session cookies: %s" % self.cookies)
@@ -1004,9 +1614,7 @@ class BGBackend(Backend):
         parser = xml.sax.make_parser()
         parser.setContentHandler(handler)
         try:
-            cleaned_contents = ''. \
-                join(c for c in contents if valid_XML_char_ordinal(ord(c)))
-            parser.feed(cleaned_contents)
+            parser.feed(remove_invalid_XML_chars(contents))
         except Exception:
             printerr("Error parsing URL %s" % info_url)
             raise
@@ -1031,36 +1639,102 @@ class BGBackend(Backend):
             url = self._get_domain(self.url)
             self._retrieve_issues(ids, url, self.tracker.id)
         else:
-            i = 0
-            max_rounds = 50  # 50*10000
             url = self._get_domain(self.url)
-            last_date, next_date = self._get_last_and_next_dates()
-
-            # Some bugzillas limit the number of results that a query can return.
-            # Due to this, bicho will search for new issues/changes until there
-            # are no more new ones.
-            ids = self._retrieve_issues_ids(self.url, self.version, next_date)
-
-            while(ids):
-                if (i >= max_rounds):
-                    break
-                printout("Round #%d - Total issues to retrieve: %d" % (i, len(ids)))
-                self._retrieve_issues(ids, url, self.tracker.id)
-                i += 1
-                # Search new ids, but first, we have to check whether they are
-                # already stored or not
-                last_date, next_date = self._get_last_and_next_dates()
-                ids = self._retrieve_issues_ids(self.url, self.version, last_date)
-                # If there aren't new issues from the same date, ask for a new one
-                if not ids:
-                    printdbg("No issues found for date %s. Trying with %s" % (last_date, next_date))
-                    ids = self._retrieve_issues_ids(self.url, self.version, next_date)
-
-            if i > 0:
-                printout("No more issues to retrieve")
-
-    def _retrieve_issues_ids(self, base_url, version, from_date, not_retrieved=True):
-        url = self._get_issues_list_url(base_url, version, from_date)
+            complete = True
+
+            for window in self._plan_windows():
+                printout("Window %s - Total issues to retrieve: %d"
+                         % (window, len(window.ids)))
+                self._retrieve_issues(list(window.ids), url, self.tracker.id)
+
+                if window.truncated:
+                    complete = False
+                else:
+                    self._complete_window(window)
+
+            # Once there are no gaps, windows are kept as a single one
+            if complete:
+                self.bugsdb.write(self.backend.merge_windows, self.tracker.id)
+                self.bugsdb.commit()
+
+            printout("No more issues to retrieve")
+
+    def _plan_windows(self):
+        """
+        Split the modification dates not retrieved yet into windows
+        whose buglists have less bugs than the limit of the server.
+
+        Windows are bisected until their buglists are below the limit.
+        Buglists of the windows pending to split are requested at once
+        by the pool, and each window is returned as soon as it is
+        planned, so bugs can be retrieved while planning goes on.
+
+        @return: iterator over the windows
+        @rtype: C{generator} of L{BuglistWindow}
+        """
+        if self.version in ("3.2.3", "3.2.2"):
+            resolution = timedelta(days=1)
+        else:
+            resolution = timedelta(seconds=1)
+
+        pending = [BuglistWindow(date_from, date_to)
+                   for date_from, date_to in self._get_pending_windows()]
+
+        while pending:
+            windows = pool.imap(self._retrieve_window, pending)
+            pending = []
+
+            for window in windows:
+                if window.truncated:
+                    halves = window.split(resolution)
+                    if halves:
+                        printdbg("Window %s reached %d issues. Splitting it"
+                                 % (window, len(window.ids)))
+                        pending.extend(halves)
+                        continue
+                    printerr("Window %s reached %d issues and cannot be split. "
+                             "Some issues will not be retrieved"
+                             % (window, len(window.ids)))
+                yield window
+
+    def _get_pending_windows(self):
+        """
+        Return the ranges of modification dates not retrieved yet:
+        the gaps between the windows stored and the range from the
+        last stored window to now.
+
+        @return: pairs of (from, to) dates; the last one is open
+        @rtype: C{list}
+        """
+        windows = self.backend.get_windows(self.bugsdb.store, self.tracker.id)
+
+        if not windows:
+            # Trackers retrieved before windows were stored go on
+            # from the last modification date
+            last_ts = self.bugsdb.get_last_modification_date(tracker_id=self.tracker.id)
+            return [(last_ts or EPOCH, None)]
+
+        gaps = []
+        last_to = windows[0][0]
+        for date_from, date_to in windows:
+            if date_from > last_to:
+                gaps.append((last_to, date_from))
+            last_to = max(last_to, date_to)
+        gaps.append((last_to, None))
+        return gaps
+
+    def _retrieve_window(self, window):
+        """
+        Fill the window with the bugs of its buglist.
+
+        @param window: window to retrieve
+        @type window: L{BuglistWindow}
+
+        @return: the same window
+        @rtype: L{BuglistWindow}
+        """
+        url = self._get_issues_list_url(self.url, self.version,
+                                        window.date_from, window.date_to)
         printdbg("Getting bugzilla issues from %s" % url)
 
         f = self._urlopen_auth(url)
@@ -1069,21 +1743,91 @@ class BGBackend(Backend):
         # '"' character. Easier using split.
         # Moreover, we drop the first line of the CSV because it contains
         # the headers
-        ids = []
+        last_ts = None
         csv = f.read().split('\n')[1:]
         for line in csv:
+            if not line:
+                continue
             # 0: bug_id, 7: changeddate
             values = line.split(',')
-            id = values[0]
+            window.ids.append(values[0])
             change_ts = values[7].strip('"')
+            if change_ts > last_ts:
+                last_ts = change_ts
 
-            # Filter issues already retrieved
-            if not_retrieved:
-                if (not id in self.retrieved) or (self.retrieved[id] != change_ts):
-                    ids.append(id)
-            else:
-                ids.append(id)
-        return ids
+        if last_ts:
+            window.last_ts = parse(last_ts)
+        window.truncated = self._is_truncated(window)
+        return window
+
+    def _is_truncated(self, window):
+        """
+        Check whether the buglist of the window was cut by the limit
+        of the server.
+
+        When the limit is not known, the bug one row past the buglist
+        is requested. If there is one, the buglist was cut and its
+        length is taken as the limit for the next windows.
+
+        @param window: window retrieved
+        @type window: L{BuglistWindow}
+
+        @return: C{True} if there are more bugs on the window
+        @rtype: C{bool}
+
+        @raise BuglistLimitError: when the limit is not known and the
+            server does not support offsets.
+        """
+        nbugs = len(window.ids)
+
+        if self.max_results:
+            if nbugs >= self.max_results:
+                return True
+            # Limits found out from the server are exact
+            if nbugs and nbugs % ROUND_SEARCH_RESULTS == 0 and \
+                    getattr(Config, 'bg_max_results', None):
+                printout("Warning: window %s returned %d issues. If the "
+                         "server limits its buglists to %d issues, set "
+                         "--bg-max-results to that limit"
+                         % (window, nbugs, nbugs))
+            return False
+
+        if not nbugs:
+            return False
+
+        url = self._get_issues_list_url(self.url, self.version,
+                                        window.date_from, window.date_to,
+                                        limit=1, offset=nbugs)
+        printdbg("Checking whether there are more bugs on %s" % url)
+
+        lines = [line for line in self._urlopen_auth(url).read().split('\n')[1:]
+                 if line]
+        if not lines:
+            return False
+
+        bug_id = lines[0].split(',')[0]
+        if bug_id in window.ids:
+            # The offset was ignored and the first bug returned again
+            raise BuglistLimitError("The server does not support offsets "
+                                    "in buglists, so their limit cannot "
+                                    "be found out. Set it with "
+                                    "--bg-max-results")
+
+        printdbg("Buglists of the server are limited to %d issues" % nbugs)
+        self.max_results = nbugs
+        return True
+
+    def _complete_window(self, window):
+        """
+        Store the window as retrieved, once its bugs are stored.
+        Open windows are closed on the last modification date found.
+        """
+        self.writer.flush()
+
+        date_to = window.date_to or window.last_ts or window.date_from
+        self.bugsdb.write(self.backend.insert_window, self.tracker.id,
+                          window.date_from, date_to)
+        self.bugsdb.commit()
 
     def _retrieve_issues(self, ids, base_url, trk_id):
         # We want to use pop() to get the oldest first so we must reverse the
@@ -1098,54 +1842,224 @@ class BGBackend(Backend):
             url = self._get_issues_info_url(base_url, query_issues)
             printdbg("Issues to retrieve from: %s" % url)
 
-            handler = BugsHandler()
+            # Dates of the bugs already stored, to fetch only the
+            # activity of those that changed since then
+            self.writer.flush()
+            stored = self.bugsdb.get_issues_activity_dates(trk_id, query_issues)
+
+            # Each issue is emitted as soon as it is parsed and its
+            # activity is fetched by the pool while parsing goes on
+            fetched = []
+            modified = []
+            activity = {}
+            fetch_activity = lambda issue: self._retrieve_issue_activity(base_url, issue.issue)
+
+            def on_issue(issue):
+                delta_ts, last_change = stored.get(unicode(issue.issue), (None, None))
+                if delta_ts is not None and delta_ts == issue.delta_ts:
+                    printdbg("Issue #%s not modified. Activity not retrieved"
+                             % issue.issue)
+                else:
+                    modified.append(issue)
+                    # The webservice returns the activity of the whole
+                    # batch at once, once it is parsed
+                    if not self.webservice:
+                        activity[issue.issue] = pool.get_pool().submit(fetch_activity, issue)
+                fetched.append((issue, last_change))
+
+            handler = BugsHandler(on_issue)
             self._safe_xml_parse(url, handler)
-            issues = handler.get_issues()
 
-            # Retrieving changes
-            for issue in issues:
-                changes = self._retrieve_issue_activity(base_url, issue.issue)
-                for c in changes:
+            history = {}
+            if self.webservice and modified:
+                history = self._retrieve_history(base_url, modified)
+                if history is None:
+                    history = {}
+                    for issue in modified:
+                        activity[issue.issue] = pool.get_pool().submit(fetch_activity, issue)
+
+            # Retrieving changes, in the order of the issues
+            for issue, last_change in fetched:
+                if issue.issue in history:
+                    changes = history[issue.issue]
+                elif issue.issue in activity:
+                    changes = activity[issue.issue].get()
+                else:
+                    changes = []
+
+                for c in self._new_changes(changes, last_change):
                     issue.add_change(c)
 
                 # We store here the issue once the complete retrieval
                 # for each bug is done
                 self._store_issue(issue, trk_id)
-                self.retrieved[issue.issue] = self._timestamp_to_str(issue.delta_ts)
-
-                time.sleep(self.delay)
+                self.retrieved += 1
 
     def _retrieve_issue_activity(self, base_url, id):
         activity_url = self._get_issue_activity_url(base_url, id)
         printdbg("Retrieving activity of issue #%s from %s"
                  % (id, activity_url))
         data = self._urlopen_auth(activity_url).read()
-        parser = SoupHtmlParser(data, id)
+        parser = BugzillaActivityParser(data, id)
         changes = parser.parse_changes()
         return changes
 
-    def _store_issue(self, issue, trk_id):
+    def _retrieve_history(self, base_url, issues):
+        """
+        Retrieve the changes of the given issues with a single call to
+        the Bug.history method of the webservice.
+
+        When the webservice fails, it is not used anymore and C{None}
+        is returned, so the activity pages are retrieved instead.
+
+        @param base_url: URL of the tracker
+        @type base_url: C{str}
+        @param issues: issues to retrieve
+        @type issues: C{list} of L{BugzillaIssue}
+
+        @return: changes by issue identifier
+        @rtype: C{dict}
+        """
+        if self.field_names is None:
+            self.field_names = self._retrieve_field_names(base_url)
+            self.tzinfo = self._retrieve_timezone(base_url)
+
+        ids = [issue.issue for issue in issues]
+        printdbg("Retrieving activity of %d issues using the webservice"
+                 % len(ids))
+
         try:
-            self.bugsdb.insert_issue(issue, trk_id)
-            printdbg("Issue #%s stored " % issue.issue)
-        except UnicodeEncodeError:
-            printerr("UnicodeEncodeError: the issue %s couldn't be stored"
-                     % issue.issue)
+            result = self._call_webservice(base_url, 'Bug.history', {'ids': ids})
+        except (http.HTTPError, xmlrpclib.Error, ExpatError), e:
+            printerr("Error retrieving activity using the webservice: %s" % e)
+            printout("Activity pages will be retrieved instead")
+            self.webservice = False
+            return None
+
+        offsets = dict([(issue.issue, issue.utc_offset) for issue in issues])
+
+        history = {}
+        for bug in result['bugs']:
+            id = str(bug['id'])
+            tzinfo = self.tzinfo
+            if tzinfo is None and offsets.get(id) is not None:
+                # Only the offset of the last change of the bug is known
+                offset = offsets[id]
+                tzinfo = tz.tzoffset(None, offset.days * 86400 + offset.seconds)
+            parser = BugzillaHistoryParser(bug['history'], self.field_names,
+                                           tzinfo)
+            history[id] = parser.parse_changes()
+        return history
+
+    def _retrieve_field_names(self, base_url):
+        """
+        Return the names of the fields shown on the activity pages
+        by the names used in the webservice.
+        """
+        try:
+            result = self._call_webservice(base_url, 'Bug.fields',
+                                           {'include_fields': ['name', 'display_name']})
+        except (http.HTTPError, xmlrpclib.Error, ExpatError), e:
+            printdbg("Error retrieving the names of the fields: %s" % e)
+            return {}
+
+        return dict([(field['name'], field['display_name'])
+                     for field in result['fields']])
 
-    def _get_last_and_next_dates(self):
-        last_ts = self.bugsdb.get_last_modification_date(tracker_id=self.tracker.id)
+    def _retrieve_timezone(self, base_url):
+        """
+        Return the time zone of the tracker, given on the configuration
+        or, by versions older than 3.6, by the webservice. When it is
+        unknown, C{None} is returned.
+
+        @rtype: L{datetime.tzinfo}
+        """
+        name = getattr(Config, 'bg_timezone', None)
+
+        if name is None:
+            try:
+                result = self._call_webservice(base_url, 'Bugzilla.time', {})
+                name = result.get('tz_name')
+            except (http.HTTPError, xmlrpclib.Error, ExpatError), e:
+                printdbg("Error retrieving the time zone: %s" % e)
+
+            # Newer versions always return UTC
+            if name == 'UTC':
+                name = None
+
+        tzinfo = None
+        if name is not None:
+            tzinfo = tz.gettz(name)
+            if tzinfo is None:
+                printerr("Unknown time zone %s" % name)
+
+        if tzinfo is None:
+            printout("Time zone of the tracker unknown. Changes done under "
+                     "a different daylight saving time than the last change "
+                     "of their bug could be stored with a wrong date; set "
+                     "the time zone with --bg-timezone")
+        return tzinfo
+
+    def _call_webservice(self, base_url, method, params):
+        """
+        Call a method of the XML-RPC webservice. The account, when
+        given, is sent with the parameters of the call.
+
+        @param base_url: URL of the tracker
+        @type base_url: C{str}
+        @param method: name of the method
+        @type method: C{str}
+        @param params: parameters of the method
+        @type params: C{dict}
+
+        @return: the result of the call
+        @rtype: C{dict}
+
+        @raise xmlrpclib.Fault: when the call fails.
+        """
+        params = dict(params)
+        if self.backend_user and self.backend_password:
+            params['Bugzilla_login'] = self.backend_user
+            params['Bugzilla_password'] = self.backend_password
+
+        url = self._get_webservice_url(base_url)
+        body = xmlrpclib.dumps((params,), method, encoding='utf-8')
+
+        while True:
+            try:
+                response = http.post(url, data=body,
+                                     headers={'Content-Type': 'text/xml'})
+                break
+            except (http.ConnectionError, http.Timeout), e:
+                printdbg("Bicho failed to reach the Bugzilla server")
+                printdbg("Reason: %s" % e)
+
+        result = xmlrpclib.loads(response.content, use_datetime=True)[0]
+        return result[0]
 
-        if not last_ts:
-            return None, None
-        printdbg("Last issues cached were modified on: %s" % last_ts)
+    def _use_webservice(self):
+        """
+        Whether the version of the tracker allows to retrieve the
+        activity of the issues using the webservice.
+        """
+        try:
+            major = int(self.version.split('.')[0])
+        except (AttributeError, ValueError):
+            return False
+        return major >= WEBSERVICE_VERSION
 
-        last_ts_str = self._timestamp_to_str(last_ts)
+    def _new_changes(self, changes, last_change):
+        """
+        Filter the changes already stored, which are those older than
+        the last change stored for the issue. Changes done on that
+        same date are kept; the database discards the duplicated ones.
+        """
+        if last_change is None:
+            return changes
+        return [c for c in changes if c.changed_on >= last_change]
 
-        # We add one second to the last date to avoid retrieving the same
-        # changes modified at that date.
-        next_ts = last_ts + timedelta(seconds=1)
-        next_ts_str = self._timestamp_to_str(next_ts)
-        return last_ts_str, next_ts_str
+    def _store_issue(self, issue, trk_id):
+        self.writer.insert_issue(issue, trk_id)
 
     def _healthy_url(self, url):
         if url.find('product=') == -1:
@@ -1160,29 +2074,28 @@ class BGBackend(Backend):
             url = tokens[0] + 'product=' + urllib.quote(tokens[1])
         return url
 
-    def _urlopen_auth(self, url):
+    def _urlopen_auth(self, url, stream=False):
         """
-        Opens an URL using an authenticated session
+        Opens an URL using an authenticated session. When X{stream}
+        is set, an iterator over the chunks of the body is returned
+        instead of a file-like object.
         """
         keep_trying = True
         while keep_trying:
-            if self._is_auth_session():
-                opener = urllib2.build_opener()
-                for c in self.cookies:
-                    q = str(c) + '=' + self.cookies[c]
-                    opener.addheaders.append(('Cookie', q))
             keep_trying = False
             try:
-                aux = urllib2.urlopen(url)
-            except urllib2.HTTPError as e:
+                if stream:
+                    aux = http.iter_content(url)
+                else:
+                    aux = http.urlopen(url)
+            except http.HTTPError as e:
                 printerr("The server couldn\'t fulfill the request.")
-                printerr("Error code: %s" % e.code)
-            except urllib2.URLError as e:
+                printerr("Error code: %s" % e.response.status_code)
+                raise
+            except (http.ConnectionError, http.Timeout) as e:
                 printdbg("Bicho failed to reach the Bugzilla server")
-                printdbg("Reason: %s" % e.reason)
-                printdbg("Bicho goes into hibernation for %s seconds"
-                         % HIBERNATION_LENGTH)
-                time.sleep(HIBERNATION_LENGTH)
+                printdbg("Reason: %s" % e)
+                # The rate limiter of the client waits before trying again
                 keep_trying = True
         return aux
 
@@ -1223,7 +2136,8 @@ class BGBackend(Backend):
             url = self._get_domain(base_url) + "show_bug.cgi?id=&ctype=xml"
         return url
 
-    def _get_issues_list_url(self, base_url, version, from_date=None):
+    def _get_issues_list_url(self, base_url, version, date_from, date_to=None,
+                             limit=0, offset=0):
         if '?' in base_url:
             url = base_url + '&'
         else:
@@ -1231,22 +2145,25 @@ class BGBackend(Backend):
 
         if ((version == "3.2.3") or (version == "3.2.2")):
             url = url + "order=Last+Changed&ctype=csv"
-            if from_date:
-                """
-                Firefox ITS (3.2.3) replaces %20 with %2520 that causes
-                Bicho to crash
-                """
-                day = from_date[:from_date.index(' ')]
-            else:
-                day = '1970-01-01'
-            url = url + "&chfieldfrom=" + day
+            """
+            Firefox ITS (3.2.3) replaces %20 with %2520 that causes
+            Bicho to crash
+            """
+            date_format = '%Y-%m-%d'
         else:
             url = url + "order=changeddate&ctype=csv"
-            if from_date:
-                day = from_date.replace(' ', '%20')
-            else:
-                day = '1970-01-01'
-            url = url + "&chfieldfrom=" + day
+            date_format = '%Y-%m-%d %H:%M:%S'
+
+        url = url + "&chfieldfrom=" + \
+            date_from.strftime(date_format).replace(' ', '%20')
+        if date_to:
+            url = url + "&chfieldto=" + \
+                date_to.strftime(date_format).replace(' ', '%20')
+
+        # Zero asks for the maximum number of results allowed by the server
+        url = url + "&limit=%d" % limit
+        if offset:
+            url = url + "&offset=%d" % offset
 
         return url
 
@@ -1263,39 +2180,25 @@ class BGBackend(Backend):
     def _get_issue_activity_url(self, base_url, issue_id):
         return base_url + "show_activity.cgi?id=" + issue_id
 
+    def _get_webservice_url(self, base_url):
+        return base_url + "xmlrpc.cgi"
+
     def _safe_xml_parse(self, bugs_url, handler):
-        f = self._urlopen_auth(bugs_url)
+        # The body is fed to the parser while it is read from the
+        # connection, removing invalid XML characters from each chunk
+        chunks = iter_valid_XML_chunks(self._urlopen_auth(bugs_url, stream=True))
         parser = xml.sax.make_parser()
         parser.setContentHandler(handler)
 
         try:
-            contents = f.read()
-        except Exception:
+            for chunk in chunks:
+                parser.feed(chunk)
+            parser.close()
+        except http.RequestException:
             printerr("Error retrieving URL: %s" % (bugs_url))
             raise
-
-        try:
-            parser.feed(contents)
-            parser.close()
         except Exception:
-            # Clean only the invalid XML
-            try:
-                parser2 = xml.sax.make_parser()
-                parser2.setContentHandler(handler)
-                parser2.setContentHandler(handler)
-                printdbg("Cleaning dirty XML")
-                cleaned_contents = ''. \
-                    join(c for c in contents if valid_XML_char_ordinal(ord(c)))
-                parser2.feed(cleaned_contents)
-                parser2.close()
-            except Exception:
-                printerr("Error parsing URL: %s" % (bugs_url))
-                raise
-        f.close()
-
-    def _timestamp_to_str(self, ts):
-        if not ts:
-            return None
-        return ts.strftime('%Y-%m-%d %H:%M:%S')
+            printerr("Error parsing URL: %s" % (bugs_url))
+            raise
 
 Backend.register_backend("bg", BGBackend)
@@ -24,6 +24,7 @@ from bicho.config import Config
 from bicho.backends import Backend
 from bicho.utils import create_dir, printdbg, printout, printerr
 from bicho.db.database import DBIssue, DBBackend, DBTracker, get_database
+from bicho.db.writer import DBWriter
 from bicho.common import Tracker, Issue, Comment, People, Change
 
 from dateutil.parser import parse
@@ -89,12 +90,60 @@ class DBGerritIssueExtMySQL(DBGerritIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBGerritIssueExtSQLite(DBGerritIssueExt):
+    """
+    SQLite subclass of L{DBGerritIssueExt}
+    """
+
+    # If the table is changed you need to remove old from database
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_gerrit ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     branch TEXT, \
+                     url TEXT, \
+                     change_id TEXT, \
+                     related_artifacts TEXT, \
+                     project TEXT, \
+                     mod_date DATETIME, \
+                     issue_id INTEGER NOT NULL, \
+                     open TEXT, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBGerritIssueExtPostgreSQL(DBGerritIssueExt):
+    """
+    PostgreSQL subclass of L{DBGerritIssueExt}
+    """
+
+    # If the table is changed you need to remove old from database
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_gerrit ( \
+                     id SERIAL PRIMARY KEY, \
+                     branch TEXT, \
+                     url TEXT, \
+                     change_id TEXT, \
+                     related_artifacts TEXT, \
+                     project TEXT, \
+                     mod_date TIMESTAMP, \
+                     issue_id INTEGER NOT NULL, \
+                     open TEXT, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
 class DBGerritBackend(DBBackend):
     """
     Adapter for Gerrit backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBGerritIssueExtMySQL]
+        self.SQLITE_EXT = [DBGerritIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBGerritIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -113,30 +162,26 @@ class DBGerritBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBGerritIssueExt,
-                                      DBGerritIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBGerritIssueExt(issue_id)
-                #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
-
-            db_issue_ext.branch = issue.branch
-            db_issue_ext.url = issue.url
-            db_issue_ext.change_id = issue.change_id
-            db_issue_ext.related_artifacts = issue.related_artifacts
-            db_issue_ext.project = issue.project
-            db_issue_ext.mod_date = issue.mod_date
-            db_issue_ext.open = unicode(issue.open)
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBGerritIssueExt,
+                                  DBGerritIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBGerritIssueExt(issue_id)
+            #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
+
+        db_issue_ext.branch = issue.branch
+        db_issue_ext.url = issue.url
+        db_issue_ext.change_id = issue.change_id
+        db_issue_ext.related_artifacts = issue.related_artifacts
+        db_issue_ext.project = issue.project
+        db_issue_ext.mod_date = issue.mod_date
+        db_issue_ext.open = unicode(issue.open)
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def insert_change_ext(self, store, change, change_id):
         """
@@ -352,11 +397,11 @@ class Gerrit():
         # Check with changes added from MERGED and ABANDONED comments
         query_i = "SELECT COUNT(id) FROM  "
         query_c = "SELECT COUNT(DISTINCT(issue_id)) FROM  "
-        query_i_m = query_i + 'issues WHERE status="MERGED" AND tracker_id='+str(dbtrk_id)
-        query_c_m = query_c + 'changes, issues WHERE field="status" AND new_value="MERGED"'
+        query_i_m = query_i + "issues WHERE status='MERGED' AND tracker_id="+str(dbtrk_id)
+        query_c_m = query_c + "changes, issues WHERE field='status' AND new_value='MERGED'"
         query_c_m += ' AND changes.issue_id = issues.id AND tracker_id='+str(dbtrk_id)
-        query_i_a = query_i + 'issues WHERE status="ABANDONED" AND tracker_id='+str(dbtrk_id)
-        query_c_a = query_c + 'changes, issues WHERE field="status" AND new_value="ABANDONED"'
+        query_i_a = query_i + "issues WHERE status='ABANDONED' AND tracker_id="+str(dbtrk_id)
+        query_c_a = query_c + "changes, issues WHERE field='status' AND new_value='ABANDONED'"
         query_c_a += ' AND changes.issue_id = issues.id AND tracker_id='+str(dbtrk_id)
         aux = store.execute(query_i_m)
         issues_merged = aux.get_one()[0]
@@ -603,42 +648,45 @@ class Gerrit():
 
         number_results = limit
 
-        while (number_results == limit or
-               number_results == limit + 1):  # wikimedia gerrit returns limit+1
-            # ordered by lastUpdated
-            time.sleep(self.delay)
-            tickets = self.getReviews(limit, last_item, mayor, minor)
-            number_results = 0
-
-            reviews = []
-            for entry in tickets:
-                if 'project' in entry.keys():
-                    if mayor == 2 and minor >= 9:
-                        last_item += 1
-                    else:
-                        # last_item = "001f672c00002f80";
-                        last_item = entry['sortKey']
-
-                    if (entry['lastUpdated'] < last_mod_time):
-                        break
-                    reviews.append(entry["number"])
-                    review_data = self.analyze_review(entry)
-
-                    if review_data is None:
-                        pprint.pprint("ERROR in review. Ignoring it.")
-                        continue
-
-                    # extra changes not included in gerrit changes
-                    # self.add_merged_abandoned_changes_from_comments(entry, review_data)
-                    self.add_merged_abandoned_changes(entry, review_data)
-                    self.add_uploaded_patchset_from_comments(entry, review_data)
-                    self.add_new_change(review_data)
-                    bugsdb.insert_issue(review_data, dbtrk.id)
-                    number_results += 1
-                elif 'rowCount' in entry.keys():
-                    pprint.pprint(entry)
-                    printdbg("CONTINUE FROM: " + str(last_item))
-            total_reviews = total_reviews + int(number_results)
+        writer = DBWriter(bugsdb)
+        with writer:
+            while (number_results == limit or
+                   number_results == limit + 1):  # wikimedia gerrit returns limit+1
+                # ordered by lastUpdated
+                time.sleep(self.delay)
+                tickets = self.getReviews(limit, last_item, mayor, minor)
+                number_results = 0
+
+                reviews = []
+                for entry in tickets:
+                    if 'project' in entry.keys():
+                        if mayor == 2 and minor >= 9:
+                            last_item += 1
+                        else:
+                            # last_item = "001f672c00002f80";
+                            last_item = entry['sortKey']
+
+                        if (entry['lastUpdated'] < last_mod_time):
+                            break
+                        reviews.append(entry["number"])
+                        review_data = self.analyze_review(entry)
+
+                        if review_data is None:
+                            pprint.pprint("ERROR in review. Ignoring it.")
+                            continue
+
+                        # extra changes not included in gerrit changes
+                        # self.add_merged_abandoned_changes_from_comments(entry, review_data)
+                        self.add_merged_abandoned_changes(entry, review_data)
+                        self.add_uploaded_patchset_from_comments(entry, review_data)
+                        self.add_new_change(review_data)
+                        writer.insert_issue(review_data, dbtrk.id)
+                        number_results += 1
+                    elif 'rowCount' in entry.keys():
+                        pprint.pprint(entry)
+                        printdbg("CONTINUE FROM: " + str(last_item))
+                total_reviews = total_reviews + int(number_results)
+
         self.check_merged_abandoned_changes(bugsdb.store, dbtrk.id)
 
         print("Done. Number of reviews: " + str(total_reviews))
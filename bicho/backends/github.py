@@ -18,11 +18,12 @@
 # Authors: Luis Cañas Díaz <lcanas@libresoft.es>
 
 import sys
-import time
-import urllib2
 import base64
 import json
+import threading
+import time
 
+from bicho import http, pool
 from bicho.backends import Backend
 from bicho.config import Config
 from bicho.utils import printerr, printdbg, printout
@@ -34,8 +35,6 @@ from storm.locals import DateTime, Int, Reference, Unicode, Desc
 from datetime import datetime
 from dateutil.parser import parse  # used to convert str time to datetime
 
-from lazr.restfulclient.errors import HTTPError
-
 
 CLOSED_STATE = "closed"
 OPEN_STATE = "open"
@@ -95,12 +94,66 @@ class DBGithubIssueExtMySQL(DBGithubIssueExt):
                      ) ENGINE=MYISAM; '
 
 
+class DBGithubIssueExtSQLite(DBGithubIssueExt):
+    """
+    SQLite subclass of L{DBGithubIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_github ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     status VARCHAR(32) DEFAULT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     web_link VARCHAR(255) DEFAULT NULL, \
+                     closed_at DATETIME DEFAULT NULL, \
+                     updated_at DATETIME DEFAULT NULL, \
+                     milestone_name VARCHAR(32) DEFAULT NULL, \
+                     milestone_summary VARCHAR(255) DEFAULT NULL, \
+                     milestone_title VARCHAR(255) DEFAULT NULL, \
+                     milestone_web_link VARCHAR(255) DEFAULT NULL, \
+                     labels VARCHAR(255) DEFAULT NULL, \
+                     title VARCHAR(255) DEFAULT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBGithubIssueExtPostgreSQL(DBGithubIssueExt):
+    """
+    PostgreSQL subclass of L{DBGithubIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_github ( \
+                     id SERIAL PRIMARY KEY, \
+                     status TEXT DEFAULT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     web_link TEXT DEFAULT NULL, \
+                     closed_at TIMESTAMP DEFAULT NULL, \
+                     updated_at TIMESTAMP DEFAULT NULL, \
+                     milestone_name TEXT DEFAULT NULL, \
+                     milestone_summary TEXT DEFAULT NULL, \
+                     milestone_title TEXT DEFAULT NULL, \
+                     milestone_web_link TEXT DEFAULT NULL, \
+                     labels TEXT DEFAULT NULL, \
+                     title TEXT DEFAULT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
 class DBGithubBackend(DBBackend):
     """
     Adapter for GitHub backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBGithubIssueExtMySQL]
+        self.SQLITE_EXT = [DBGithubIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBGithubIssueExtPostgreSQL]
 
     def get_last_modification_date(self, store, tracker_id):
         # get last modification date stored in the database for a given status
@@ -140,39 +193,35 @@ class DBGithubBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBGithubIssueExt,
-                                      DBGithubIssueExt.issue_id
-                                      ==
-                                      issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBGithubIssueExt(issue_id)
-
-            db_issue_ext.status = self.__return_unicode(issue.status)
-            db_issue_ext.description = self.__return_unicode(issue.description)
-            db_issue_ext.web_link = self.__return_unicode(issue.web_link)
-            db_issue_ext.closed_at = issue.closed_at
-            db_issue_ext.updated_at = issue.updated_at
-            db_issue_ext.milestone_name = self.__return_unicode(
-                issue.milestone_name)
-            db_issue_ext.milestone_summary = self.__return_unicode(
-                issue.milestone_summary)
-            db_issue_ext.milestone_title = self.__return_unicode(
-                issue.milestone_title)
-            db_issue_ext.milestone_web_link = self.__return_unicode(
-                issue.milestone_web_link)
-            db_issue_ext.labels = self.__return_unicode(issue.labels)
-            db_issue_ext.title = self.__return_unicode(issue.title)
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBGithubIssueExt,
+                                  DBGithubIssueExt.issue_id
+                                  ==
+                                  issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBGithubIssueExt(issue_id)
+
+        db_issue_ext.status = self.__return_unicode(issue.status)
+        db_issue_ext.description = self.__return_unicode(issue.description)
+        db_issue_ext.web_link = self.__return_unicode(issue.web_link)
+        db_issue_ext.closed_at = issue.closed_at
+        db_issue_ext.updated_at = issue.updated_at
+        db_issue_ext.milestone_name = self.__return_unicode(
+            issue.milestone_name)
+        db_issue_ext.milestone_summary = self.__return_unicode(
+            issue.milestone_summary)
+        db_issue_ext.milestone_title = self.__return_unicode(
+            issue.milestone_title)
+        db_issue_ext.milestone_web_link = self.__return_unicode(
+            issue.milestone_web_link)
+        db_issue_ext.labels = self.__return_unicode(issue.labels)
+        db_issue_ext.title = self.__return_unicode(issue.title)
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def __return_int(self, str):
         """
@@ -359,6 +408,77 @@ class GitHubRateLimitReached(Exception):
     pass
 
 
+class GitHubTokenPool:
+    """
+    Pool of API tokens, used in turns by their remaining budget.
+
+    Each request is sent with the token that has more requests left
+    on its current rate limit window. When the budget of every token
+    is exhausted, the pool waits until the first one is reset.
+
+    @ivar tokens: API tokens
+    @type tokens: C{list} of C{str}
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.remaining = {}
+        self.reset = {}
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Return the token with the highest remaining budget, waiting
+        until a budget is reset when all of them are exhausted.
+
+        @rtype: C{str}
+        """
+        while True:
+            self.lock.acquire()
+            try:
+                now = time.time()
+                token = max(self.tokens, key=lambda t: self._budget(t, now))
+
+                if self._budget(token, now) > 0:
+                    # Requests sent at the same time by other
+                    # workers are taken into account
+                    if token in self.remaining:
+                        self.remaining[token] -= 1
+                    return token
+
+                reset = min(self.reset[t] for t in self.tokens)
+            finally:
+                self.lock.release()
+
+            printout("GitHub rate limit reached. Waiting until %s"
+                     % time.ctime(reset))
+            time.sleep(max(1, reset - time.time() + 1))
+
+    def update(self, token, headers):
+        """
+        Update the budget of a token with the headers of a response.
+        """
+        remaining = headers.get('x-ratelimit-remaining')
+        reset = headers.get('x-ratelimit-reset')
+
+        if remaining is None or reset is None:
+            return
+
+        self.lock.acquire()
+        try:
+            self.remaining[token] = int(remaining)
+            self.reset[token] = float(reset)
+        finally:
+            self.lock.release()
+
+    def _budget(self, token, now):
+        # Tokens not used yet, or whose window was reset,
+        # have their whole budget
+        if token not in self.remaining or self.reset[token] <= now:
+            return sys.maxint
+        return self.remaining[token]
+
+
 class GithubBackend(Backend):
 
     def __init__(self):
@@ -371,6 +491,7 @@ class GithubBackend(Backend):
 
         if hasattr(Config, 'backend_token'):
             self.backend_token = Config.backend_token
+            self.tokens = GitHubTokenPool(self.backend_token.split(','))
         elif hasattr(Config, 'backend_user') and hasattr(Config, 'backend_password'):
             self.backend_user = Config.backend_user
             self.backend_password = Config.backend_password
@@ -381,8 +502,14 @@ class GithubBackend(Backend):
             sys.exit(1)
 
         self.newest_first = Config.newest_first
+        self.per_issue = getattr(Config, 'gh_per_issue', False)
         self.remaining_ratelimit = 0
 
+        # Comments and events of the repository by issue number,
+        # when they are not fetched issue by issue
+        self.comments = None
+        self.events = None
+
     def get_domain(self, url):
         strings = url.split('/')
         return strings[0] + "//" + strings[2] + "/"
@@ -434,7 +561,7 @@ class GithubBackend(Backend):
             issue.set_milestone_title(bug['milestone']['title'])
             issue.set_milestone_web_link(bug['milestone']['url'])
 
-        comments = self.__get_batch_comments(bug['number'])
+        comments = self.__get_comments(bug['number'])
         for c in comments:
             by = self.__get_user(c['user']['login'])
             date = self.__to_datetime(c['created_at'])
@@ -442,7 +569,7 @@ class GithubBackend(Backend):
             issue.add_comment(com)
 
         # activity
-        entries = self.__get_batch_activities(bug['number'])
+        entries = self.__get_events(bug['number'])
         for e in entries:
             field = e['event']
             added = e['commit_id']
@@ -464,16 +591,16 @@ class GithubBackend(Backend):
 
         return parse(str[:-1])
 
-    def __set_request_auth(self, request):
-        if self.backend_token:
-            auth = "token %s" % self.backend_token
+    def __set_request_auth(self, headers, token=None):
+        if token:
+            auth = "token %s" % token
         else:
             base64string = base64.encodestring(
                 '%s:%s' % (self.backend_user,
                            self.backend_password)).replace('\n', '')
             auth = "Basic %s" % base64string
 
-        request.add_header("Authorization", auth)
+        headers["Authorization"] = auth
 
     def __get_project_from_url(self):
 
@@ -492,22 +619,56 @@ class GithubBackend(Backend):
     def __get_tracker_url_from_bug(self, bug):
         return bug['url'][:bug['url'].rfind('/')]
 
-    def __fetch_data(self, url):
-        request = urllib2.Request(url)
-        self.__set_request_auth(request)
+    def __request(self, url):
+        while True:
+            token = None
+            if self.backend_token:
+                token = self.tokens.acquire()
 
-        try:
-            result = urllib2.urlopen(request)
-            content = result.read()
-        except urllib2.HTTPError, e:
-            if e.code == 403:
+            headers = {}
+            self.__set_request_auth(headers, token)
+
+            # Responses are cached by the repository and not by the
+            # token, so conditional requests, which are not counted
+            # on the rate limit, can be sent with any of them
+            try:
+                result = http.get(url, headers=headers,
+                                  cache_scope=self.backend_token or None)
+            except http.HTTPError, e:
+                if e.response.status_code != 403:
+                    printdbg("Error raised on %s" % url)
+                    raise e
+
+                # The budget of the token was exhausted; try again
+                # with other token or once it is reset
+                if token and e.response.headers.get('x-ratelimit-remaining') == '0':
+                    self.tokens.update(token, e.response.headers)
+                    continue
                 raise GitHubRateLimitReached()
-            printdbg("Error raised on %s" % url)
-            raise e
 
-        self.remaining_ratelimit = result.info()['x-ratelimit-remaining']
+            if token:
+                self.tokens.update(token, result.headers)
+            self.remaining_ratelimit = result.headers.get('x-ratelimit-remaining')
 
-        return json.loads(content)
+            return result
+
+    def __fetch_data(self, url):
+        result = self.__request(url)
+        return json.loads(result.content)
+
+    def __fetch_page(self, url):
+        # Returns the data of the page and the url of the next
+        # one, taken from the Link header
+        result = self.__request(url)
+        next_url = result.links.get('next', {}).get('url')
+        return json.loads(result.content), next_url
+
+    def __fetch_all(self, url):
+        data = []
+        while url:
+            page, url = self.__fetch_page(url)
+            data += page
+        return data
 
     def __get_user(self, username):
         if username in self.users:
@@ -528,21 +689,79 @@ class GithubBackend(Backend):
         return user
 
     def __get_batch_activities(self, bug_number):
-        url = self.url + "/" + str(bug_number) + "/events"
+        url = self.url + "/" + str(bug_number) + "/events?per_page=100"
 
-        events = self.__fetch_data(url)
+        events = self.__fetch_all(url)
 
         return events
 
     def __get_batch_comments(self, bug_number):
-        url = self.url + "/" + str(bug_number) + "/comments"
+        url = self.url + "/" + str(bug_number) + "/comments?per_page=100"
+
+        comments = self.__fetch_all(url)
+
+        return comments
+
+    def __get_repo_comments(self):
+        # Comments of all the issues, created or updated
+        # since the last issue stored
+        url = self.url + "/comments?per_page=100&sort=created&direction=asc"
 
-        comments = self.__fetch_data(url)
+        if self.mod_date:
+            url = url + "&since=" + str(self.mod_date)
+
+        printdbg("Fetching comments of the repository: " + url)
+
+        comments = {}
+        for page in pool.pages(self.__fetch_page, url):
+            for c in page:
+                bug_number = int(c['issue_url'].rsplit('/', 1)[1])
+                comments.setdefault(bug_number, []).append(c)
 
         return comments
 
-    def __get_batch_bugs_state(self, state=ALL_STATES, since=None, direction='asc'):
-        url = self.url + "?state=" + state + "&page=" + str(self.pagecont) \
+    def __get_repo_events(self):
+        url = self.url + "/events?per_page=100"
+
+        printdbg("Fetching events of the repository: " + url)
+
+        def fetch_events(url):
+            events, next_url = self.__fetch_page(url)
+
+            # Events are listed from the newest, so there is no need
+            # to go on once they are older than the last issue stored
+            if self.mod_date and events and \
+                    self.__to_datetime(events[-1]['created_at']) < parse(self.mod_date):
+                next_url = None
+
+            return events, next_url
+
+        events = {}
+        for page in pool.pages(fetch_events, url):
+            for e in page:
+                if not e.get('issue'):
+                    continue
+                events.setdefault(e['issue']['number'], []).append(e)
+
+        # Keep the events of each issue from the oldest,
+        # the same order they are listed issue by issue
+        for bug_events in events.values():
+            bug_events.reverse()
+
+        return events
+
+    def __get_comments(self, bug_number):
+        if self.comments is None:
+            return self.__get_batch_comments(bug_number)
+        return self.comments.pop(bug_number, [])
+
+    def __get_events(self, bug_number):
+        if self.events is None:
+            return self.__get_batch_activities(bug_number)
+        return self.events.pop(bug_number, [])
+
+    def __get_batch_bugs_state(self, page, state=ALL_STATES, since=None, direction='asc'):
+        url = self.url + "?state=" + state + "&page=" + str(page) \
             + "&per_page=100&sort=updated&direction=" + direction
 
         if since:
@@ -554,16 +773,23 @@ class GithubBackend(Backend):
 
         return bugs
 
-    def __get_batch_bugs(self):
+    def __get_batch_bugs(self, page):
         direction = 'asc'
 
         if self.newest_first:
             direction = 'desc'
 
-        bugs = self.__get_batch_bugs_state(state=ALL_STATES,
+        bugs = self.__get_batch_bugs_state(page,
+                                           state=ALL_STATES,
                                            since=self.mod_date,
                                            direction=direction)
-        return bugs
+
+        if bugs:
+            next_page = page + 1
+        else:
+            next_page = None
+
+        return bugs, next_page
 
     def run(self):
         print("Running Bicho with delay of %s seconds" % (str(self.delay)))
@@ -581,7 +807,6 @@ class GithubBackend(Backend):
         dbtrk = bugsdb.insert_tracker(trk)
 
         self.bugs_state = ALL_STATES
-        self.pagecont = 1
         self.mod_date = None
 
         aux_date = bugsdb.get_last_modification_date(tracker_id=dbtrk.id)
@@ -590,8 +815,19 @@ class GithubBackend(Backend):
             self.mod_date = aux_date.isoformat()
             printdbg("Last issue already cached: %s" % self.mod_date)
 
+        # The next page of bugs is fetched while
+        # the bugs of the current one are stored
+        pages = pool.pages(self.__get_batch_bugs, 1)
+
         try:
-            bugs = self.__get_batch_bugs()
+            # Comments and events of the whole repository are fetched
+            # once and joined to the issues, instead of requesting
+            # them for every issue
+            if not self.per_issue:
+                self.comments = self.__get_repo_comments()
+                self.events = self.__get_repo_events()
+
+            bugs = pages.next()
         except GitHubRateLimitReached:
             printout("GitHub rate limit reached. To resume, wait some minutes.")
             sys.exit(0)
@@ -637,12 +873,9 @@ class GithubBackend(Backend):
                     print e
 
                 printdbg ("Getting ticket number " + str(bug["number"]))
-                time.sleep(self.delay)
-
-            self.pagecont += 1
 
             try:
-                bugs = self.__get_batch_bugs()
+                bugs = next(pages, [])
             except GitHubRateLimitReached:
                 printout("GitHub rate limit reached. To resume, wait some minutes.")
                 sys.exit(0)
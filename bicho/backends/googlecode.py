@@ -22,6 +22,7 @@
 The Google Code backend is abandoned and nonfunctional as of November 2013.
 """
 
+from bicho import http, pool
 from bicho.config import Config
 
 from bicho.backends import Backend
@@ -38,9 +39,7 @@ import os
 import pprint
 import random
 import sys
-import time
 import traceback
-import urllib
 import feedparser
 
 from storm.locals import DateTime, Int, Reference, Unicode, Bool
@@ -82,37 +81,75 @@ class DBGoogleCodeIssueExtMySQL(DBGoogleCodeIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBGoogleCodeIssueExtSQLite(DBGoogleCodeIssueExt):
+    """
+    SQLite subclass of L{DBGoogleCodeIssueExt}
+    """
+
+    # If the table is changed you need to remove old from database
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_googlecode ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     star TEXT, \
+                     ticket_num INTEGER NOT NULL, \
+                     mod_date DATETIME, \
+                     closed_date DATETIME, \
+                     issue_id INTEGER NOT NULL, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBGoogleCodeIssueExtPostgreSQL(DBGoogleCodeIssueExt):
+    """
+    PostgreSQL subclass of L{DBGoogleCodeIssueExt}
+    """
+
+    # If the table is changed you need to remove old from database
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_googlecode ( \
+                     id SERIAL PRIMARY KEY, \
+                     star TEXT, \
+                     ticket_num INTEGER NOT NULL, \
+                     mod_date TIMESTAMP, \
+                     closed_date TIMESTAMP, \
+                     issue_id INTEGER NOT NULL, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
 class DBGoogleCodeBackend(DBBackend):
     """
     Adapter for GoogleCode backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBGoogleCodeIssueExtMySQL]
+        self.SQLITE_EXT = [DBGoogleCodeIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBGoogleCodeIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBGoogleCodeIssueExt,
-                                      DBGoogleCodeIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBGoogleCodeIssueExt(issue_id)
+        db_issue_ext = store.find(DBGoogleCodeIssueExt,
+                                  DBGoogleCodeIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBGoogleCodeIssueExt(issue_id)
 
-            db_issue_ext.star = unicode(issue.star)
-            db_issue_ext.ticket_num = int(issue.ticket_num)
-            db_issue_ext.mod_date = issue.mod_date
-            db_issue_ext.closed_date = issue.closed_date
+        db_issue_ext.star = unicode(issue.star)
+        db_issue_ext.ticket_num = int(issue.ticket_num)
+        db_issue_ext.mod_date = issue.mod_date
+        db_issue_ext.closed_date = issue.closed_date
 
-            if newIssue is True:
-                store.add(db_issue_ext)
+        if newIssue is True:
+            store.add(db_issue_ext)
 
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        store.flush()
+        return db_issue_ext
 
     def insert_change_ext(self, store, change, change_id):
         pass
@@ -176,7 +213,7 @@ class GoogleCode():
         changes_url = Config.url + "/issues/" + issue.ticket_num + "/comments/full"
         printdbg("Analyzing issue " + changes_url)
 
-        d = feedparser.parse(changes_url)
+        d = feedparser.parse(http.get(changes_url).content)
         changes = self.parse_changes(d, issue.ticket_num)
 
         for c in changes:
@@ -229,7 +266,7 @@ class GoogleCode():
         self.url_issues = Config.url + "/issues/full?max-results=1"
         printdbg("URL for getting metadata " + self.url_issues)
 
-        d = feedparser.parse(self.url_issues)
+        d = feedparser.parse(http.get(self.url_issues).content)
 
         total_issues = int(d['feed']['opensearch_totalresults'])
         print "Total bugs: ", total_issues
@@ -240,14 +277,23 @@ class GoogleCode():
 
         print "ETA ", (total_issues * Config.delay) / (60), "m (", (total_issues * Config.delay) / (60 * 60), "h)"
 
-        while start_issue < total_issues:
-            self.url_issues = Config.url + "/issues/full?max-results=" + str(issues_per_query)
-            self.url_issues += "&start-index=" + str(start_issue)
+        def fetch_entries(start_issue):
+            url_issues = Config.url + "/issues/full?max-results=" + str(issues_per_query)
+            url_issues += "&start-index=" + str(start_issue)
 
-            printdbg("URL for next issues " + self.url_issues)
+            printdbg("URL for next issues " + url_issues)
 
-            d = feedparser.parse(self.url_issues)
+            d = feedparser.parse(http.get(url_issues).content)
 
+            next_issue = start_issue + issues_per_query
+            if next_issue >= total_issues:
+                next_issue = None
+
+            return d, next_issue
+
+        # The next feed of issues is fetched while
+        # the issues of the current one are stored
+        for d in pool.pages(fetch_entries, start_issue):
             for entry in d['entries']:
                 try:
                     issue = self.analyze_bug(entry)
@@ -256,7 +302,6 @@ class GoogleCode():
                     bugsdb.insert_issue(issue, dbtrk.id)
                     remaining -= 1
                     print "Remaining time: ", (remaining) * Config.delay / 60, "m", " issues ", str(remaining)
-                    time.sleep(Config.delay)
                 except Exception, e:
                     printerr("Error in function analyze_bug ")
                     pprint.pprint(entry)
@@ -265,8 +310,6 @@ class GoogleCode():
                     printerr("UnicodeEncodeError: the issue %s couldn't be stored"
                              % (issue.issue))
 
-            start_issue += issues_per_query
-
         printout("Done. %s bugs analyzed" % (total_issues - remaining))
 
 Backend.register_backend('googlecode', GoogleCode)
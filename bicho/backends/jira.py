@@ -21,19 +21,23 @@
 #          Santiago Dueñas <sduenas@libresoft.es>
 #          Alvaro del Castillo <acs@bitergia.com>
 
-import urllib2
-import base64
-import time
-import sys
+import collections
+import json
+import urllib
+
+from datetime import datetime, timedelta
 
 from storm.locals import Int, DateTime, Unicode, Reference, Desc
 
 from dateutil.parser import parse
+from itertools import izip
+
+from bicho import http, pool
 from bicho.common import Issue, People, Tracker, Comment, Change, Attachment
 from bicho.backends import Backend
 from bicho.db.database import DBIssue, DBBackend, DBTracker, get_database
 from bicho.config import Config
-from bicho.utils import printout, printerr, printdbg
+from bicho.utils import printout, printerr, printdbg, iter_valid_XML_chunks
 from BeautifulSoup import BeautifulSoup
 #from BeautifulSoup import NavigableString
 from BeautifulSoup import Comment as BFComment
@@ -45,6 +49,10 @@ import xml.sax.handler
 import feedparser
 
 
+# Days after which the email of a user is resolved again
+EMAIL_TTL = 30
+
+
 
 class DBJiraIssueExt(object):
     """
@@ -109,12 +117,153 @@ class DBJiraIssueExtMySQL(DBJiraIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBJiraIssueExtSQLite(DBJiraIssueExt):
+    """
+    SQLite subclass of L{DBJiraIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_jira ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     issue_key VARCHAR(32) NOT NULL, \
+                     link VARCHAR(100) NOT NULL, \
+                     title VARCHAR(256) NOT NULL, \
+                     environment VARCHAR(128) NOT NULL, \
+                     security VARCHAR(35) NOT NULL, \
+                     updated DATETIME NOT NULL, \
+                     version VARCHAR(35) NOT NULL, \
+                     fix_version VARCHAR(35) NOT NULL, \
+                     component VARCHAR(35) NOT NULL, \
+                     votes INTEGER, \
+                     project VARCHAR(35) NOT NULL, \
+                     project_id INTEGER, \
+                     project_key VARCHAR(35) NOT NULL, \
+                     status VARCHAR(35) NOT NULL, \
+                     resolution VARCHAR(35) NOT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBJiraIssueExtPostgreSQL(DBJiraIssueExt):
+    """
+    PostgreSQL subclass of L{DBJiraIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_jira ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_key TEXT NOT NULL, \
+                     link TEXT NOT NULL, \
+                     title TEXT NOT NULL, \
+                     environment TEXT NOT NULL, \
+                     security TEXT NOT NULL, \
+                     updated TIMESTAMP NOT NULL, \
+                     version TEXT NOT NULL, \
+                     fix_version TEXT NOT NULL, \
+                     component TEXT NOT NULL, \
+                     votes INTEGER, \
+                     project TEXT NOT NULL, \
+                     project_id INTEGER, \
+                     project_key TEXT NOT NULL, \
+                     status TEXT NOT NULL, \
+                     resolution TEXT NOT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBJiraPeopleExt(object):
+    """
+    Email of a user of the tracker, with the date it was resolved
+    """
+    __storm_table__ = 'people_ext_jira'
+
+    id = Int(primary=True)
+    username = Unicode()
+    email = Unicode()
+    resolved_on = DateTime()
+    tracker_id = Int()
+
+    tracker = Reference(tracker_id, DBTracker.id)
+
+    def __init__(self, username, tracker_id):
+        self.username = username
+        self.tracker_id = tracker_id
+
+
+class DBJiraPeopleExtMySQL(DBJiraPeopleExt):
+    """
+    MySQL subclass of L{DBJiraPeopleExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS people_ext_jira ( \
+                     id INTEGER NOT NULL AUTO_INCREMENT, \
+                     username VARCHAR(255) NOT NULL, \
+                     email VARCHAR(255) NOT NULL, \
+                     resolved_on DATETIME NOT NULL, \
+                     tracker_id INTEGER NOT NULL, \
+                     PRIMARY KEY(id), \
+                     UNIQUE KEY(tracker_id, username), \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ) ENGINE=MYISAM;'
+
+
+class DBJiraPeopleExtSQLite(DBJiraPeopleExt):
+    """
+    SQLite subclass of L{DBJiraPeopleExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS people_ext_jira ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     username VARCHAR(255) NOT NULL, \
+                     email VARCHAR(255) NOT NULL, \
+                     resolved_on DATETIME NOT NULL, \
+                     tracker_id INTEGER NOT NULL, \
+                     UNIQUE(tracker_id, username), \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBJiraPeopleExtPostgreSQL(DBJiraPeopleExt):
+    """
+    PostgreSQL subclass of L{DBJiraPeopleExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS people_ext_jira ( \
+                     id SERIAL PRIMARY KEY, \
+                     username TEXT NOT NULL, \
+                     email TEXT NOT NULL, \
+                     resolved_on TIMESTAMP NOT NULL, \
+                     tracker_id INTEGER NOT NULL, \
+                     UNIQUE(tracker_id, username), \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
 class DBJiraBackend(DBBackend):
     """
     Adapter for Jira backend.
     """
     def __init__(self):
-        self.MYSQL_EXT = [DBJiraIssueExtMySQL]
+        self.MYSQL_EXT = [DBJiraIssueExtMySQL, DBJiraPeopleExtMySQL]
+        self.SQLITE_EXT = [DBJiraIssueExtSQLite, DBJiraPeopleExtSQLite]
+        self.POSTGRESQL_EXT = [DBJiraIssueExtPostgreSQL, DBJiraPeopleExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -133,37 +282,33 @@ class DBJiraBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBJiraIssueExt,
-                                      DBJiraIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBJiraIssueExt(issue_id)
-
-            db_issue_ext.title = self.__return_unicode(issue.title)
-            db_issue_ext.issue_key = self.__return_unicode(issue.issue_key)
-            db_issue_ext.link = self.__return_unicode(issue.link)
-            db_issue_ext.environment = self.__return_unicode(issue.environment)
-            db_issue_ext.security = self.__return_unicode(issue.security)
-            db_issue_ext.updated = issue.updated
-            db_issue_ext.version = self.__return_unicode(issue.version)
-            db_issue_ext.fix_version = self.__return_unicode(issue.fix_version)
-            db_issue_ext.component = self.__return_unicode(issue.component)
-            db_issue_ext.votes = issue.votes
-            db_issue_ext.project = self.__return_unicode(issue.project)
-            db_issue_ext.project_id = issue.project_id
-            db_issue_ext.project_key = self.__return_unicode(issue.project_key)
-            db_issue_ext.status = self.__return_unicode(issue.status)
-            db_issue_ext.resolution = self.__return_unicode(issue.resolution)
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBJiraIssueExt,
+                                  DBJiraIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBJiraIssueExt(issue_id)
+
+        db_issue_ext.title = self.__return_unicode(issue.title)
+        db_issue_ext.issue_key = self.__return_unicode(issue.issue_key)
+        db_issue_ext.link = self.__return_unicode(issue.link)
+        db_issue_ext.environment = self.__return_unicode(issue.environment)
+        db_issue_ext.security = self.__return_unicode(issue.security)
+        db_issue_ext.updated = issue.updated
+        db_issue_ext.version = self.__return_unicode(issue.version)
+        db_issue_ext.fix_version = self.__return_unicode(issue.fix_version)
+        db_issue_ext.component = self.__return_unicode(issue.component)
+        db_issue_ext.votes = issue.votes
+        db_issue_ext.project = self.__return_unicode(issue.project)
+        db_issue_ext.project_id = issue.project_id
+        db_issue_ext.project_key = self.__return_unicode(issue.project_key)
+        db_issue_ext.status = self.__return_unicode(issue.status)
+        db_issue_ext.resolution = self.__return_unicode(issue.resolution)
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def __return_unicode(self, str):
         """
@@ -206,6 +351,57 @@ class DBJiraBackend(DBBackend):
             db_issue_ext = result.order_by(Desc(DBJiraIssueExt.updated))[0]
             return db_issue_ext.updated.strftime('%Y-%m-%d %H:%M')
 
+    def get_emails(self, store, tracker_id, usernames):
+        """
+        Return the emails stored for the given users of the tracker.
+
+        @param store: database connection
+        @type store: L{storm.locals.Store}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        @param usernames: names of the users
+        @type usernames: C{list}
+
+        @return: pairs of (email, resolution date) by username
+        @rtype: C{dict}
+        """
+        usernames = [unicode(username) for username in usernames]
+        if not usernames:
+            return {}
+
+        result = store.find((DBJiraPeopleExt.username, DBJiraPeopleExt.email,
+                             DBJiraPeopleExt.resolved_on),
+                            DBJiraPeopleExt.tracker_id == tracker_id,
+                            DBJiraPeopleExt.username.is_in(usernames))
+        return dict([(username, (email, resolved_on))
+                     for username, email, resolved_on in result])
+
+    def set_email(self, store, tracker_id, username, email, resolved_on):
+        """
+        Store the email of a user of the tracker.
+
+        @param store: database connection
+        @type store: L{storm.locals.Store}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        @param username: name of the user
+        @type username: C{str}
+        @param email: email of the user; empty when it is unknown
+        @type email: C{str}
+        @param resolved_on: date when the email was resolved
+        @type resolved_on: L{datetime.datetime}
+        """
+        db_people_ext = store.find(DBJiraPeopleExt,
+                                   DBJiraPeopleExt.tracker_id == tracker_id,
+                                   DBJiraPeopleExt.username == unicode(username)).one()
+        if not db_people_ext:
+            db_people_ext = DBJiraPeopleExt(unicode(username), tracker_id)
+            store.add(db_people_ext)
+
+        db_people_ext.email = unicode(email or '')
+        db_people_ext.resolved_on = resolved_on
+        store.flush()
+
 ####################################
 
 
@@ -431,10 +627,199 @@ class SoupHtmlParser():
         return changes
 
 
+class JiraRESTParser():
+    """
+    Converts the issues returned by the REST API (version 2) of Jira,
+    with their changelog expanded, into L{JiraIssue} objects.
+
+    Fields are named and rendered as on the XML views and on the
+    change history pages, so issues are stored in the same way by
+    both retrieval modes.
+    """
+
+    def __init__(self, server_url, field_names=None):
+        """
+        @param server_url: base URL of the Jira server
+        @type server_url: C{str}
+        @param field_names: names shown on the change history pages
+            by field identifier
+        @type field_names: C{dict}
+        """
+        self.server_url = server_url
+        self.field_names = field_names or {}
+
+    def _get_date(self, str_date):
+        return parse(str_date).replace(tzinfo=None)
+
+    def _get_people(self, user):
+        """
+        Return the identity of a user of the REST API. Anonymous users
+        are returned as the XML views do.
+        """
+        if not user:
+            people = People(u'-1')
+            people.set_name(u'Unassigned')
+            return people
+
+        username = user.get('name') or user.get('key') or user.get('accountId')
+        people = People(unicode(username))
+        people.set_name(user.get('displayName'))
+        email = user.get('emailAddress') or BugsHandler.getUserEmail(username)
+        people.set_email(email)
+        return people
+
+    def _get_name(self, value):
+        if not value:
+            return None
+        return value['name']
+
+    def get_issue(self, raw_issue):
+        """
+        Return the issue with its comments, attachments and changes.
+
+        @param raw_issue: issue returned by the REST API
+        @type raw_issue: C{dict}
+
+        @rtype: L{JiraIssue}
+        """
+        fields = raw_issue['fields']
+        rendered = raw_issue.get('renderedFields') or {}
+
+        description = rendered.get('description') or fields.get('description') or u''
+        submitted_by = self._get_people(fields.get('reporter'))
+        submitted_on = self._get_date(fields['created'])
+
+        issue = JiraIssue(raw_issue['id'], self._get_name(fields['issuetype']),
+                          fields['summary'], description,
+                          submitted_by, submitted_on)
+        issue.set_assigned(self._get_people(fields.get('assignee')))
+        issue.setIssue_key(raw_issue['key'])
+        issue.setTitle(u"[%s] %s" % (raw_issue['key'], fields['summary']))
+        issue.setLink(self.server_url + "/browse/" + raw_issue['key'])
+        issue.setEnvironment(rendered.get('environment') or fields.get('environment'))
+        issue.setSecurity(self._get_name(fields.get('security')))
+        issue.setUpdated(self._get_date(fields['updated']))
+        issue.setVersion(','.join([v['name'] for v in fields.get('versions') or []]))
+        issue.setFixVersion(','.join([v['name'] for v in fields.get('fixVersions') or []]))
+        components = fields.get('components') or []
+        if components:
+            issue.setComponent(components[-1]['name'])
+        if fields.get('votes'):
+            issue.setVotes(fields['votes']['votes'])
+        issue.setProject(fields['project']['name'])
+        issue.setProject_id(fields['project']['id'])
+        issue.setProject_key(fields['project']['key'])
+        issue.setStatus(self._get_name(fields['status']))
+        issue.setPriority(self._get_name(fields.get('priority')))
+        issue.setResolution(self._get_name(fields.get('resolution')) or u'Unresolved')
+
+        for c in self.parse_changes(raw_issue):
+            issue.add_change(c)
+
+        comments = (fields.get('comment') or {}).get('comments', [])
+        rendered_comments = (rendered.get('comment') or {}).get('comments', [])
+        for i, comment in enumerate(comments):
+            if i < len(rendered_comments):
+                text = rendered_comments[i]['body']
+            else:
+                text = comment['body']
+            comment_by = self._get_people(comment.get('author'))
+            comment_on = self._get_date(comment['created'])
+            issue.add_comment(Comment(text, comment_by, comment_on))
+
+        for attachment in fields.get('attachment') or []:
+            url = "/secure/attachment/" + attachment['id'] + "/" + attachment['filename']
+            attachment_by = self._get_people(attachment.get('author'))
+            attachment_on = self._get_date(attachment['created'])
+            issue.add_attachment(Attachment(url, attachment_by, attachment_on))
+
+        return issue
+
+    def get_users(self, raw_issues):
+        """
+        Return the users found on the given issues.
+
+        @param raw_issues: issues returned by the REST API
+        @type raw_issues: C{list} of C{dict}
+
+        @return: emails by username; C{None} when the email
+            is not shown by the API
+        @rtype: C{dict}
+        """
+        users = {}
+
+        def add_user(user):
+            if not user:
+                return
+            username = user.get('name') or user.get('key') or user.get('accountId')
+            if username:
+                users[username] = user.get('emailAddress') or users.get(username)
+
+        for raw_issue in raw_issues:
+            fields = raw_issue['fields']
+            add_user(fields.get('reporter'))
+            add_user(fields.get('assignee'))
+            for comment in (fields.get('comment') or {}).get('comments', []):
+                add_user(comment.get('author'))
+            for attachment in fields.get('attachment') or []:
+                add_user(attachment.get('author'))
+            for history in (raw_issue.get('changelog') or {}).get('histories', []):
+                add_user(history.get('author'))
+
+        return users
+
+    def parse_changes(self, raw_issue):
+        """
+        Return the changes of the changelog of the issue.
+
+        @param raw_issue: issue returned by the REST API
+        @type raw_issue: C{dict}
+
+        @rtype: C{list} of L{Change}
+        """
+        changes = []
+        changelog = raw_issue.get('changelog') or {}
+
+        for history in changelog.get('histories', []):
+            if history.get('author'):
+                author = self._get_people(history['author'])
+            else:
+                author = People(u'anonymous')
+            # Change history pages show dates without seconds, so
+            # they are removed to store changes with the same dates
+            date = self._get_date(history['created'])
+            date = date.replace(second=0, microsecond=0)
+
+            for item in history['items']:
+                field_id = item.get('fieldId') or item['field']
+                field = unicode(self.field_names.get(field_id, item['field']))
+                if field == "Assignee":
+                    old = unicode(item.get('from') or '')
+                    new = unicode(item.get('to') or '')
+                else:
+                    old = unicode(item.get('fromString') or '')
+                    new = unicode(item.get('toString') or '')
+
+                change = Change(field, old, new, author, date)
+                changes.append(change)
+
+        return changes
+
+
 class BugsHandler(xml.sax.handler.ContentHandler):
 
-    def __init__(self):
+    # Resolver of the emails of the users, set by the backend
+    resolver = None
+
+    def __init__(self, on_issue=None):
+        """
+        @param on_issue: function called with each issue once it is
+            parsed; when it is not given, issues are kept on
+            C{issues_data}
+        @type on_issue: C{function}
+        """
         self.issues_data = []
+        self.on_issue = on_issue
         self.init_bug()
 
     def init_bug(self):
@@ -672,7 +1057,10 @@ class BugsHandler(xml.sax.handler.ContentHandler):
             newbug.attachments = self.attachments
             newbug.customfields = self.customfields
 
-            self.issues_data.append(newbug)
+            if self.on_issue is not None:
+                self.on_issue(newbug)
+            else:
+                self.issues_data.append(newbug)
 
     @staticmethod
     def remove_unicode(str):
@@ -685,30 +1073,33 @@ class BugsHandler(xml.sax.handler.ContentHandler):
 
     @staticmethod
     def getUserEmail(username):
-        return ""
-        # http://issues.liferay.com/activity?maxResults=1&streams=user+IS+kalman.vincze
-        if not "_emails" in vars(BugsHandler):
-            BugsHandler._emails = {}
-        if username in BugsHandler._emails:
-            email = BugsHandler._emails[username]
-        else:
-            serverUrl = Config.url.split("/browse/")[0]
-            user_url = serverUrl + "/activity?maxResults=1&streams=user+IS+" + username
-            email = ""
-            d = feedparser.parse(user_url)
-            if 'entries' in d:
-                if len(d['entries']) > 0:
-                    email = d['entries'][0]['author_detail']['email']
-                    email = BugsHandler.remove_unicode(email)
-                    printdbg(username + " " + email)
-            BugsHandler._emails[username] = email
-        return email
+        if BugsHandler.resolver is None:
+            return ""
+        return BugsHandler.resolver.get_email(username)
+
+    def getUsernames(self, bugs=None):
+        """
+        Return the users found on the given issues, by username.
+        By default, the ones of the parsed issues are returned.
+        """
+        if bugs is None:
+            bugs = self.issues_data
+
+        users = {}
+        for bug in bugs:
+            users[bug.assignee_username] = None
+            users[bug.reporter_username] = None
+            for comment in bug.comments:
+                users[comment.comment_author] = None
+            for attachment in bug.attachments:
+                users[attachment.attachment_author] = None
+        return users
 
     def getIssues(self, conn):
-        bicho_bugs = []
-        for bug in self.issues_data:
-            bicho_bugs.append(self.getIssue(bug, conn))
-        return bicho_bugs
+        # Change histories are fetched by the workers of the pool;
+        # issues are returned in the same order they were parsed
+        return list(pool.imap(lambda bug: self.getIssue(bug, conn),
+                              self.issues_data))
 
     def getIssue(self, bug, conn):
         #Return the parse data bug into issue object
@@ -790,24 +1181,9 @@ class JiraConnection(object):
             printout("No account data provided. Not logged in Jira")
             return
 
-        import cookielib
-
-        cookie_j = cookielib.CookieJar()
-        cookie_h = urllib2.HTTPCookieProcessor(cookie_j)
-
-        auth_info = user + ':' + password
-        auth_info = auth_info.replace('\n', '')
-        base64string = base64.encodestring(auth_info)
-
-        request = urllib2.Request(url)
-        request.add_header("Authorization", "Basic %s" % base64string)
-
-        opener = urllib2.build_opener(cookie_h)
-        urllib2.install_opener(opener)
-
-        urllib2.urlopen(request)
-        for i, c in enumerate(cookie_j):
-            self.cookies[c.name] = c.value
+        # Session cookies are kept by the HTTP client
+        http.get(url, auth=(user, password))
+        self.cookies = http.get_client().get_cookies()
 
         printout("Logged in Jira as %s" % user)
         printdbg("Jira session cookies: %s" % self.cookies)
@@ -816,18 +1192,23 @@ class JiraConnection(object):
         """
         Opens an URL using an authenticated session
         """
-        request = urllib2.Request(url)
-
-        opener = urllib2.build_opener()
-
-        if self.is_auth_session():
-            q = [str(c) + '=' + v for c, v in self.cookies.items()]
-            opener.addheaders.append(('Cookie', '; '.join(q)))
+        try:
+            return http.urlopen(url)
+        except http.HTTPError as e:
+            printerr("Error code: %s, reason: %s" % (e.response.status_code,
+                                                     e.response.reason))
+            raise e
 
+    def iter_content_auth(self, url):
+        """
+        Opens an URL using an authenticated session, returning an
+        iterator over the chunks of the body
+        """
         try:
-            return opener.open(request)
-        except (urllib2.HTTPError, urllib2.URLError) as e:
-            printerr("Error code: %s, reason: %s" % (e.code, e.reason))
+            return http.iter_content(url)
+        except http.HTTPError as e:
+            printerr("Error code: %s, reason: %s" % (e.response.status_code,
+                                                     e.response.reason))
             raise e
 
     def is_auth_session(self):
@@ -837,6 +1218,111 @@ class JiraConnection(object):
         return len(self.cookies) > 0
 
 
+class JiraEmailResolver:
+    """
+    Resolves the emails of the users of the tracker.
+
+    Emails are stored on the database with the date they were
+    resolved, so they are requested again only after L{EMAIL_TTL}
+    days. The users of each page of issues are resolved together
+    before the issues are converted, and the ones not stored are
+    requested concurrently by the pool.
+    """
+
+    def __init__(self, bugsdb, backend, tracker_id, server_url, rest=False):
+        """
+        @param bugsdb: database where the emails are stored
+        @type bugsdb: L{DBDatabase}
+        @param backend: adapter of the Jira tables
+        @type backend: L{DBJiraBackend}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        @param server_url: base URL of the Jira server
+        @type server_url: C{str}
+        @param rest: whether the server provides the REST API
+        @type rest: C{bool}
+        """
+        self.bugsdb = bugsdb
+        self.backend = backend
+        self.tracker_id = tracker_id
+        self.server_url = server_url
+        self.rest = rest
+        self.emails = {}
+
+    def get_email(self, username):
+        """
+        Return the email of a user already resolved; it is empty
+        when the email is unknown.
+        """
+        return self.emails.get(username, "")
+
+    def resolve(self, users):
+        """
+        Resolve the emails of the given users. Emails returned along
+        with the issues are stored without requesting them again.
+
+        @param users: emails by username; C{None} when it is unknown
+        @type users: C{dict}
+        """
+        users = dict([(username, email) for username, email in users.items()
+                      if username and username not in self.emails])
+        if not users:
+            return
+
+        now = datetime.now()
+        expired = now - timedelta(days=EMAIL_TTL)
+        stored = self.backend.get_emails(self.bugsdb.store, self.tracker_id,
+                                         users.keys())
+
+        pending = []
+        for username, email in users.items():
+            stored_email, resolved_on = stored.get(unicode(username), (None, None))
+            fresh = resolved_on is not None and resolved_on > expired
+
+            if email:
+                self.emails[username] = email
+                if not fresh or email != stored_email:
+                    self._store(username, email, now)
+            elif fresh:
+                self.emails[username] = stored_email
+            else:
+                pending.append(username)
+
+        if not pending:
+            return
+
+        printdbg("Resolving the emails of %s users" % len(pending))
+        emails = pool.imap(self._fetch_email, pending)
+        for username, email in izip(pending, emails):
+            self.emails[username] = email
+            self._store(username, email, now)
+
+    def _store(self, username, email, resolved_on):
+        self.bugsdb.write(self.backend.set_email, self.tracker_id,
+                          username, email, resolved_on)
+
+    def _fetch_email(self, username):
+        if self.rest:
+            url = self.server_url + "/rest/api/2/user?" + \
+                urllib.urlencode({'username': username.encode('utf-8')})
+            try:
+                user = json.loads(http.urlopen(url).read())
+            except http.HTTPError:
+                return ""
+            return user.get('emailAddress') or ""
+
+        # http://issues.liferay.com/activity?maxResults=1&streams=user+IS+kalman.vincze
+        user_url = self.server_url + "/activity?maxResults=1&streams=user+IS+" + username
+        email = ""
+        d = feedparser.parse(http.get(user_url).content)
+        if 'entries' in d:
+            if len(d['entries']) > 0:
+                email = d['entries'][0]['author_detail']['email']
+                email = BugsHandler.remove_unicode(email)
+                printdbg(username + " " + email)
+        return email
+
+
 class JiraBackend(Backend):
     """
     Jira Backend
@@ -856,6 +1342,108 @@ class JiraBackend(Backend):
 
         self.conn = JiraConnection()
 
+    def rest_url(self, server_url, path, params=None):
+        url = server_url + "/rest/api/2/" + path
+        if params:
+            url += "?" + urllib.urlencode(params)
+        return url
+
+    def rest_get(self, server_url, path, params=None):
+        """
+        Request a resource of the REST API and return it decoded
+        """
+        url = self.rest_url(server_url, path, params)
+        printdbg(url)
+        return json.loads(self.conn.urlopen_auth(url).read())
+
+    def check_rest_api(self, server_url):
+        """
+        Returns whether the server provides the REST API (version 2).
+        Old servers only provide the XML views.
+        """
+        url = self.rest_url(server_url, "serverInfo")
+        try:
+            info = json.loads(http.urlopen(url).read())
+        except (http.HTTPError, ValueError):
+            printdbg("REST API not available on %s" % server_url)
+            return False
+
+        printdbg("Jira %s REST API available" % info.get('version'))
+        return True
+
+    def get_field_names(self, server_url):
+        """
+        Returns the names of the fields by their identifiers
+        """
+        try:
+            fields = self.rest_get(server_url, "field")
+        except http.HTTPError:
+            return {}
+        return dict([(f['id'], f['name']) for f in fields])
+
+    def get_rest_issues(self, server_url, raw_issues, parser):
+        """
+        Converts the issues of the REST API. Changelogs returned
+        incomplete by the search are requested again with the issue.
+        """
+        for raw_issue in raw_issues:
+            changelog = raw_issue.get('changelog') or {}
+            histories = changelog.get('histories', [])
+            if changelog.get('total', len(histories)) > len(histories):
+                printdbg("Changelog of %s incomplete. Retrieving it" % raw_issue['key'])
+                full_issue = self.rest_get(server_url, "issue/" + raw_issue['key'],
+                                           {'expand': 'changelog', 'fields': 'none'})
+                raw_issue['changelog'] = full_issue['changelog']
+
+        self.resolver.resolve(parser.get_users(raw_issues))
+
+        return [parser.get_issue(raw_issue) for raw_issue in raw_issues]
+
+    def analyze_rest_issues(self, server_url, project, bugsdb, dbtrk_id):
+        """
+        Retrieves the issues of the project using the REST API.
+
+        Each search page returns the issues with their comments,
+        attachments and changelog, so only one request is needed for
+        every C{max_issues} issues.
+        """
+        parser = JiraRESTParser(server_url, self.get_field_names(server_url))
+
+        jql = 'project = "%s"' % project
+        if self.last_mod_date:
+            jql += ' AND updated >= "%s"' % self.last_mod_date
+        jql += ' ORDER BY updated ASC'
+
+        def fetch_issues(start_at):
+            params = {'jql': jql,
+                      'startAt': start_at,
+                      'maxResults': self.max_issues,
+                      'expand': 'changelog,renderedFields',
+                      'fields': '*all'}
+            result = self.rest_get(server_url, "search", params)
+
+            if start_at == 0:
+                printout("Tickets to be retrieved: %s" % result['total'])
+
+            # The server may return less issues than requested
+            raw_issues = result['issues']
+            next_start_at = start_at + len(raw_issues)
+
+            if not raw_issues or next_start_at >= result['total']:
+                next_start_at = None
+
+            return raw_issues, next_start_at
+
+        # The next page is retrieved while the issues
+        # of the current one are stored
+        nissues = 0
+        for raw_issues in pool.pages(fetch_issues, 0):
+            for issue in self.get_rest_issues(server_url, raw_issues, parser):
+                bugsdb.insert_issue(issue, dbtrk_id)
+            nissues += len(raw_issues)
+
+        return nissues
+
     def basic_jira_url(self):
         serverUrl = self.url.split("/browse/")[0]
         product = self.url.split("/browse/")[1]
@@ -875,62 +1463,58 @@ class JiraBackend(Backend):
         bugs = data_url.split("<issue")[1].split('\"/>')[0].split("total=\"")[1]
         return int(bugs)
 
-    # http://stackoverflow.com/questions/8733233/filtering-out-certain-bytes-in-python
-    def valid_XML_char_ordinal(self, i):
-        return (  # conditions ordered by presumed frequency
-            0x20 <= i <= 0xD7FF
-            or i in (0x9, 0xA, 0xD)
-            or 0xE000 <= i <= 0xFFFD
-            or 0x10000 <= i <= 0x10FFFF)
-
     def safe_xml_parse(self, url_issues, handler):
-        f = self.conn.urlopen_auth(url_issues)
+        # The body is fed to the parser while it is read from the
+        # connection, removing invalid XML characters from each chunk
+        chunks = iter_valid_XML_chunks(self.conn.iter_content_auth(url_issues))
         parser = xml.sax.make_parser()
         parser.setContentHandler(handler)
 
         try:
-            contents = f.read()
-            parser.feed(contents)
+            for chunk in chunks:
+                parser.feed(chunk)
             parser.close()
+        except http.RequestException:
+            printerr("Error retrieving URL: %s" % (url_issues))
+            raise
         except Exception:
-            # Clean only the invalid XML
-            try:
-                parser2 = xml.sax.make_parser()
-                parser2.setContentHandler(handler)
-                parser2.setContentHandler(handler)
-                printdbg("Cleaning dirty XML")
-                cleaned_contents = ''. \
-                    join(c for c in contents if self.valid_XML_char_ordinal(ord(c)))
-                parser2.feed(cleaned_contents)
-                parser2.close()
-            except Exception:
-                printerr("Error parsing URL: %s" % (url_issues))
-                raise
-        f.close()
+            printerr("Error parsing URL: %s" % (url_issues))
+            raise
 
     def analyze_bug_list(self, nissues, offset, bugsdb, dbtrk_id):
         url_issues = self.basic_jira_url()
         url_issues += "&tempMax=" + str(nissues) + "&pager/start=" + str(offset)
         printdbg(url_issues)
 
-        handler = BugsHandler()
+        # Issues are converted and stored while the page is parsed.
+        # Change histories are fetched by the workers of the pool, so
+        # only a few issues ahead are kept in memory
+        pending = collections.deque()
+        lookahead = max(1, pool.get_pool().workers * pool.LOOKAHEAD)
+
+        def store_next_issue():
+            issue = pending.popleft().get()
+            bugsdb.insert_issue(issue, dbtrk_id)
+
+        def on_issue(bug):
+            self.resolver.resolve(handler.getUsernames([bug]))
+            pending.append(pool.get_pool().submit(handler.getIssue, bug, self.conn))
+            while len(pending) > lookahead:
+                store_next_issue()
+
+        handler = BugsHandler(on_issue)
         self.safe_xml_parse(url_issues, handler)
 
-        try:
-            issues = handler.getIssues(self.conn)
-            for issue in issues:
-                bugsdb.insert_issue(issue, dbtrk_id)
-        except Exception, e:
-            import traceback
-            traceback.print_exc()
-            sys.exit(0)
+        while pending:
+            store_next_issue()
 
     def run(self):
         printout("Running Bicho with delay of %s seconds" % (str(self.delay)))
 
         self.conn.login(self.url, self.backend_user, self.backend_password)
 
-        bugsdb = get_database(DBJiraBackend())
+        backend = DBJiraBackend()
+        bugsdb = get_database(backend)
 
         bugsdb.insert_supported_traker("jira", "4.1.2")
         trk = Tracker(self.url.split("-")[0], "jira", "4.1.2")
@@ -940,11 +1524,23 @@ class JiraBackend(Backend):
         query = "/si/jira.issueviews:issue-xml/"
         project = self.url.split("/browse/")[1]
 
+        rest = self.check_rest_api(serverUrl)
+        self.resolver = JiraEmailResolver(bugsdb, backend, dbtrk.id, serverUrl, rest)
+        BugsHandler.resolver = self.resolver
+
         if (project.split("-").__len__() > 1):
             bug_key = project
             project = project.split("-")[0]
             bugs_number = 1
 
+            if rest:
+                parser = JiraRESTParser(serverUrl, self.get_field_names(serverUrl))
+                raw_issue = self.rest_get(serverUrl, "issue/" + bug_key,
+                                          {'expand': 'changelog,renderedFields'})
+                issue = self.get_rest_issues(serverUrl, [raw_issue], parser)[0]
+                bugsdb.insert_issue(issue, dbtrk.id)
+                return
+
             printdbg(serverUrl + query + bug_key + "/" + bug_key + ".xml")
 
             parser = xml.sax.make_parser()
@@ -952,6 +1548,7 @@ class JiraBackend(Backend):
             parser.setContentHandler(handler)
             try:
                 parser.parse(serverUrl + query + bug_key + "/" + bug_key + ".xml")
+                self.resolver.resolve(handler.getUsernames())
                 issue = handler.getIssues(self.conn)[0]
                 bugsdb.insert_issue(issue, dbtrk.id)
             except Exception, e:
@@ -964,6 +1561,12 @@ class JiraBackend(Backend):
                 # self.url = self.url + "&updated:after=" + last_mod_date
                 printdbg("Last bugs cached were modified at: %s" % self.last_mod_date)
 
+            if rest:
+                bugs_number = self.analyze_rest_issues(serverUrl, project,
+                                                       bugsdb, dbtrk.id)
+                printout("Done. %s bugs analyzed" % (bugs_number))
+                return
+
             bugs_number = self.bugsNumber(self.url)
             print "Tickets to be retrieved:", str(bugs_number)
             remaining = bugs_number
@@ -971,7 +1574,6 @@ class JiraBackend(Backend):
                 self.analyze_bug_list(self.max_issues, bugs_number - remaining, bugsdb, dbtrk.id)
                 remaining -= self.max_issues
                 #print "Remaining time: ", (remaining/issues_per_xml_query)*Config.delay/60, "m", "(",remaining,")"
-                time.sleep(self.delay)
 
             printout("Done. %s bugs analyzed" % (bugs_number))
 
@@ -130,12 +130,106 @@ class DBLaunchpadIssueExtMySQL(DBLaunchpadIssueExt):
                      ) ENGINE=MYISAM; '
 
 
+class DBLaunchpadIssueExtSQLite(DBLaunchpadIssueExt):
+    """
+    SQLite subclass of L{DBLaunchpadIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_launchpad ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     status VARCHAR(32) DEFAULT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     description TEXT DEFAULT NULL, \
+                     web_link VARCHAR(256) DEFAULT NULL, \
+                     bug_target_display_name VARCHAR(32) DEFAULT NULL, \
+                     bug_target_name VARCHAR(32) DEFAULT NULL, \
+                     date_assigned DATETIME DEFAULT NULL, \
+                     date_closed DATETIME DEFAULT NULL, \
+                     date_confirmed DATETIME DEFAULT NULL, \
+                     date_created DATETIME DEFAULT NULL, \
+                     date_fix_committed DATETIME DEFAULT NULL, \
+                     date_fix_released DATETIME DEFAULT NULL, \
+                     date_in_progress DATETIME DEFAULT NULL, \
+                     date_incomplete DATETIME DEFAULT NULL, \
+                     date_left_closed DATETIME DEFAULT NULL, \
+                     date_left_new DATETIME DEFAULT NULL, \
+                     date_triaged DATETIME DEFAULT NULL, \
+                     date_last_message DATETIME DEFAULT NULL, \
+                     date_last_updated DATETIME DEFAULT NULL, \
+                     milestone_code_name VARCHAR(32) DEFAULT NULL, \
+                     milestone_data_targeted VARCHAR(32) DEFAULT NULL, \
+                     milestone_name VARCHAR(32) DEFAULT NULL, \
+                     milestone_summary VARCHAR(32) DEFAULT NULL, \
+                     milestone_title VARCHAR(255) DEFAULT NULL, \
+                     milestone_web_link VARCHAR(256) DEFAULT NULL, \
+                     heat INTEGER DEFAULT NULL, \
+                     linked_branches VARCHAR(32) DEFAULT NULL, \
+                     tags VARCHAR(255) DEFAULT NULL, \
+                     title VARCHAR(255) DEFAULT NULL, \
+                     users_affected_count INTEGER DEFAULT NULL, \
+                     web_link_standalone VARCHAR(256) DEFAULT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBLaunchpadIssueExtPostgreSQL(DBLaunchpadIssueExt):
+    """
+    PostgreSQL subclass of L{DBLaunchpadIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_launchpad ( \
+                     id SERIAL PRIMARY KEY, \
+                     status TEXT DEFAULT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     description TEXT DEFAULT NULL, \
+                     web_link TEXT DEFAULT NULL, \
+                     bug_target_display_name TEXT DEFAULT NULL, \
+                     bug_target_name TEXT DEFAULT NULL, \
+                     date_assigned TIMESTAMP DEFAULT NULL, \
+                     date_closed TIMESTAMP DEFAULT NULL, \
+                     date_confirmed TIMESTAMP DEFAULT NULL, \
+                     date_created TIMESTAMP DEFAULT NULL, \
+                     date_fix_committed TIMESTAMP DEFAULT NULL, \
+                     date_fix_released TIMESTAMP DEFAULT NULL, \
+                     date_in_progress TIMESTAMP DEFAULT NULL, \
+                     date_incomplete TIMESTAMP DEFAULT NULL, \
+                     date_left_closed TIMESTAMP DEFAULT NULL, \
+                     date_left_new TIMESTAMP DEFAULT NULL, \
+                     date_triaged TIMESTAMP DEFAULT NULL, \
+                     date_last_message TIMESTAMP DEFAULT NULL, \
+                     date_last_updated TIMESTAMP DEFAULT NULL, \
+                     milestone_code_name TEXT DEFAULT NULL, \
+                     milestone_data_targeted TEXT DEFAULT NULL, \
+                     milestone_name TEXT DEFAULT NULL, \
+                     milestone_summary TEXT DEFAULT NULL, \
+                     milestone_title TEXT DEFAULT NULL, \
+                     milestone_web_link TEXT DEFAULT NULL, \
+                     heat INTEGER DEFAULT NULL, \
+                     linked_branches TEXT DEFAULT NULL, \
+                     tags TEXT DEFAULT NULL, \
+                     title TEXT DEFAULT NULL, \
+                     users_affected_count INTEGER DEFAULT NULL, \
+                     web_link_standalone TEXT DEFAULT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
 class DBLaunchpadBackend(DBBackend):
     """
     Adapter for Launchpad backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBLaunchpadIssueExtMySQL]
+        self.SQLITE_EXT = [DBLaunchpadIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBLaunchpadIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -154,68 +248,64 @@ class DBLaunchpadBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBLaunchpadIssueExt,
-                                      DBLaunchpadIssueExt.issue_id
-                                      ==
-                                      issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBLaunchpadIssueExt(issue_id)
-
-            db_issue_ext.status = self.__return_unicode(issue.status)
-            db_issue_ext.description = self.__return_unicode(issue.description)
-            db_issue_ext.web_link = self.__return_unicode(issue.web_link)
-            db_issue_ext.target_display_name = self.__return_unicode(
-                issue.target_display_name)
-            db_issue_ext.target_name = self.__return_unicode(issue.target_name)
-            db_issue_ext.date_assigned = issue.date_assigned
-            db_issue_ext.date_closed = issue.date_closed
-            db_issue_ext.date_confirmed = issue.date_confirmed
-            db_issue_ext.date_created = issue.date_created
-            db_issue_ext.date_fix_committed = issue.date_fix_committed
-            db_issue_ext.date_fix_released = issue.date_fix_released
-            db_issue_ext.date_in_progress = issue.date_in_progress
-            db_issue_ext.date_incomplete = issue.date_incomplete
-            db_issue_ext.date_left_closed = issue.date_left_closed
-            db_issue_ext.date_left_new = issue.date_left_new
-            db_issue_ext.date_triaged = issue.date_triaged
-            db_issue_ext.date_last_message = issue.date_last_message
-            db_issue_ext.date_last_updated = issue.date_last_updated
-            db_issue_ext.milestone_code_name = self.__return_unicode(
-                issue.milestone_code_name)
-            db_issue_ext.milestone_data_targeted = self.__return_unicode(
-                issue.milestone_data_targeted)
-            db_issue_ext.milestone_name = self.__return_unicode(
-                issue.milestone_name)
-            db_issue_ext.milestone_summary = self.__return_unicode(
-                issue.milestone_summary)
-            db_issue_ext.milestone_title = self.__return_unicode(
-                issue.milestone_title)
-            db_issue_ext.milestone_web_link = self.__return_unicode(
-                issue.milestone_web_link)
-            db_issue_ext.heat = issue.heat
-            db_issue_ext.linked_branches = self.__return_unicode(
-                issue.linked_branches)
+        db_issue_ext = store.find(DBLaunchpadIssueExt,
+                                  DBLaunchpadIssueExt.issue_id
+                                  ==
+                                  issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBLaunchpadIssueExt(issue_id)
+
+        db_issue_ext.status = self.__return_unicode(issue.status)
+        db_issue_ext.description = self.__return_unicode(issue.description)
+        db_issue_ext.web_link = self.__return_unicode(issue.web_link)
+        db_issue_ext.target_display_name = self.__return_unicode(
+            issue.target_display_name)
+        db_issue_ext.target_name = self.__return_unicode(issue.target_name)
+        db_issue_ext.date_assigned = issue.date_assigned
+        db_issue_ext.date_closed = issue.date_closed
+        db_issue_ext.date_confirmed = issue.date_confirmed
+        db_issue_ext.date_created = issue.date_created
+        db_issue_ext.date_fix_committed = issue.date_fix_committed
+        db_issue_ext.date_fix_released = issue.date_fix_released
+        db_issue_ext.date_in_progress = issue.date_in_progress
+        db_issue_ext.date_incomplete = issue.date_incomplete
+        db_issue_ext.date_left_closed = issue.date_left_closed
+        db_issue_ext.date_left_new = issue.date_left_new
+        db_issue_ext.date_triaged = issue.date_triaged
+        db_issue_ext.date_last_message = issue.date_last_message
+        db_issue_ext.date_last_updated = issue.date_last_updated
+        db_issue_ext.milestone_code_name = self.__return_unicode(
+            issue.milestone_code_name)
+        db_issue_ext.milestone_data_targeted = self.__return_unicode(
+            issue.milestone_data_targeted)
+        db_issue_ext.milestone_name = self.__return_unicode(
+            issue.milestone_name)
+        db_issue_ext.milestone_summary = self.__return_unicode(
+            issue.milestone_summary)
+        db_issue_ext.milestone_title = self.__return_unicode(
+            issue.milestone_title)
+        db_issue_ext.milestone_web_link = self.__return_unicode(
+            issue.milestone_web_link)
+        db_issue_ext.heat = issue.heat
+        db_issue_ext.linked_branches = self.__return_unicode(
+            issue.linked_branches)
 
         #### TO DO : create comment instances for
         ## issue.set_messages()
 
-            db_issue_ext.tags = self.__return_unicode(issue.tags)
-            db_issue_ext.title = self.__return_unicode(issue.title)
-            db_issue_ext.users_affected_count = self.__return_int(
-                issue.users_affected_count)
-            db_issue_ext.web_link_standalone = self.__return_unicode(
-                issue.web_link_standalone)
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext.tags = self.__return_unicode(issue.tags)
+        db_issue_ext.title = self.__return_unicode(issue.title)
+        db_issue_ext.users_affected_count = self.__return_int(
+            issue.users_affected_count)
+        db_issue_ext.web_link_standalone = self.__return_unicode(
+            issue.web_link_standalone)
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def __return_int(self, str):
         """
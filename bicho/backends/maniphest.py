@@ -21,19 +21,21 @@
 
 
 import datetime
+import itertools
 import json
 import sys
 import time
 
-import requests
 
 from storm.locals import DateTime, Int, Float, Reference, Unicode, Desc
 
+from bicho import http, pool
 from bicho.config import Config
 from bicho.utils import printout, printdbg, printerr
 from bicho.backends import Backend
 from bicho.common import Tracker, People, Issue, Comment, Change
 from bicho.db.database import DBIssue, DBTracker, DBBackend, NotFoundError, get_database
+from bicho.db.writer import DBWriter
 
 
 def unix_to_datetime(timestamp):
@@ -114,6 +116,52 @@ class DBManiphestIssueExtMySQL(DBManiphestIssueExt):
                      ) ENGINE=MYISAM; '
 
 
+class DBManiphestIssueExtSQLite(DBManiphestIssueExt):
+    """
+    SQLite subclass of L{DBManiphestIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_maniphest ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     issue_id INTEGER NOT NULL, \
+                     phid VARCHAR(64) DEFAULT NULL, \
+                     status_name VARCHAR(64) DEFAULT NULL, \
+                     object_name VARCHAR(32) DEFAULT NULL, \
+                     priority_color VARCHAR(32) DEFAULT NULL, \
+                     points FLOAT DEFAULT NULL, \
+                     uri VARCHAR(255) DEFAULT NULL, \
+                     updated_on DATETIME DEFAULT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBManiphestIssueExtPostgreSQL(DBManiphestIssueExt):
+    """
+    PostgreSQL subclass of L{DBManiphestIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_maniphest ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     phid TEXT DEFAULT NULL, \
+                     status_name TEXT DEFAULT NULL, \
+                     object_name TEXT DEFAULT NULL, \
+                     priority_color TEXT DEFAULT NULL, \
+                     points FLOAT DEFAULT NULL, \
+                     uri TEXT DEFAULT NULL, \
+                     updated_on TIMESTAMP DEFAULT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
 class DBManiphestProjectMySQL(DBManiphestProject):
     """
     MySQL subclass of L{DBManiphestProject}
@@ -129,6 +177,32 @@ class DBManiphestProjectMySQL(DBManiphestProject):
                      ) ENGINE=MYISAM; '
 
 
+class DBManiphestProjectSQLite(DBManiphestProject):
+    """
+    SQLite subclass of L{DBManiphestProject}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS projects_maniphest ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     name VARCHAR(64) NOT NULL, \
+                     phid VARCHAR(64) NOT NULL, \
+                     UNIQUE(phid) \
+                     )'
+
+
+class DBManiphestProjectPostgreSQL(DBManiphestProject):
+    """
+    PostgreSQL subclass of L{DBManiphestProject}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS projects_maniphest ( \
+                     id SERIAL PRIMARY KEY, \
+                     name TEXT NOT NULL, \
+                     phid TEXT NOT NULL, \
+                     UNIQUE(phid) \
+                     )'
+
+
 class DBManiphestIssuesProjectstMySQL(DBManiphestIssueProject):
     """
     MySQL subclass of L{DBManiphestIssueProject}
@@ -153,6 +227,52 @@ class DBManiphestIssuesProjectstMySQL(DBManiphestIssueProject):
                      ) ENGINE=MYISAM; '
 
 
+class DBManiphestIssuesProjectstSQLite(DBManiphestIssueProject):
+    """
+    SQLite subclass of L{DBManiphestIssueProject}
+    """
+
+    __sql_table__ = ['CREATE TABLE IF NOT EXISTS issues_projects_maniphest ( \
+                      id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                      issue_id INTEGER NOT NULL, \
+                      project_id INTEGER NOT NULL, \
+                      UNIQUE(issue_id, project_id), \
+                      FOREIGN KEY(issue_id) \
+                        REFERENCES issues(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE, \
+                      FOREIGN KEY(project_id) \
+                        REFERENCES projects_maniphest(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE \
+                      )',
+                     'CREATE INDEX IF NOT EXISTS ph_project_idx \
+                      ON issues_projects_maniphest (project_id)']
+
+
+class DBManiphestIssuesProjectstPostgreSQL(DBManiphestIssueProject):
+    """
+    PostgreSQL subclass of L{DBManiphestIssueProject}
+    """
+
+    __sql_table__ = ['CREATE TABLE IF NOT EXISTS issues_projects_maniphest ( \
+                      id SERIAL PRIMARY KEY, \
+                      issue_id INTEGER NOT NULL, \
+                      project_id INTEGER NOT NULL, \
+                      UNIQUE(issue_id, project_id), \
+                      FOREIGN KEY(issue_id) \
+                        REFERENCES issues(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE, \
+                      FOREIGN KEY(project_id) \
+                        REFERENCES projects_maniphest(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE \
+                      )',
+                     'CREATE INDEX IF NOT EXISTS ph_project_idx \
+                      ON issues_projects_maniphest (project_id)']
+
+
 
 class DBManiphestBackend(DBBackend):
     """
@@ -161,6 +281,11 @@ class DBManiphestBackend(DBBackend):
     def __init__(self):
         self.MYSQL_EXT = [DBManiphestIssueExtMySQL, DBManiphestProjectMySQL,
                           DBManiphestIssuesProjectstMySQL]
+        self.SQLITE_EXT = [DBManiphestIssueExtSQLite, DBManiphestProjectSQLite,
+                           DBManiphestIssuesProjectstSQLite]
+        self.POSTGRESQL_EXT = [DBManiphestIssueExtPostgreSQL,
+                               DBManiphestProjectPostgreSQL,
+                               DBManiphestIssuesProjectstPostgreSQL]
 
     def get_last_modification_date(self, store, tracker_id):
         result = store.find(DBManiphestIssueExt,
@@ -179,28 +304,24 @@ class DBManiphestBackend(DBBackend):
     def insert_issue_ext(self, store, issue, issue_id):
         is_new = False
 
-        try:
-            db_issue_ext = store.find(DBManiphestIssueExt,
-                                      DBManiphestIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                is_new = True
-                db_issue_ext = DBManiphestIssueExt(issue_id)
-
-            db_issue_ext.phid = self.__to_unicode(issue.phid)
-            db_issue_ext.object_name = self.__to_unicode(issue.object_name)
-            db_issue_ext.status_name = self.__to_unicode(issue.status_name)
-            db_issue_ext.priority_color = self.__to_unicode(issue.priority_color)
-            db_issue_ext.points = issue.points
-            db_issue_ext.uri = self.__to_unicode(issue.uri)
-            db_issue_ext.updated_on = issue.updated_on
-
-            if is_new:
-                store.add(db_issue_ext)
+        db_issue_ext = store.find(DBManiphestIssueExt,
+                                  DBManiphestIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            is_new = True
+            db_issue_ext = DBManiphestIssueExt(issue_id)
 
-            store.flush()
-        except:
-            store.rollback()
-            raise
+        db_issue_ext.phid = self.__to_unicode(issue.phid)
+        db_issue_ext.object_name = self.__to_unicode(issue.object_name)
+        db_issue_ext.status_name = self.__to_unicode(issue.status_name)
+        db_issue_ext.priority_color = self.__to_unicode(issue.priority_color)
+        db_issue_ext.points = issue.points
+        db_issue_ext.uri = self.__to_unicode(issue.uri)
+        db_issue_ext.updated_on = issue.updated_on
+
+        if is_new:
+            store.add(db_issue_ext)
+
+        store.flush()
 
         # Remove all relationships
         self.remove_issues_projects(store, issue_id)
@@ -214,31 +335,29 @@ class DBManiphestBackend(DBBackend):
         return db_issue_ext
 
     def insert_project(self, store, project):
+        # Projects are looked up before inserting them, because a
+        # failed INSERT aborts the whole transaction on PostgreSQL.
+        # Changes are committed with the rest of the issue
         try:
+            db_project = self._get_db_project(store, project.phid)
+            db_project.name = unicode(project.name)
+        except NotFoundError:
             db_project = DBManiphestProject(unicode(project.name),
                                             unicode(project.phid))
             store.add(db_project)
-            store.commit()
-        except:
-            db_project = self._get_db_project(store, project.phid)
-            db_project.name = project.name
-            store.commit()
+            store.flush()
         return db_project
 
     def insert_issue_project(self, store, issue_id, project_id):
-        try:
-            db_rel = DBManiphestIssueProject(issue_id, project_id)
-            store.add(db_rel)
-            store.commit()
-        except:
-            pass
+        db_rel = store.find(DBManiphestIssueProject,
+                            DBManiphestIssueProject.issue_id == issue_id,
+                            DBManiphestIssueProject.project_id == project_id).one()
+        if db_rel is None:
+            store.add(DBManiphestIssueProject(issue_id, project_id))
+            store.flush()
 
     def remove_issues_projects(self, store, issue_id):
-        result = self._get_db_issues_projects(store, issue_id)
-
-        for r in result:
-            store.remove(r)
-        store.commit()
+        self._get_db_issues_projects(store, issue_id).remove()
 
     def insert_comment_ext(self, store, comment, comment_id):
         pass
@@ -486,9 +605,9 @@ class Conduit(object):
                 'output' : 'json',
                 '__conduit__' : True}
 
-        req = requests.post('%s/api/%s' % (self.url, method),
-                            headers=self.HEADERS,
-                            data=data)
+        req = http.post('%s/api/%s' % (self.url, method),
+                        headers=self.HEADERS,
+                        data=data)
         printdbg("Conduit %s method called: %s" % (method, req.url))
 
         # Raise HTTP errors, if any
@@ -567,11 +686,11 @@ class Maniphest(Backend):
             printdbg("Credentials checked")
 
             return True
-        except (requests.exceptions.HTTPError, ConduitError), e:
+        except (http.HTTPError, ConduitError), e:
             printerr("Error: %s" % e)
             return False
 
-    def get_issue_from_task(self, pht):
+    def get_issue_from_task(self, pht, phtrans=None):
         printdbg("Parsing task %s (%s) - date: %s" \
                  % (pht['objectName'], pht['phid'], pht['dateModified']))
 
@@ -630,7 +749,8 @@ class Maniphest(Backend):
             issue.add_watcher(subscriber)
 
         # Retrieve comments and changes
-        phtrans = self.conduit.transactions(pht['id'])
+        if phtrans is None:
+            phtrans = self.conduit.transactions(pht['id'])
         comments, changes = self.get_events_from_transactions(phtrans)
 
         for comment in comments:
@@ -727,6 +847,28 @@ class Maniphest(Backend):
             self.projects[project.phid] = project
         return prjs
 
+    def fetch_tasks(self, count, as_id, last_mod_date):
+        if as_id:
+            printout("Fetching tasks from %s id to %s id" % (count, count + self.max_issues - 1))
+        else:
+            printout("Fetching tasks from %s to %s" % (count, count + self.max_issues))
+
+        ph_tasks = self.conduit.tasks(offset=count,
+                                      limit=self.max_issues,
+                                      as_id=as_id)
+
+        # Tasks are sorted by modification date, so there is no
+        # need to fetch more once an up to date task is found
+        if not ph_tasks:
+            next_count = None
+        elif self.up_to_date(last_mod_date,
+                             unix_to_datetime(ph_tasks[-1]['dateModified'])):
+            next_count = None
+        else:
+            next_count = count + self.max_issues
+
+        return ph_tasks, next_count
+
     def fetch_and_store_tasks(self):
         printdbg("Fetching tasks")
 
@@ -742,8 +884,6 @@ class Maniphest(Backend):
         if self.from_id:
             count = self.from_id
             as_id = True
-
-            printout("Fetching tasks from %s id to %s id" % (count, count + self.max_issues - 1))
         else:
             as_id = False
 
@@ -752,13 +892,20 @@ class Maniphest(Backend):
             if self.start_from:
                 printdbg("Ignoring tasks after %s" % str(self.start_from))
 
-            printout("Fetching tasks from %s to %s" % (count, count + self.max_issues))
+        # The next page of tasks is fetched while
+        # the tasks of the current one are stored
+        pages = pool.pages(lambda count: self.fetch_tasks(count, as_id, last_mod_date),
+                           count)
 
-        ph_tasks = self.conduit.tasks(offset=count,
-                                      limit=self.max_issues,
-                                      as_id=as_id)
+        for npage, ph_tasks in enumerate(pages):
+            if not ph_tasks:
+                if npage > 0:
+                    printdbg("No more tasks fetched")
+                    printout("Up to date")
+                break
+
+            tasks = []
 
-        while ph_tasks:
             for pht in ph_tasks:
                 updated_on = unix_to_datetime(pht['dateModified'])
 
@@ -771,10 +918,18 @@ class Maniphest(Backend):
                              (pht['objectName'] ,str(updated_on)))
                     continue
 
-                issue = self.get_issue_from_task(pht)
+                tasks.append(pht)
+
+            # Transactions are fetched by the workers of the pool
+            # and parsed in order
+            transactions = pool.imap(lambda pht: self.conduit.transactions(pht['id']),
+                                     tasks)
+
+            for pht, phtrans in itertools.izip(tasks, transactions):
+                issue = self.get_issue_from_task(pht, phtrans)
 
                 # Insert issue
-                self.db.insert_issue(issue, dbtrk.id)
+                self.writer.insert_issue(issue, dbtrk.id)
 
                 nbugs += 1
 
@@ -782,21 +937,6 @@ class Maniphest(Backend):
                 printout("Up to date")
                 break
 
-            count = count + self.max_issues
-
-            if as_id:
-                printout("Fetching tasks from %s id to %s id" % (count, count + self.max_issues - 1))
-            else:
-                printout("Fetching tasks from %s to %s" % (count, count + self.max_issues))
-
-            ph_tasks = self.conduit.tasks(offset=count,
-                                          limit=self.max_issues,
-                                          as_id=as_id)
-
-            if not ph_tasks:
-                printdbg("No more tasks fetched")
-                printout("Up to date")
-
         printout("Done. %s bugs analyzed" % (nbugs))
 
     def run(self):
@@ -805,9 +945,11 @@ class Maniphest(Backend):
         if not self.check_auth():
             sys.exit(1)
 
+        self.writer = DBWriter(self.db)
         try:
-            self.fetch_and_store_tasks()
-        except (requests.exceptions.HTTPError, ConduitError), e:
+            with self.writer:
+                self.fetch_and_store_tasks()
+        except (http.HTTPError, ConduitError), e:
             printerr("Error: %s" % e)
             sys.exit(1)
 
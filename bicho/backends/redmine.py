@@ -20,10 +20,8 @@
 #          Santiago Dueñas <sduenas@bitergia.com>
 #
 
+import itertools
 import json
-import time
-import urllib2
-import base64
 import pprint
 import re
 
@@ -33,10 +31,12 @@ from storm.locals import DateTime, Desc, Int, Reference
 
 from BeautifulSoup import BeautifulSoup
 
+from bicho import http, pool
 from bicho.config import Config
 from bicho.backends import Backend
 from bicho.utils import printdbg, printout
 from bicho.db.database import DBIssue, DBBackend, DBTracker, get_database
+from bicho.db.writer import DBWriter
 from bicho.common import Tracker, Issue, People, Change, Comment
 
 
@@ -100,48 +100,106 @@ class DBRedmineIssueExtMySQL(DBRedmineIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBRedmineIssueExtSQLite(DBRedmineIssueExt):
+    """
+    SQLite subclass of L{DBRedmineIssueExt}
+    """
+
+    # If the table is changed you need to remove old from database
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_redmine ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     category_id INTEGER, \
+                     done_ratio INTEGER, \
+                     due_date DATETIME, \
+                     estimated_hours INTEGER, \
+                     fixed_version_id INTEGER, \
+                     lft INTEGER, \
+                     rgt INTEGER, \
+                     lock_version INTEGER, \
+                     parent_id INTEGER, \
+                     project_id INTEGER, \
+                     root_id INTEGER, \
+                     start_date DATETIME, \
+                     tracker_id INTEGER, \
+                     updated_on DATETIME, \
+                     issue_id INTEGER, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBRedmineIssueExtPostgreSQL(DBRedmineIssueExt):
+    """
+    PostgreSQL subclass of L{DBRedmineIssueExt}
+    """
+
+    # If the table is changed you need to remove old from database
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_redmine ( \
+                     id SERIAL PRIMARY KEY, \
+                     category_id INTEGER, \
+                     done_ratio INTEGER, \
+                     due_date TIMESTAMP, \
+                     estimated_hours INTEGER, \
+                     fixed_version_id INTEGER, \
+                     lft INTEGER, \
+                     rgt INTEGER, \
+                     lock_version INTEGER, \
+                     parent_id INTEGER, \
+                     project_id INTEGER, \
+                     root_id INTEGER, \
+                     start_date TIMESTAMP, \
+                     tracker_id INTEGER, \
+                     updated_on TIMESTAMP, \
+                     issue_id INTEGER, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
 class DBRedmineBackend(DBBackend):
     """
     Adapter for Redmine backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBRedmineIssueExtMySQL]
+        self.SQLITE_EXT = [DBRedmineIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBRedmineIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBRedmineIssueExt,
-                                      DBRedmineIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBRedmineIssueExt(issue_id)
-                #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
-
-            db_issue_ext.category_id = issue.category_id
-            db_issue_ext.done_ratio = issue.done_ratio
-            #db_issue_ext.due_date = issue.due_date
-            #db_issue_ext.estimated_hours = issue.estimated_hours
-            db_issue_ext.fixed_version_id = issue.fixed_version_id
-            #db_issue_ext.lft = issue.lft
-            #db_issue_ext.rgt = issue.rgt
-            #db_issue_ext.lock_version = issue.lock_version
-            #db_issue_ext.parent_id = issue.parent_id
-            db_issue_ext.project_id = issue.project_id
-            #db_issue_ext.root_id = issue.root_id
-            db_issue_ext.start_date = issue.start_date
-            db_issue_ext.tracker_id = issue.tracker_id
-            db_issue_ext.updated_on = issue.updated_on
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBRedmineIssueExt,
+                                  DBRedmineIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBRedmineIssueExt(issue_id)
+            #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
+
+        db_issue_ext.category_id = issue.category_id
+        db_issue_ext.done_ratio = issue.done_ratio
+        #db_issue_ext.due_date = issue.due_date
+        #db_issue_ext.estimated_hours = issue.estimated_hours
+        db_issue_ext.fixed_version_id = issue.fixed_version_id
+        #db_issue_ext.lft = issue.lft
+        #db_issue_ext.rgt = issue.rgt
+        #db_issue_ext.lock_version = issue.lock_version
+        #db_issue_ext.parent_id = issue.parent_id
+        db_issue_ext.project_id = issue.project_id
+        #db_issue_ext.root_id = issue.root_id
+        db_issue_ext.start_date = issue.start_date
+        db_issue_ext.tracker_id = issue.tracker_id
+        db_issue_ext.updated_on = issue.updated_on
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def insert_change_ext(self, store, change, change_id):
         """
@@ -214,7 +272,7 @@ class Redmine():
     def _get_statuses(self):
         root = self._get_redmine_root(Config.url)
         statuses_url = root + "issue_statuses.json"
-        f = urllib2.urlopen(statuses_url)
+        f = http.urlopen(statuses_url)
         statuses = json.loads(f.read())
 
         for status in statuses["issue_statuses"]:
@@ -230,17 +288,17 @@ class Redmine():
         #print author_url
         identity = None
         try:
-            f = urllib2.urlopen(author_url)
+            f = http.urlopen(author_url)
             person = json.loads(f.read())
             identity = person['user']['mail']
-        except (urllib2.HTTPError, KeyError):
+        except (http.HTTPError, KeyError):
             printdbg("User with id %s has no account information" % author_id)
             identity = author_id
 
         self.identities[author_id] = identity
         return identity
 
-    def analyze_bug(self, issue_redmine):
+    def analyze_bug(self, issue_redmine, journals=None):
         #print(issue_redmine)
         #print("*** %s " % issue_redmine["author"]["id"])
         try:
@@ -315,7 +373,7 @@ class Redmine():
             issue.updated_on = None
 
         # Parse journals (comments and changes)
-        self._parse_journals(issue, issue_redmine["id"])
+        self._parse_journals(issue, issue_redmine["id"], journals)
 
         print("Issue #%s updated on %s" % (issue_redmine["id"], issue.updated_on))
 
@@ -341,13 +399,26 @@ class Redmine():
         issue_url = issue_url + "issues/" + unicode(issue_id) + ".json?include=journals"
         return issue_url
 
-    def _parse_journals(self, issue, issue_id):
+    def _analyze_bugs(self, tickets):
+        # Journals are fetched by the workers of the pool
+        # and parsed in order
+        journals = pool.imap(lambda ticket: self._fetch_journals(ticket["id"]),
+                             tickets)
+
+        for ticket, ticket_journals in itertools.izip(tickets, journals):
+            yield self.analyze_bug(ticket, ticket_journals)
+
+    def _fetch_journals(self, issue_id):
         issue_url = self._get_issue_url(issue_id)
 
         printdbg("Analyzing issue journals " + issue_url)
-        f = urllib2.urlopen(issue_url)
+        f = http.urlopen(issue_url)
         data = json.loads(f.read())
-        journals = data["issue"]["journals"]
+        return data["issue"]["journals"]
+
+    def _parse_journals(self, issue, issue_id, journals=None):
+        if journals is None:
+            journals = self._fetch_journals(issue_id)
 
         for journal in journals:
             try:
@@ -430,50 +501,44 @@ class Redmine():
         updated_on = bugsdb.get_last_modification_date(tracker_id=dbtrk.id)
         self.url_issues = self._get_issues_url(updated_on)
         url = self.url_issues + "&page=" + str(last_page)
-        request = urllib2.Request(url)
+        auth = None
 
         if self.backend_user:
-            base64string = base64.encodestring('%s:%s' % (Config.backend_user, Config.backend_password)).replace('\n', '')
-            request.add_header("Authorization", "Basic %s" % base64string)   
+            auth = (Config.backend_user, Config.backend_password)
 
         # Get statuses
         self._get_statuses()
 
-        f = urllib2.urlopen(request)
-        tickets = json.loads(f.read())
+        writer = DBWriter(bugsdb)
+        with writer:
+            f = http.urlopen(url, auth=auth)
+            tickets = json.loads(f.read())
 
-        if not tickets["issues"]:
-            printout("Done. No new bugs to analyze")
-            return
+            if not tickets["issues"]:
+                printout("Done. No new bugs to analyze")
+                return
 
-        for ticket in tickets["issues"]:
-            issue = self.analyze_bug(ticket)
-            bugsdb.insert_issue(issue, dbtrk.id)
-            time.sleep(self.delay)
+            for issue in self._analyze_bugs(tickets["issues"]):
+                writer.insert_issue(issue, dbtrk.id)
 
-        last_ticket = tickets["issues"][0]['id']
+            last_ticket = tickets["issues"][0]['id']
 
-        while True:
-            last_page += 1
-            url = self.url_issues + "&page=" + str(last_page)
-            request = urllib2.Request(url)
-            #base64string = base64.encodestring('%s:%s' % (Config.backend_user, Config.backend_password)).replace('\n', '')
-            #request.add_header("Authorization", "Basic %s" % base64string)
-            f = urllib2.urlopen(request)
-            tickets = json.loads(f.read())
+            while True:
+                last_page += 1
+                url = self.url_issues + "&page=" + str(last_page)
+                f = http.urlopen(url)
+                tickets = json.loads(f.read())
 
-            if len(tickets['issues']) == 0:
-                break
+                if len(tickets['issues']) == 0:
+                    break
 
-            pprint.pprint("Tickets read: " + str(tickets["issues"][0]['id']) + " " + str(tickets["issues"][-1]['id']))
+                pprint.pprint("Tickets read: " + str(tickets["issues"][0]['id']) + " " + str(tickets["issues"][-1]['id']))
 
-            if tickets["issues"][0]['id'] == last_ticket:
-                break
+                if tickets["issues"][0]['id'] == last_ticket:
+                    break
 
-            for ticket in tickets["issues"]:
-                issue = self.analyze_bug(ticket)
-                bugsdb.insert_issue(issue, dbtrk.id)
-                time.sleep(self.delay)
+                for issue in self._analyze_bugs(tickets["issues"]):
+                    writer.insert_issue(issue, dbtrk.id)
 
         pprint.pprint("Total pages: " + str(last_page))
 
@@ -20,21 +20,22 @@
 #
 
 import datetime
+import itertools
 import sys
-import time
 import urlparse
 
 import dateutil.parser
-import requests
 
 from storm.locals import Int, DateTime, Reference, Unicode, Desc
 
 from bicho.backends import Backend
 from bicho.common import Tracker, People, Issue, Comment, Change
+from bicho import http, pool
 from bicho.config import Config
 from bicho.utils import printout, printdbg, printerr
 
 from bicho.db.database import DBIssue, DBTracker, DBBackend, get_database
+from bicho.db.writer import DBWriter
 
 
 STATUS_FIELD = unicode('status')
@@ -83,12 +84,52 @@ class DBReviewBoardIssueExtMySQL(DBReviewBoardIssueExt):
                      ) ENGINE=MYISAM; '
 
 
+class DBReviewBoardIssueExtSQLite(DBReviewBoardIssueExt):
+    """
+    SQLite subclass of L{DBReviewBoardIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_gerrit ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     issue_id INTEGER NOT NULL, \
+                     mod_date DATETIME DEFAULT NULL, \
+                     branch TEXT, \
+                     uri TEXT, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBReviewBoardIssueExtPostgreSQL(DBReviewBoardIssueExt):
+    """
+    PostgreSQL subclass of L{DBReviewBoardIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_gerrit ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     mod_date TIMESTAMP DEFAULT NULL, \
+                     branch TEXT, \
+                     uri TEXT, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
 class DBReviewBoardBackend(DBBackend):
     """
     Adapter for Trac backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBReviewBoardIssueExtMySQL]
+        self.SQLITE_EXT = [DBReviewBoardIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBReviewBoardIssueExtPostgreSQL]
 
     def get_last_modification_date(self, store, tracker_id):
         result = store.find(DBReviewBoardIssueExt,
@@ -107,24 +148,20 @@ class DBReviewBoardBackend(DBBackend):
     def insert_issue_ext(self, store, issue, issue_id):
         is_new = False
 
-        try:
-            db_issue_ext = store.find(DBReviewBoardIssueExt,
-                                      DBReviewBoardIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                is_new = True
-                db_issue_ext = DBReviewBoardIssueExt(issue_id)
+        db_issue_ext = store.find(DBReviewBoardIssueExt,
+                                  DBReviewBoardIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            is_new = True
+            db_issue_ext = DBReviewBoardIssueExt(issue_id)
 
-                db_issue_ext.mod_date = issue.mod_date
-                db_issue_ext.branch = issue.branch
-                db_issue_ext.uri = issue.uri
+            db_issue_ext.mod_date = issue.mod_date
+            db_issue_ext.branch = issue.branch
+            db_issue_ext.uri = issue.uri
 
-            if is_new:
-                store.add(db_issue_ext)
+        if is_new:
+            store.add(db_issue_ext)
 
-            store.flush()
-        except:
-            store.rollback()
-            raise
+        store.flush()
 
     def insert_comment_ext(self, store, comment, comment_id):
         pass
@@ -262,8 +299,8 @@ class ReviewBoardAPIClient(object):
     def call(self, method, params):
         url = self.URL % {'base' : self.url, 'method' : method}
 
-        req = requests.get(url, params=params,
-                           headers=self.HEADERS)
+        req = http.get(url, params=params,
+                       headers=self.HEADERS)
 
         printdbg("Review Board %s method called: %s" % (method, req.url))
 
@@ -341,7 +378,7 @@ class ReviewBoard(Backend):
 
         return identity
 
-    def get_review_request(self, raw_rq):
+    def get_review_request(self, raw_rq, activity=None):
         printdbg("Parsing review request %s - date: %s" \
                  % (raw_rq['id'], raw_rq['last_updated']))
 
@@ -368,13 +405,12 @@ class ReviewBoard(Backend):
         rq.set_branch(branch)
         rq.set_uri(url)
 
-        # Get changes
-        printdbg("Fetching review request changes from %s" % (rq_id))
-        changes = self.fetch_review_changes(rq)
+        if activity is None:
+            activity = self.fetch_activity(raw_rq)
+        raw_changes, raw_reviews = activity
 
-        # Get reviews
-        printdbg("Fetching review request reviews from %s" % (rq_id))
-        reviews = self.fetch_reviews(rq)
+        changes = self.fetch_review_changes(rq, raw_changes)
+        reviews = self.fetch_reviews(rq, raw_reviews)
 
         # Complete review request activity
         activity = self.process_review_request_activity(changes, reviews)
@@ -401,9 +437,23 @@ class ReviewBoard(Backend):
                 continue
         return activity
 
-    def fetch_reviews(self, rq):
-        result = self.api_client.review_request_reviews(rq.issue)
-        raw_reviews = result['reviews']
+    def fetch_activity(self, raw_rq):
+        rq_id = unicode(raw_rq['id'])
+
+        # Get changes
+        printdbg("Fetching review request changes from %s" % (rq_id))
+        raw_changes = self.api_client.review_request_changes(rq_id)['changes']
+
+        # Get reviews
+        printdbg("Fetching review request reviews from %s" % (rq_id))
+        raw_reviews = self.api_client.review_request_reviews(rq_id)['reviews']
+
+        return raw_changes, raw_reviews
+
+    def fetch_reviews(self, rq, raw_reviews=None):
+        if raw_reviews is None:
+            result = self.api_client.review_request_reviews(rq.issue)
+            raw_reviews = result['reviews']
 
         reviews = []
 
@@ -426,9 +476,10 @@ class ReviewBoard(Backend):
 
         return reviews
 
-    def fetch_review_changes(self, rq):
-        result = self.api_client.review_request_changes(rq.issue)
-        raw_changes = result['changes']
+    def fetch_review_changes(self, rq, raw_changes=None):
+        if raw_changes is None:
+            result = self.api_client.review_request_changes(rq.issue)
+            raw_changes = result['changes']
 
         last_rev = unicode(1)
         author = rq.submitted_by
@@ -487,6 +538,22 @@ class ReviewBoard(Backend):
     def str_to_datetime(self, s):
         return dateutil.parser.parse(s, ignoretz=True)
 
+    def fetch_review_requests(self, offset, last_mod_date):
+        printout("Fetching reviews requests from %s to %s" % (offset, offset + self.max_issues))
+
+        result = self.api_client.review_requests(offset=offset,
+                                                 limit=self.max_issues,
+                                                 group=self.group,
+                                                 last_date=last_mod_date)
+        raw_rqs = result['review_requests']
+
+        if raw_rqs:
+            next_offset = offset + self.max_issues
+        else:
+            next_offset = None
+
+        return raw_rqs, next_offset
+
     def fetch_and_store(self):
         printdbg("Fetching reviews from")
 
@@ -502,43 +569,35 @@ class ReviewBoard(Backend):
         if last_mod_date:
             printdbg("Last modification date stored: %s" % last_mod_date)
 
-        printout("Fetching reviews requests from %s to %s" % (offset, offset + self.max_issues))
+        # The next page of review requests is fetched while
+        # the ones of the current page are stored
+        pages = pool.pages(lambda offset: self.fetch_review_requests(offset, last_mod_date),
+                           offset)
 
-        result = self.api_client.review_requests(offset=offset,
-                                                 limit=self.max_issues,
-                                                 group=self.group,
-                                                 last_date=last_mod_date)
-        raw_rqs = result['review_requests']
-
-        while raw_rqs:
+        for raw_rqs in pages:
             total_rqs += len(raw_rqs)
 
-            for raw_rq in raw_rqs:
-                rq = self.get_review_request(raw_rq)
+            # Changes and reviews are fetched by the workers
+            # of the pool and parsed in order
+            activities = pool.imap(self.fetch_activity, raw_rqs)
+
+            for raw_rq, activity in itertools.izip(raw_rqs, activities):
+                rq = self.get_review_request(raw_rq, activity)
 
                 # Insert review request
-                self.db.insert_issue(rq, dbtrk.id)
+                self.writer.insert_issue(rq, dbtrk.id)
                 nrqs += 1
 
-            time.sleep(self.delay)
-
-            offset += self.max_issues
-            printout("Fetching reviews requests from %s to %s" % (offset, offset + self.max_issues))
-
-            result = self.api_client.review_requests(offset=offset,
-                                                     limit=self.max_issues,
-                                                     group=self.group,
-                                                     last_date=last_mod_date)
-            raw_rqs = result['review_requests']
-
         printout("Done. %s review requests analyzed from %s" % (nrqs, total_rqs))
 
     def run(self):
         printout("Running Bicho - url: %s" % self.url)
 
+        self.writer = DBWriter(self.db)
         try:
-            self.fetch_and_store()
-        except (requests.exceptions.HTTPError, ReviewBoardAPIError), e:
+            with self.writer:
+                self.fetch_and_store()
+        except (http.HTTPError, ReviewBoardAPIError), e:
             printerr("Error: %s" % e)
             sys.exit(1)
 
@@ -27,13 +27,12 @@ The SourceForge backend is abandoned and nonfunctional as of November 2013.
 
 import re
 import urlparse
-import urllib2
 import sys
-import time
 
 import BeautifulSoup
 from storm.locals import Int, Unicode, Reference
 
+from bicho import http
 from bicho.common import Issue, People, Tracker, Comment, Attachment, Change
 from bicho.backends import Backend
 from bicho.db.database import DBIssue, DBBackend, get_database
@@ -163,12 +162,48 @@ class DBSourceForgeIssueExtMySQL(DBSourceForgeIssueExt):
                      ) ENGINE=MYISAM;'
 
 
+class DBSourceForgeIssueExtSQLite(DBSourceForgeIssueExt):
+    """
+    SQLite subclass of L{DBSourceForgeIssueExt}
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_sf ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     category VARCHAR(32) NOT NULL, \
+                     group_sf VARCHAR(32) NOT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBSourceForgeIssueExtPostgreSQL(DBSourceForgeIssueExt):
+    """
+    PostgreSQL subclass of L{DBSourceForgeIssueExt}
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_sf ( \
+                     id SERIAL PRIMARY KEY, \
+                     category TEXT NOT NULL, \
+                     group_sf TEXT NOT NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
 class DBSourceForgeBackend(DBBackend):
     """
     Adapter for SourceForge backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBSourceForgeIssueExtMySQL]
+        self.SQLITE_EXT = [DBSourceForgeIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBSourceForgeIssueExtPostgreSQL]
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -187,25 +222,21 @@ class DBSourceForgeBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBSourceForgeIssueExt,
-                                      DBSourceForgeIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBSourceForgeIssueExt(issue_id)
-                #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
+        db_issue_ext = store.find(DBSourceForgeIssueExt,
+                                  DBSourceForgeIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBSourceForgeIssueExt(issue_id)
+            #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
 
-            db_issue_ext.category = unicode(issue.category)
-            db_issue_ext.group = unicode(issue.group)
+        db_issue_ext.category = unicode(issue.category)
+        db_issue_ext.group = unicode(issue.group)
 
-            if newIssue is True:
-                store.add(db_issue_ext)
+        if newIssue is True:
+            store.add(db_issue_ext)
 
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        store.flush()
+        return db_issue_ext
 
     def insert_comment_ext(self, store, comment, comment_id):
         """
@@ -640,8 +671,6 @@ class SourceForge():
             issue = self.__get_issue(url)
             self.__insert_issue(issue)
 
-            time.sleep(self.delay)
-
         printout("Done. %s bugs analyzed" % (nbugs))
 
     def __get_issues_list(self, url):
@@ -684,7 +713,7 @@ class SourceForge():
     def __get_html(self, url):
         """
         """
-        html = urllib2.urlopen(url).read()
+        html = http.urlopen(url).read()
         return html
 
     def __check_tracker_url(self, url):
@@ -721,7 +750,7 @@ Backend.register_backend('sf', SourceForge)
 
 if __name__ == "__main__":
     url = "http://sourceforge.net/tracker/?func=detail&aid=3178299&group_id=152568&atid=784665"
-    html = urllib2.urlopen(url)
+    html = http.urlopen(url)
 
     parser = SourceForgeParser()
     parser.parse_issue(html)
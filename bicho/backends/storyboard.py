@@ -19,6 +19,7 @@
 # Authors:  Alvaro del Castillo <acs@bitergia.com>
 #
 
+from bicho import http, pool
 from bicho.config import Config
 
 from bicho.backends import Backend
@@ -37,9 +38,7 @@ import os
 import pprint
 import random
 import sys
-import time
 import traceback
-import urllib
 
 
 from storm.locals import DateTime, Desc, Int, Reference, Unicode, Bool
@@ -114,42 +113,114 @@ class DBStoryBoardIssueExtMySQL(DBStoryBoardIssueExt):
                     ON UPDATE CASCADE \
                      ) ENGINE=MYISAM;'
 
+
+class DBStoryBoardStorySQLite(DBStoryBoardStory):
+    """
+    SQLite subclass of L{DBStoryBoardStory}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS stories ( \
+                    story_id INTEGER NOT NULL, \
+                    created_at DATETIME, \
+                    updated_at DATETIME, \
+                    status VARCHAR(255), \
+                    creator_id INTEGER NOT NULL, \
+                    is_bug BOOLEAN, \
+                    title TEXT, \
+                    description TEXT, \
+                    tags TEXT, \
+                    PRIMARY KEY(story_id) \
+                     )'
+
+
+class DBStoryBoardStoryPostgreSQL(DBStoryBoardStory):
+    """
+    PostgreSQL subclass of L{DBStoryBoardStory}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS stories ( \
+                    story_id INTEGER NOT NULL, \
+                    created_at TIMESTAMP, \
+                    updated_at TIMESTAMP, \
+                    status TEXT, \
+                    creator_id INTEGER NOT NULL, \
+                    is_bug BOOLEAN, \
+                    title TEXT, \
+                    description TEXT, \
+                    tags TEXT, \
+                    PRIMARY KEY(story_id) \
+                     )'
+
+
+class DBStoryBoardIssueExtSQLite(DBStoryBoardIssueExt):
+    """
+    SQLite subclass of L{DBStoryBoardIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_storyboard ( \
+                    id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                    project_id INTEGER, \
+                    story_id INTEGER NOT NULL, \
+                    mod_date DATETIME, \
+                    issue_id INTEGER NOT NULL, \
+                    FOREIGN KEY(issue_id) \
+                    REFERENCES tasks (id) \
+                    ON DELETE CASCADE \
+                    ON UPDATE CASCADE \
+                     )'
+
+
+class DBStoryBoardIssueExtPostgreSQL(DBStoryBoardIssueExt):
+    """
+    PostgreSQL subclass of L{DBStoryBoardIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_storyboard ( \
+                    id SERIAL PRIMARY KEY, \
+                    project_id INTEGER, \
+                    story_id INTEGER NOT NULL, \
+                    mod_date TIMESTAMP, \
+                    issue_id INTEGER NOT NULL, \
+                    FOREIGN KEY(issue_id) \
+                    REFERENCES issues (id) \
+                    ON DELETE CASCADE \
+                    ON UPDATE CASCADE \
+                     )'
+
 class DBStoryBoardBackend(DBBackend):
     """
     Adapter for StoryBoard backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBStoryBoardIssueExtMySQL,DBStoryBoardStoryMySQL]
+        self.SQLITE_EXT = [DBStoryBoardIssueExtSQLite,DBStoryBoardStorySQLite]
+        self.POSTGRESQL_EXT = [DBStoryBoardIssueExtPostgreSQL,DBStoryBoardStoryPostgreSQL]
 
     def insert_story(self, store, story):
         newStory = False
-        try:
-            db_story = store.find(DBStoryBoardStory,
-                                  DBStoryBoardStory.story_id == story['id']).one()
-            if not db_story:
-                newStory = True
-                db_story = DBStoryBoardStory(story['id'])
-
-            db_story.updated_at = StoryBoard.convert_to_datetime(story['updated_at'])
-            db_story.created_at = StoryBoard.convert_to_datetime(story['created_at'])
-            db_story.status = story['status']
-            if story['creator_id']:
-                db_story.creator_id = story['creator_id']
-            else:
-                db_story.creator_id = -1
-            db_story.is_bug = story['is_bug']
-            db_story.description = story['description']
-            db_story.title = story['title']
-            db_story.tags = unicode(";".join(story['tags']))
+        db_story = store.find(DBStoryBoardStory,
+                              DBStoryBoardStory.story_id == story['id']).one()
+        if not db_story:
+            newStory = True
+            db_story = DBStoryBoardStory(story['id'])
+
+        db_story.updated_at = StoryBoard.convert_to_datetime(story['updated_at'])
+        db_story.created_at = StoryBoard.convert_to_datetime(story['created_at'])
+        db_story.status = story['status']
+        if story['creator_id']:
+            db_story.creator_id = story['creator_id']
+        else:
+            db_story.creator_id = -1
+        db_story.is_bug = story['is_bug']
+        db_story.description = story['description']
+        db_story.title = story['title']
+        db_story.tags = unicode(";".join(story['tags']))
 
-            if newStory is True:
-                store.add(db_story)
+        if newStory is True:
+            store.add(db_story)
 
-            store.flush()
-            return db_story
-        except:
-            store.rollback()
-            raise
+        store.flush()
+        return db_story
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -168,31 +239,27 @@ class DBStoryBoardBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBStoryBoardIssueExt,
-                                      DBStoryBoardIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBStoryBoardIssueExt(issue_id)
-                #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
+        db_issue_ext = store.find(DBStoryBoardIssueExt,
+                                  DBStoryBoardIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBStoryBoardIssueExt(issue_id)
+            #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
 
 
-            self.project_id = None
-            self.story_id = None
-            self.mod_date = None
+        self.project_id = None
+        self.story_id = None
+        self.mod_date = None
 
-            db_issue_ext.project_id = issue.project_id
-            db_issue_ext.story_id = issue.story_id
-            db_issue_ext.mod_date = issue.mod_date
+        db_issue_ext.project_id = issue.project_id
+        db_issue_ext.story_id = issue.story_id
+        db_issue_ext.mod_date = issue.mod_date
 
-            if newIssue is True:
-                store.add(db_issue_ext)
+        if newIssue is True:
+            store.add(db_issue_ext)
 
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        store.flush()
+        return db_issue_ext
 
     def insert_change_ext(self, store, change, change_id):
         """
@@ -321,6 +388,42 @@ class StoryBoard():
             str = str[2:len(str) - 1]
         return str
 
+    def get_pages(self, url, name, total_pages, is_last=None):
+        """
+        Return an iterator over the pages of items of the given url.
+        The next page is fetched while the current one is processed.
+
+        @param url: url of the items, with the limit per page
+        @param name: name of the items, used for logging
+        @param total_pages: last page to fetch, starting from 0
+        @param is_last: function that checks whether the given page
+            is the last one needed
+        """
+        def fetch_page(cursor):
+            page, marker = cursor
+
+            # The marker is the resource id where the page should begin
+            if marker:
+                url_page = url + "&marker=" + str(marker)
+            else:
+                url_page = url
+
+            logging.info("URL for next " + name + " " + url_page)
+
+            f = http.urlopen(url_page)
+            items = json.loads(f.read())
+
+            if not items or page >= total_pages:
+                next_cursor = None
+            elif is_last and is_last(items):
+                next_cursor = None
+            else:
+                next_cursor = (page + 1, items[-1]['id'])
+
+            return items, next_cursor
+
+        return pool.pages(fetch_page, (0, None))
+
     def analyze_tasks(self):
         self.url_tasks = Config.url + "/api/v1/tasks"
         # self.url_tasks += "?sort_field=updated_at&sort_dir=asc&limit="+str(tasks_per_query)
@@ -329,7 +432,7 @@ class StoryBoard():
 
         logging.debug("URL for getting tasks " + self.url_tasks)
 
-        f = urllib.urlopen(self.url_tasks_total)
+        f = http.urlopen(self.url_tasks_total)
         total_tasks = int(f.info()['x-total'])
         limit_tasks = int(f.info()['x-limit'])
         f.close()
@@ -341,25 +444,12 @@ class StoryBoard():
             sys.exit(0)
         remaining = total_tasks
 
-        start_page = 0
         total_pages = total_tasks / self.items_per_query
-        marker = None # The resource id where the page should begin
-
-        while start_page <= total_pages:
-            if marker:
-                self.url_tasks_page = self.url_tasks + "&marker="+str(marker)
-            else:
-                self.url_tasks_page = self.url_tasks
-
-            logging.info("URL for next tasks " + self.url_tasks_page)
-
-            f = urllib.urlopen(self.url_tasks_page)
-            taskList = json.loads(f.read())
 
+        for taskList in self.get_pages(self.url_tasks, "tasks", total_pages):
             for task in taskList:
                 try:
                     issue_data = self.analyze_task(task)
-                    marker = task['id']
                     if issue_data is None:
                         continue
                     self.bugsdb.insert_issue(issue_data, self.dbtrk.id)
@@ -372,7 +462,6 @@ class StoryBoard():
                 except UnicodeEncodeError:
                     logging.error("UnicodeEncodeError: the task couldn't be stored")
                     logging.error(task)
-            start_page += 1
             logging.info("Remaining issues: %i" % (remaining))
 
         logging.info("Done. Tasks analyzed:" + str(total_tasks - remaining))
@@ -405,7 +494,7 @@ class StoryBoard():
                         continue
                     # logging.info("Adding to " + task.summary + " " + task.status + " event")
                     change = Change(field, old_value, task.status, by, task_ext.mod_date)
-                    self.bugsdb._insert_change(change, task.id, self.dbtrk.id)
+                    self.bugsdb._insert_changes([change], task.id, self.dbtrk.id)
 
     def analyze_stories_and_events(self):
         # The changes in tasks is in stories events
@@ -416,7 +505,7 @@ class StoryBoard():
         self.url_stories_total = self.url_stories + "&limit=1"
         self.url_stories += "&limit="+str(self.items_per_query)
 
-        f = urllib.urlopen(self.url_stories_total)
+        f = http.urlopen(self.url_stories_total)
         total_stories = int(f.info()['x-total'])
         f.close()
 
@@ -427,32 +516,35 @@ class StoryBoard():
             sys.exit(0)
         remaining = total_stories
 
-        start_page = 0
         total_pages = total_stories / self.items_per_query
-        marker = None # The resource id where the page should begin
         storiesUpdated = [] # stories with updated info
         updated_stories = True # control if we have more updated stories
 
-        while start_page <= total_pages and updated_stories:
-            if marker:
-                self.url_stories_page = self.url_stories + "&marker="+str(marker)
-            else:
-                self.url_stories_page = self.url_stories
+        def is_updated(story):
+            story_date = parse(story['updated_at']).replace(tzinfo=None)
+            last_date_shown = parse(self.last_mod_date).replace(tzinfo=None)
+            return story_date > last_date_shown
+
+        # Stories are sorted by update date, so no more pages are
+        # needed once a story not updated since the last run is found
+        if self.last_mod_date:
+            is_last = lambda stories: not is_updated(stories[-1])
+        else:
+            is_last = None
 
-            logging.info("URL for next stories " + self.url_stories_page)
+        for storiesList in self.get_pages(self.url_stories, "stories",
+                                          total_pages, is_last):
+            if not updated_stories:
+                break
 
-            f = urllib.urlopen(self.url_stories_page)
-            storiesList = json.loads(f.read())
             logging.info("Stories gathered: " + str(len(storiesList)))
 
             for story in storiesList:
                 # print story['updated_at'],story['title']
-                story_date = parse(story['updated_at']).replace(tzinfo=None)
                 if self.last_mod_date:
-                    last_date_shown = parse(self.last_mod_date).replace(tzinfo=None)
-                    if story_date > last_date_shown:
+                    if is_updated(story):
                         storiesUpdated.append(story['id'])
-                        self.backend.insert_story(self.bugsdb.store, story)
+                        self.bugsdb.write(self.backend.insert_story, story)
                     else:
                         logging.info("First story updated before " + self.last_mod_date)
                         logging.info("No updates from " + story['updated_at']+" "+story['title'])
@@ -460,11 +552,9 @@ class StoryBoard():
                         break
                 else:
                     storiesUpdated.append(story['id'])
-                    self.backend.insert_story(self.bugsdb.store, story)
-                marker = story['id']
+                    self.bugsdb.write(self.backend.insert_story, story)
                 remaining -= 1
 
-            start_page += 1
             logging.info("Remaining stories: %i" % (remaining))
             if (self.debug): break
 
@@ -479,7 +569,7 @@ class StoryBoard():
         remaining = len(storiesUpdated)
         for story_id in storiesUpdated:
             url_events = Config.url + "/api/v1/stories/" + str(story_id) + "/events"
-            f = urllib.urlopen(url_events)
+            f = http.urlopen(url_events)
             data = f.read()
             events = json.loads(data)
 
@@ -495,15 +585,13 @@ class StoryBoard():
                         logging.info(event)
                         continue
                     change = self.parse_change(event)
-                    db_change = self.bugsdb._get_db_change(change, issue.id, self.dbtrk.id)
-                    if db_change == -1:
-                        self.bugsdb._insert_change(change, issue.id, self.dbtrk.id)
+                    # Changes already stored are skipped
+                    self.bugsdb._insert_changes([change], issue.id, self.dbtrk.id)
 
 
             remaining -= 1
             if remaining % 100 == 0: logging.info("Remaining: " + str(remaining))
             f.close()
-            time.sleep(0.2)
 
     def get_user_field(self, user_id, field):
         for user in self.all_users:
@@ -525,27 +613,13 @@ class StoryBoard():
         self.url_users_total = self.url_users + "?limit=1"
         self.url_users += "?limit="+str(self.items_per_query)
 
-        f = urllib.urlopen(self.url_users_total)
+        f = http.urlopen(self.url_users_total)
         total_users = int(f.info()['x-total'])
         f.close()
 
-        start_page = 0
         total_pages = total_users / self.items_per_query
-        marker = None # The resource id where the page should begin
-
-        while start_page <= total_pages:
-            if marker:
-                self.url_users_page = self.url_users + "&marker="+str(marker)
-            else:
-                self.url_users_page = self.url_users
-
-            logging.info("URL for next users " + self.url_users_page)
-
-            f = urllib.urlopen(self.url_users_page)
-            userList = json.loads(f.read())
-            marker = userList[-1]['id']
-            start_page += 1
 
+        for userList in self.get_pages(self.url_users, "users", total_pages):
             self.all_users += userList
 
 
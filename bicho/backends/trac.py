@@ -20,20 +20,21 @@
 #
 
 import datetime
+import itertools
 import json
 import sys
-import time
 
 import dateutil.parser
-import requests
 
 from storm.locals import DateTime, Int, Float, Reference, Unicode, Desc
 
 from bicho.backends import Backend
 from bicho.common import Tracker, People, Issue, Comment, Change
+from bicho import http, pool
 from bicho.config import Config
 from bicho.utils import printout, printdbg, printerr
 from bicho.db.database import DBIssue, DBTracker, DBBackend, get_database
+from bicho.db.writer import DBWriter
 
 
 class DBTracIssueExt(object):
@@ -79,12 +80,60 @@ class DBTracIssueExtMySQL(DBTracIssueExt):
                          ON UPDATE CASCADE \
                      ) ENGINE=MYISAM; '
 
+
+class DBTracIssueExtSQLite(DBTracIssueExt):
+    """
+    SQLite subclass of L{DBTracIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_trac ( \
+                     id INTEGER PRIMARY KEY AUTOINCREMENT, \
+                     issue_id INTEGER NOT NULL, \
+                     milestone VARCHAR(64) DEFAULT NULL, \
+                     component VARCHAR(64) DEFAULT NULL, \
+                     version VARCHAR(64) DEFAULT NULL, \
+                     keywords TEXT DEFAULT NULL, \
+                     rhbz FLOAT DEFAULT NULL, \
+                     uri VARCHAR(255) DEFAULT NULL, \
+                     updated_on DATETIME DEFAULT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBTracIssueExtPostgreSQL(DBTracIssueExt):
+    """
+    PostgreSQL subclass of L{DBTracIssueExt}
+    """
+
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_trac ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     milestone TEXT DEFAULT NULL, \
+                     component TEXT DEFAULT NULL, \
+                     version TEXT DEFAULT NULL, \
+                     keywords TEXT DEFAULT NULL, \
+                     rhbz FLOAT DEFAULT NULL, \
+                     uri TEXT DEFAULT NULL, \
+                     updated_on TIMESTAMP DEFAULT NULL, \
+                     UNIQUE(issue_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
 class DBTracBackend(DBBackend):
     """
     Adapter for Trac backend.
     """
     def __init__(self):
         self.MYSQL_EXT = [DBTracIssueExtMySQL]
+        self.SQLITE_EXT = [DBTracIssueExtSQLite]
+        self.POSTGRESQL_EXT = [DBTracIssueExtPostgreSQL]
 
     def get_last_modification_date(self, store, tracker_id):
         result = store.find(DBTracIssueExt,
@@ -103,28 +152,24 @@ class DBTracBackend(DBBackend):
     def insert_issue_ext(self, store, issue, issue_id):
         is_new = False
 
-        try:
-            db_issue_ext = store.find(DBTracIssueExt,
-                                      DBTracIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                is_new = True
-                db_issue_ext = DBTracIssueExt(issue_id)
-
-                db_issue_ext.milestone = self.__to_unicode(issue.milestone)
-                db_issue_ext.component = self.__to_unicode(issue.component)
-                db_issue_ext.keywords = self.__to_unicode(issue.keywords)
-                db_issue_ext.version = self.__to_unicode(issue.version)
-                db_issue_ext.rhbz = issue.rhbz
-                db_issue_ext.uri = self.__to_unicode(issue.uri)
-                db_issue_ext.updated_on = issue.updated_on
-
-            if is_new:
-                store.add(db_issue_ext)
-
-            store.flush()
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBTracIssueExt,
+                                  DBTracIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            is_new = True
+            db_issue_ext = DBTracIssueExt(issue_id)
+
+            db_issue_ext.milestone = self.__to_unicode(issue.milestone)
+            db_issue_ext.component = self.__to_unicode(issue.component)
+            db_issue_ext.keywords = self.__to_unicode(issue.keywords)
+            db_issue_ext.version = self.__to_unicode(issue.version)
+            db_issue_ext.rhbz = issue.rhbz
+            db_issue_ext.uri = self.__to_unicode(issue.uri)
+            db_issue_ext.updated_on = issue.updated_on
+
+        if is_new:
+            store.add(db_issue_ext)
+
+        store.flush()
 
     def insert_comment_ext(self, store, comment, comment_id):
         pass
@@ -285,14 +330,58 @@ class TracRPC(object):
         result = self.call(method, params)
         return result
 
+    def tickets_changes(self, ticket_ids):
+        """Fetch several tickets with their changelogs at once. Returns
+        a list with a tuple (ticket, changes) for each ticket, or the
+        TracRPCError raised while fetching it."""
+
+        calls = []
+        for ticket_id in ticket_ids:
+            calls.append(('ticket.get', [ticket_id]))
+            calls.append(('ticket.changeLog', [ticket_id]))
+
+        results = self.multicall(calls)
+
+        tickets = []
+        for i in range(0, len(results), 2):
+            ticket, changes = results[i], results[i + 1]
+
+            if isinstance(ticket, TracRPCError):
+                tickets.append(ticket)
+            elif isinstance(changes, TracRPCError):
+                tickets.append(changes)
+            else:
+                tickets.append((ticket, changes))
+        return tickets
+
+    def multicall(self, calls):
+        """Send several calls in a single request. Returns the result
+        of each call, in the same order, or the TracRPCError raised
+        by the call, so one failing call does not fail the others."""
+
+        method = 'system.multicall'
+        params = [{'method': m, 'params': p} for m, p in calls]
+
+        responses = self.call(method, params)
+
+        results = []
+        for response in responses:
+            if response.get('error'):
+                error = TracRPCError(response['error']['code'],
+                                     response['error']['message'])
+                results.append(error)
+            else:
+                results.append(response['result'])
+        return results
+
     def call(self, method, params):
         # POST parameters
         data = {'method': method, 'params': params}
         data = json.dumps(data)
 
-        res = requests.post('%s/jsonrpc' % self.url,
-                            headers=self.HEADERS,
-                            data=data)
+        res = http.post('%s/jsonrpc' % self.url,
+                        headers=self.HEADERS,
+                        data=data)
         printdbg("Trac RPC %s method called: %s" % (method, res.url))
 
         # Raise HTTP errors, if any
@@ -317,6 +406,7 @@ class Trac(Backend):
             self.url = Config.url[0:-1]
 
         self.delay = Config.delay
+        self.max_issues = Config.nissues
         self.identities = {}
 
         self.db = get_database(DBTracBackend())
@@ -349,7 +439,7 @@ class Trac(Backend):
 
         return identity
 
-    def get_issue_from_ticket(self, ticket):
+    def get_issue_from_ticket(self, ticket, ticket_changes=None):
         printdbg("Parsing ticket %s" % (ticket[0]))
 
         # Parse dates
@@ -408,7 +498,8 @@ class Trac(Backend):
             issue.add_watcher(identity)
 
         # Retrieve comments and changes
-        ticket_changes = self.trac_rpc.changes(ticket[0])
+        if ticket_changes is None:
+            ticket_changes = self.trac_rpc.changes(ticket[0])
         comments, changes = self.get_events_from_changes(ticket_changes)
 
         for comment in comments:
@@ -441,6 +532,10 @@ class Trac(Backend):
 
         return comments, changes
 
+    def fetch_tickets(self, ticket_ids):
+        printdbg("Fetching tickets %s to %s" % (ticket_ids[0], ticket_ids[-1]))
+        return self.trac_rpc.tickets_changes(ticket_ids)
+
     def fetch_and_store_tickets(self):
         printdbg("Fetching tickets")
 
@@ -456,26 +551,36 @@ class Trac(Backend):
 
         trac_tickets = self.trac_rpc.tickets(last_mod_date)
 
-        for ticket_id in trac_tickets:
-            printdbg("Fetching ticket %s" % str(ticket_id))
-            ticket = self.trac_rpc.ticket(ticket_id)
+        # Tickets and their changes are requested in batches of
+        # calls, fetched by the workers of the pool and parsed in order
+        batches = [trac_tickets[i:i + self.max_issues]
+                   for i in range(0, len(trac_tickets), self.max_issues)]
+
+        for batch, results in itertools.izip(batches,
+                                             pool.imap(self.fetch_tickets, batches)):
+            for ticket_id, result in itertools.izip(batch, results):
+                if isinstance(result, TracRPCError):
+                    printerr("Error fetching ticket %s: %s" % (ticket_id, result))
+                    continue
 
-            issue = self.get_issue_from_ticket(ticket)
+                ticket, ticket_changes = result
+                issue = self.get_issue_from_ticket(ticket, ticket_changes)
 
-            # Insert issue
-            self.db.insert_issue(issue, dbtrk.id)
+                # Insert issue
+                self.writer.insert_issue(issue, dbtrk.id)
 
-            nbugs += 1
-            time.sleep(self.delay)
+                nbugs += 1
 
         printout("Done. %s bugs analyzed from %s" % (nbugs, len(trac_tickets)))
 
     def run(self):
         printout("Running Bicho with delay of %s seconds - %s" % (self.delay, self.url))
 
+        self.writer = DBWriter(self.db)
         try:
-            self.fetch_and_store_tickets()
-        except (requests.exceptions.HTTPError, TracRPCError), e:
+            with self.writer:
+                self.fetch_and_store_tickets()
+        except (http.HTTPError, TracRPCError), e:
             printerr("Error: %s" % e)
             sys.exit(1)
 
@@ -32,6 +32,9 @@ from urllib2 import Request, urlopen, urlparse, URLError, HTTPError
 # 250 for working with bugzilla in redhat
 MAX_ISSUES_PER_QUERY = 200
 
+# Default port of the database servers
+DB_DEFAULT_PORTS = {'mysql': '3306', 'postgresql': '5432'}
+
 
 class ErrorLoadingConfig(Exception):
     """
@@ -163,9 +166,16 @@ class Config():
                                  'db_password_in', 'db_hostname_in',
                                  'db_port_in', 'db_database_in'])
         if getattr(Config, 'output', None) == 'db':
-            Config.check_params(['db_driver_out', 'db_user_out',
-                                 'db_password_out', 'db_hostname_out',
-                                 'db_port_out', 'db_database_out'])
+            if getattr(Config, 'db_port_out', None) is None:
+                Config.db_port_out = DB_DEFAULT_PORTS.get(
+                    getattr(Config, 'db_driver_out', None))
+            if getattr(Config, 'db_driver_out', None) == 'sqlite':
+                # SQLite databases are files, no server is needed
+                Config.check_params(['db_database_out'])
+            else:
+                Config.check_params(['db_driver_out', 'db_user_out',
+                                     'db_password_out', 'db_hostname_out',
+                                     'db_port_out', 'db_database_out'])
 
     @staticmethod
     def clean_empty_options(options):
@@ -206,12 +216,21 @@ class Config():
         parser.add_argument('--backend-password', dest='backend_password',
                             help='Backend password', default=None)
         parser.add_argument('--backend-token', dest='backend_token',
-                            help='Backend authentication token', default=None)
+                            help='Backend authentication token; GitHub accepts '
+                                 'several ones separated by commas', default=None)
         parser.add_argument('-c', '--cfg', dest='cfgfile',
                             help='Use a custom configuration file', default=None)
-        parser.add_argument('-d', '--delay', type=int, dest='delay',
+        parser.add_argument('-d', '--delay', type=float, dest='delay',
                             help='Delay in seconds betweeen petitions to avoid been banned',
                             default='5')
+        parser.add_argument('--max-rate', type=float, dest='max_rate',
+                            help='Maximum number of requests per second sent to a host '
+                            '(default 1/delay)',
+                            default=None)
+        parser.add_argument('--workers', type=int, dest='workers',
+                            help='Number of issues whose comments and changes '
+                            'are fetched at once (1 fetches them one by one)',
+                            default=1)
         parser.add_argument('-g', '--debug', action='store_true', dest='debug',
                             help='Enable debug mode', default=False)
         parser.add_argument('--gerrit-project', dest='gerrit_project',
@@ -222,8 +241,17 @@ class Config():
         parser.add_argument('-o', '--output', choices=['db'],
                             dest='output', help='Output format', default='db')
         parser.add_argument('-p', '--path', dest='path',
-                            help='Path where downloaded URLs will be stored',
+                            help='Path where downloaded URLs will be stored '
+                            '(default ~/.bicho/cache)',
                             default=None)
+        parser.add_argument('--no-cache', action='store_true', dest='no_cache',
+                            help='Do not store nor reuse downloaded URLs',
+                            default=False)
+        parser.add_argument('--cache-max-age', type=int, dest='cache_max_age',
+                            help='Reuse downloaded URLs younger than these '
+                            'seconds without requesting them again, i.e, '
+                            'to resume an interrupted run. Downloaded URLs '
+                            'not used for longer are removed', default=None)
         parser.add_argument('-u', '--url', dest='url',
                             help='URL to get issues from using the backend',
                             default=None)
@@ -249,10 +277,30 @@ class Config():
                            help='Name of the host where database server is running',
                            default='localhost')
         group.add_argument('--db-port-out', dest='db_port_out',
-                           help='Port of the host where database server is running',
-                           default='3306')
+                           help='Port of the host where database server is running '
+                           '(default depends on the driver)',
+                           default=None)
         group.add_argument('--db-database-out', dest='db_database_out',
-                           help='Output database name', default=None)
+                           help='Output database name (file path for sqlite)',
+                           default=None)
+        group.add_argument('--commit-every', type=int, dest='commit_every',
+                           help='Number of issues stored on each database transaction',
+                           default=1)
+        group.add_argument('--commit-interval', type=int, dest='commit_interval',
+                           help='Maximum number of seconds between database commits',
+                           default=None)
+        group.add_argument('--people-cache-size', type=int, dest='people_cache_size',
+                           help='Maximum number of identities kept in memory',
+                           default=100000)
+        group.add_argument('--writer-queue-size', type=int, dest='writer_queue_size',
+                           help='Maximum number of issues waiting to be stored '
+                           'by the writer thread (0 stores them synchronously)',
+                           default=50)
+        group.add_argument('--remove-duplicates', action='store_true',
+                           dest='remove_duplicates',
+                           help='Remove the duplicated comments and changes '
+                           'found while upgrading the tables of older versions',
+                           default=False)
 
         # Options for input database
         group = parser.add_argument_group('Input database specific options')
@@ -273,10 +321,25 @@ class Config():
         group.add_argument('--db-database-in', dest='db_database_in',
                            help='Input database name', default=None)
 
+        # Bugzilla options
+        group = parser.add_argument_group('Bugzilla specific options')
+        group.add_argument('--bg-max-results', type=int, dest='bg_max_results',
+                           help='Maximum number of issues returned by a search '
+                           'of the server (default: found out from the server; '
+                           'required when it does not support offsets)',
+                           default=None)
+        group.add_argument('--bg-timezone', dest='bg_timezone',
+                           help='Time zone of the server (i.e, Europe/Madrid), '
+                           'used to convert the dates of the webservice',
+                           default=None)
+
         # GitHub options
         group = parser.add_argument_group('GitHub specific options')
         group.add_argument('--newest-first', action='store_true', dest='newest_first',
                            help='Fetch newest issues first', default=False)
+        group.add_argument('--gh-per-issue', action='store_true', dest='gh_per_issue',
+                           help='Fetch comments and events issue by issue instead of '
+                                'those of the whole repository', default=False)
 
         # Maniphest options
         group = parser.add_mutually_exclusive_group()
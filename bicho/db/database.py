@@ -24,15 +24,59 @@
 Database module
 """
 
+import atexit
 import datetime
+import hashlib
+import sys
+import time
 
 from storm.exceptions import IntegrityError # DatabaseError,
 from storm.locals import DateTime, Int, Reference, Unicode
 
-from bicho.utils import printdbg
+from bicho.utils import printdbg, printerr, printout, LRUCache
 from bicho.config import Config
 
 
+# Maximum number of rows written by a single multi-row INSERT
+BULK_INSERT_SIZE = 500
+
+# Maximum number of identities kept in memory
+PEOPLE_CACHE_SIZE = 100000
+
+
+def content_hash(*fields):
+    """
+    Return the SHA-1 fingerprint of the given fields.
+
+    Fields are hashed as they are stored in the database: dates
+    without microseconds and any other value as unicode.
+
+    @return: hexadecimal digest of the fields
+    @rtype: C{unicode}
+    """
+    digest = hashlib.sha1()
+    for field in fields:
+        if isinstance(field, datetime.datetime):
+            field = field.strftime('%Y-%m-%d %H:%M:%S')
+        digest.update(unicode(field).encode('utf-8'))
+        digest.update('\0')
+    return unicode(digest.hexdigest())
+
+
+def comment_hash(issue_id, submitted_on, text):
+    """
+    Return the fingerprint of a comment of the issue X{issue_id}.
+    """
+    return content_hash(issue_id, submitted_on, text)
+
+
+def change_hash(issue_id, field, old_value, new_value, changed_on):
+    """
+    Return the fingerprint of a change of the issue X{issue_id}.
+    """
+    return content_hash(issue_id, field, old_value, new_value, changed_on)
+
+
 class NotFoundError(Exception):
     """
     Exception raised when an entry is not found into the database.
@@ -47,26 +91,134 @@ class NotFoundError(Exception):
         return repr(self.msg)
 
 
+class DuplicatedRowsError(Exception):
+    """
+    Exception raised when the tables of an older version have
+    duplicated rows that must be removed to upgrade them.
+
+    @param msg: explanation of the error
+    @type msg: C{str}
+    """
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
 class DBDatabase:
     """
     """
+    # Maximum number of parameters allowed by the engine in
+    # a single query; None when there is no limit
+    MAX_QUERY_PARAMS = None
+
+    # Whether the connection can be used from a thread other
+    # than the one that opened it
+    CONNECTION_THREAD_SAFE = True
+
+    # People identifiers stored for issues not assigned to anyone
+    # and for changes without author
+    UNASSIGNED_ID = 0
+    ANONYMOUS_ID = -1
+
     def __init__(self, backend=None):
         self.database = None
         self.store = None
         self.backend = backend
 
+        # Group commit: issues stored since the last commit are kept
+        # to be replayed when one of the batch fails
+        self.commit_every = getattr(Config, 'commit_every', None) or 1
+        self.commit_interval = getattr(Config, 'commit_interval', None)
+        self._batch = []
+        self._last_commit = time.time()
+
+        # Maps user_id to people.id. Identities inserted by the open
+        # transaction are tracked to forget them on rollback
+        cache_size = getattr(Config, 'people_cache_size', None) or PEOPLE_CACHE_SIZE
+        self.people_cache = LRUCache(cache_size)
+        self._new_people = []
+
+        atexit.register(self.close)
+
+    def commit(self):
+        """
+        Commit the issues stored since the last commit.
+        """
+        self.store.commit()
+        self._batch = []
+        self._new_people = []
+        self._last_commit = time.time()
+
+    def close(self):
+        """
+        Commit the pending batch of issues, if any, and report the
+        usage of the identities cache.
+        """
+        if self._batch and self.store is not None:
+            try:
+                self.commit()
+            except Exception, e:
+                printerr("Error committing the last %s issues: %s" %
+                         (len(self._batch), str(e)))
+
+        if self.people_cache.hits or self.people_cache.misses:
+            printout("Identities cache: %s hits, %s misses" %
+                     (self.people_cache.hits, self.people_cache.misses))
+
+    def warm_people_cache(self):
+        """
+        Load the stored identities into the cache, up to its size.
+        """
+        result = self.store.find((DBPeople.user_id, DBPeople.id))
+        for user_id, people_id in result[:self.people_cache.size]:
+            self.people_cache.set(user_id, people_id)
+        printdbg("%s identities loaded into the cache" % len(self.people_cache))
+
     def create_tables(self, clsl):
         """
         Create the database tables.
 
         SQL query with the structure of each table is stored into
-        X{__sql_table__} attribute of database classes.
+        X{__sql_table__} attribute of database classes. It can also
+        be a list of queries, for those engines that need separate
+        statements to create the indexes.
 
         @param clsl: a list of database classes
         @type clsl: C{list} of L{object}
         """
         for c in clsl:
-            self.store.execute(c.__sql_table__)
+            queries = c.__sql_table__
+            if isinstance(queries, basestring):
+                queries = [queries]
+            for query in queries:
+                self.store.execute(query)
+
+    def fill_hashes(self):
+        """
+        Compute the fingerprints of those comments and changes that
+        were stored without them by older versions of Bicho.
+        """
+        tables = [(DBComment, (DBComment.issue_id, DBComment.submitted_on,
+                               DBComment.text), comment_hash),
+                  (DBChange, (DBChange.issue_id, DBChange.field,
+                              DBChange.old_value, DBChange.new_value,
+                              DBChange.changed_on), change_hash)]
+
+        for cls, columns, hash_func in tables:
+            query = 'UPDATE %s SET hash = ? WHERE id = ?' % cls.__storm_table__
+            while True:
+                result = self.store.find((cls.id,) + columns, cls.hash == None)
+                rows = list(result[:BULK_INSERT_SIZE])
+                if not rows:
+                    break
+                for row in rows:
+                    self.store.execute(query, (hash_func(*row[1:]), row[0]),
+                                       noresult=True)
+                self.store.commit()
+                printdbg("%s fingerprints computed for table %s" %
+                         (len(rows), cls.__storm_table__))
 
     def insert_supported_traker(self, name, version):
         """
@@ -85,6 +237,7 @@ class DBDatabase:
             self.store.add(db_sup)
             self.store.commit()
         except:
+            self.store.rollback()
             db_sup = self._get_db_supported_tracker(name, version)
         return db_sup
 
@@ -109,6 +262,7 @@ class DBDatabase:
             self.store.add(db_tracker)
             self.store.commit()
         except:
+            self.store.rollback()
             db_tracker = self._get_db_tracker(tracker.url)
             db_tracker.retrieved_on = datetime.datetime.now()
             self.store.commit()
@@ -124,15 +278,37 @@ class DBDatabase:
         @return: the inserted identity
         @rtype: L{People}
         """
+        return self.store.get(DBPeople, self._get_people_id(people))
+
+    def _get_people_id(self, people):
+        """
+        Return the database identifier of the given identity,
+        inserting it when it is not stored yet.
+
+        @param people: identity to look for
+        @type people: L{People}
+
+        @return: identifier of the identity
+        @rtype: C{int}
+        """
+        user_id = unicode(people.user_id)
+
+        people_id = self.people_cache.get(user_id)
+        if people_id is not None:
+            return people_id
+
         try:
             db_people = DBPeople(people.user_id)
             db_people.set_name(people.name)
             db_people.set_email(people.email)
             self.store.add(db_people)
-            self.store.commit()
+            self.store.flush()
+            self._new_people.append(user_id)
         except IntegrityError:
             db_people = self._get_db_people(people.user_id)
-        return db_people
+
+        self.people_cache.set(user_id, db_people.id)
+        return db_people.id
 
     def insert_issue(self, issue, tracker_id):
         """
@@ -146,99 +322,146 @@ class DBDatabase:
         @return: the inserted issue
         @rtype: L{DBIssue}
         """
+        try:
+            db_issue = self._store_issue(issue, tracker_id)
+        except:
+            # The batch could raise other errors while it is
+            # written again; the original one is raised anyway
+            exc_info = sys.exc_info()
+            self._rollback_batch()
+            raise exc_info[0], exc_info[1], exc_info[2]
 
-        newIssue = False
+        self._batch.append((issue, tracker_id))
+
+        elapsed = time.time() - self._last_commit
+        if len(self._batch) >= self.commit_every or \
+                (self.commit_interval and elapsed >= self.commit_interval):
+            self.commit()
+
+        return db_issue
+
+    def write(self, func, *args):
+        """
+        Call X{func} with the store and the given arguments, to write
+        data other than issues (i.e, tables of the backends) in the
+        transaction of the current batch. Backends must not commit nor
+        roll back the store by themselves: when X{func} fails, the
+        transaction is rolled back here and the issues of the batch
+        are written again before raising the error.
+
+        @param func: function to call
+        @type func: C{function}
 
+        @return: the value returned by X{func}
+        """
         try:
-            db_issue = self._get_db_issue(issue.issue, tracker_id)
+            return func(self.store, *args)
+        except:
+            exc_info = sys.exc_info()
+            self._rollback_batch()
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _store_issue(self, issue, tracker_id):
+        """
+        Write the given issue into the current transaction.
+
+        @param issue: issue to insert
+        @type issue: L{Issue}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+
+        @return: the inserted issue
+        @rtype: L{DBIssue}
+        """
+        newIssue = False
 
-            #if issue does not in the tracker, we create a new one
-            if db_issue == -1:
-                newIssue = True
-                db_issue = DBIssue(issue.issue, tracker_id)
+        db_issue = self._get_db_issue(issue.issue, tracker_id)
 
-            #update the data, or take the new one
-            db_issue.type = unicode(issue.type)
-            db_issue.summary = unicode(issue.summary)
-            db_issue.description = unicode(issue.description)
-            db_issue.status = unicode(issue.status)
-            db_issue.resolution = unicode(issue.resolution)
-            db_issue.priority = unicode(issue.priority)
-            db_issue.submitted_by = self.insert_people(issue.submitted_by).id
+        #if issue does not in the tracker, we create a new one
+        if db_issue == -1:
+            newIssue = True
+            db_issue = DBIssue(issue.issue, tracker_id)
 
+        #update the data, or take the new one
+        db_issue.type = unicode(issue.type)
+        db_issue.summary = unicode(issue.summary)
+        db_issue.description = unicode(issue.description)
+        db_issue.status = unicode(issue.status)
+        db_issue.resolution = unicode(issue.resolution)
+        db_issue.priority = unicode(issue.priority)
+        db_issue.submitted_by = self._get_people_id(issue.submitted_by)
 
-            db_issue.submitted_on = issue.submitted_on
 
-            if issue.assigned_to is not None:
-                db_issue.assigned_to = self.insert_people(issue.assigned_to).id
-            else:
-                db_issue.assigned_to = 0
+        db_issue.submitted_on = issue.submitted_on
 
-            #if issue is new, we add to the data base before the flush()
-            if newIssue == True:
-                self.store.add(db_issue)
+        if issue.assigned_to is not None:
+            db_issue.assigned_to = self._get_people_id(issue.assigned_to)
+        else:
+            db_issue.assigned_to = self.UNASSIGNED_ID
 
-            self.store.flush()
+        #if issue is new, we add to the data base before the flush()
+        if newIssue == True:
+            self.store.add(db_issue)
 
-            # Insert extra data of the issue, if any
-            if self.backend is not None:
-                self.backend.insert_issue_ext(self.store, issue, db_issue.id)
-
-            # Insert temporal relationships
-            for trel in issue.temp_relationships:
-                db_trel = self._get_db_temp_rel(trel, db_issue.id)
-                if db_trel == -1:
-                    db_trel = self._insert_temp_rel(trel, db_issue.id, tracker_id)
-                    if self.backend is not None:
-                        self.backend.insert_temp_rel(self.store, trel, db_trel, tracker_id)
-
-            # Insert comments
-            for comment in issue.comments:
-                db_comment = self._get_db_comment(comment, db_issue.id, tracker_id)
-                if db_comment == -1:
-                    db_comment = self._insert_comment(comment, db_issue.id, tracker_id)
-                    if self.backend is not None:
-                        self.backend.insert_comment_ext(self.store, comment, db_comment.id)
-
-            # Insert attachments
-            for attachment in issue.attachments:
-                db_attch = self._get_db_attachment(attachment, db_issue.id, tracker_id)
-                if db_attch == -1:
-                    db_attch = self._insert_attachment(attachment, db_issue.id, tracker_id)
-                    if self.backend is not None:
-                        self.backend.insert_attachment_ext(self.store, attachment, db_attch.id)
-
-            # Insert changes
-            for change in issue.changes:
-                db_change = self._get_db_change(change, db_issue.id, tracker_id)
-                if db_change == -1:
-                    db_change = self._insert_change(change, db_issue.id, tracker_id)
-                    if self.backend is not None:
-                        self.backend.insert_change_ext(self.store, change, db_change.id)
-
-            # Insert CC/watchers
-            # Remove old watchers
-            self._remove_issues_watchers(db_issue.id, tracker_id)
-
-            for person in issue.watchers:
-                try:
-                    #db_issues_watchers = self._insert_issues_watchers(person, db_issue.id,
-                    #                                                  tracker_id)
-                    self._insert_issues_watchers(person, db_issue.id, tracker_id)
-                except:
-                    None
+        self.store.flush()
 
-            self.store.commit()
+        # Insert extra data of the issue, if any
+        if self.backend is not None:
+            self.backend.insert_issue_ext(self.store, issue, db_issue.id)
 
-            return db_issue
-        except:
+        # Insert temporal relationships, comments, attachments and
+        # changes. Stored rows are loaded once per table and the new
+        # ones are written using multi-row INSERT statements.
+        self._insert_temp_rels(issue.temp_relationships, tracker_id)
+        self._insert_comments(issue.comments, db_issue.id, tracker_id)
+        self._insert_attachments(issue.attachments, db_issue.id, tracker_id)
+        self._insert_changes(issue.changes, db_issue.id, tracker_id)
+
+        # Insert CC/watchers
+        self._sync_issues_watchers(issue.watchers, db_issue.id, tracker_id)
+
+        return db_issue
+
+    def _rollback_batch(self):
+        """
+        Discard the issue that failed, keeping the rest of the batch.
+
+        The whole transaction is rolled back and the issues stored
+        since the last commit are written again. Those that fail this
+        time are discarded too, rolling back and starting over again.
+        """
+        batch = self._batch
+
+        while True:
             self.store.rollback()
-            raise
+
+            for user_id in self._new_people:
+                self.people_cache.remove(user_id)
+            self._new_people = []
+
+            self._batch = []
+            for i, (issue, tracker_id) in enumerate(batch):
+                try:
+                    self._store_issue(issue, tracker_id)
+                except Exception, e:
+                    printerr("Error storing again issue %s, discarded: %s"
+                             % (issue.issue, e))
+                    batch = self._batch + batch[i + 1:]
+                    break
+                self._batch.append((issue, tracker_id))
+            else:
+                return
 
     def get_last_modification_date(self, state=None, tracker_id=None):
         """
         Return last modification date stored in database
+
+        The pending batch of issues is committed before, so the date
+        never goes beyond the issues that are already durable.
         """
+        if self._batch:
+            self.commit()
+
         if self.backend is not None:
             # in the github backend we need to get both open and closed
             # issues in two different petitions
@@ -247,160 +470,317 @@ class DBDatabase:
             else:
                 return self.backend.get_last_modification_date(self.store, tracker_id)
 
-    def _insert_relationship(self, issue_id, type, rel_id):
+    def get_issues_activity_dates(self, tracker_id, issues):
         """
-        Insert a relationship between the given issues.
+        Return the modification date and the date of the last change
+        stored for each one of the given issues of the tracker.
 
-        @param rel_id: related issued
-        @type rel_id: C{int}
-        @param type: type of the relationship
-        @type type: C{str}
-        @param issue_id: issue identifier
-        @type issue_id: C{int}
+        The pending batch of issues is committed before.
 
-        @return: the inserted relationship
-        @rtype: L{DBIssueRelationship}
-        """
-        db_rel = DBIssueRelationship(rel_id, type, issue_id)
-        self.store.add(db_rel)
-        self.store.flush()
-        return db_rel
-
-    def _insert_temp_rel(self, relationship, issue_id, tracker_id):
-        """
-        Insert temporal relationships for the issue X{issue_id}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        @param issues: issue identifiers in the tracker
+        @type issues: C{list}
 
-        @return: the inserted relationship
-        @rtype: L{DBComment}
+        @return: pairs of (modification date, last change date) by
+            issue identifier; stored issues only
+        @rtype: C{dict}
         """
-        db_temp_rel = DBIssueTempRelationship(relationship.issue,
-                                              relationship.type,
-                                              relationship.related_to,
-                                              tracker_id)
+        if self._batch:
+            self.commit()
 
-        self.store.add(db_temp_rel)
-        self.store.flush()
-        return db_temp_rel
+        if self.backend is not None:
+            return self.backend.get_issues_activity_dates(self.store, tracker_id,
+                                                          issues)
 
     def store_final_relationships(self):
         """
-        """
-        temp_rels = self.store.find(DBIssueTempRelationship)
+        Resolve the temporal relationships into relationships between
+        stored issues.
 
-        for tr in temp_rels:
-            aux_issue_id = self._get_db_issue(tr.issue_id, tr.tracker_id)
-            aux_related_to = self._get_db_issue(tr.related_to, tr.tracker_id)
-            if (aux_related_to != -1 and aux_issue_id != -1):
-                db_rel = self._get_db_rel(aux_issue_id.id, tr.type, aux_related_to.id)
+        Resolution is done by a single INSERT ... SELECT statement and
+        the temporal relationships resolved are removed. Relationships
+        with issues of a different tracker, or not stored yet, are kept
+        to try them again on the next call.
+        """
+        if self.store.find(DBIssueTempRelationship).is_empty():
+            return
+
+        tables = {'rel': DBIssueRelationship.__storm_table__,
+                  'temp': DBIssueTempRelationship.__storm_table__,
+                  'issues': DBIssue.__storm_table__}
+
+        query = 'INSERT INTO %(rel)s (issue_id, related_to, type) \
+                 SELECT DISTINCT i1.id, i2.id, t.type \
+                 FROM %(temp)s t \
+                 JOIN %(issues)s i1 ON i1.issue = %(issue_id)s \
+                   AND i1.tracker_id = t.tracker_id \
+                 JOIN %(issues)s i2 ON i2.issue = t.related_to \
+                   AND i2.tracker_id = t.tracker_id \
+                 LEFT JOIN %(rel)s r ON r.issue_id = i1.id \
+                   AND r.related_to = i2.id AND r.type = t.type \
+                 WHERE r.id IS NULL' % \
+            dict(tables, issue_id=self._cast_to_text('t.issue_id'))
+        self.store.execute(query, noresult=True)
+
+        # MySQL does not allow aliases in single table deletes
+        query = 'DELETE FROM %(temp)s \
+                 WHERE EXISTS (SELECT 1 FROM %(issues)s i1, %(issues)s i2 \
+                   WHERE i1.issue = %(issue_id)s \
+                   AND i1.tracker_id = %(temp)s.tracker_id \
+                   AND i2.issue = %(temp)s.related_to \
+                   AND i2.tracker_id = %(temp)s.tracker_id)' % \
+            dict(tables, issue_id=self._cast_to_text('%s.issue_id' % tables['temp']))
+        result = self.store.execute(query)
+        resolved = result.rowcount
+        self.commit()
+
+        printdbg("%s temporal relationships resolved" % resolved)
+
+    def _cast_to_text(self, expr):
+        """
+        Return the SQL expression that converts X{expr} to text.
+        """
+        return 'CAST(%s AS CHAR)' % expr
 
-                if db_rel == -1:
-                    self._insert_relationship(aux_issue_id.id, tr.type, aux_related_to.id)
-            else:
-                printdbg("Issue %s belongs to a different tracker and won't be stored" % tr.related_to)
+    def _insert_temp_rels(self, relationships, tracker_id):
+        """
+        Insert, in bulk, the temporal relationships not stored yet.
 
-    def _insert_comment(self, comment, issue_id, tracker_id):
+        @param relationships: temporal relationships to insert
+        @type relationships: C{list} of L{TempRelationship}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        """
+        if not relationships:
+            return
+
+        issues = set([int(trel.issue) for trel in relationships])
+        stored = self._get_db_temp_rels_map(issues)
+
+        new_rels = []
+        for trel in relationships:
+            key = self._temp_rel_key(trel)
+            if key in stored:
+                continue
+            stored[key] = None
+            new_rels.append(trel)
+
+        rows = [(int(trel.issue), unicode(trel.related_to), unicode(trel.type),
+                 tracker_id) for trel in new_rels]
+        self._bulk_insert(DBIssueTempRelationship.__storm_table__,
+                          ('issue_id', 'related_to', 'type', 'tracker_id'),
+                          rows)
+
+        if new_rels and self.backend is not None:
+            db_trels = self.store.find(DBIssueTempRelationship,
+                                       DBIssueTempRelationship.issue_id.is_in(issues))
+            db_trels = dict([((db_trel.issue_id, db_trel.type,
+                               db_trel.related_to), db_trel)
+                             for db_trel in db_trels])
+            for trel in new_rels:
+                db_trel = db_trels[self._temp_rel_key(trel)]
+                self.backend.insert_temp_rel(self.store, trel, db_trel, tracker_id)
+
+    def _insert_comments(self, comments, issue_id, tracker_id):
         """
-        Insert a comment for the issue X{issue_id}
+        Insert, in bulk, the comments of the issue X{issue_id} not
+        stored yet.
 
-        @param comment: comment to insert
-        @type comment: L{Comment}
+        @param comments: comments to insert
+        @type comments: C{list} of L{Comment}
         @param issue_id: issue identifier
         @type issue_id: C{int}
         @param tracker_id: identifier of the tracker
         @type tracker_id: C{int}
-
-        @return: the inserted comment
-        @rtype: L{DBComment}
         """
-        submitted_by = self.insert_people(comment.submitted_by)
-
-        db_comment = DBComment(comment.comment, submitted_by.id,
-                               comment.submitted_on, issue_id)
-        self.store.add(db_comment)
-        try:
-            self.store.flush()
-        except UnicodeEncodeError:
-            print("UnicodeEncodeError: one of the comments of the issue_id " + \
-                  "%s couldn't be stored" % (issue_id))
-        return db_comment
-
-    def _insert_attachment(self, attachment, issue_id, tracker_id):
+        if not comments:
+            return
+
+        stored = self._get_db_comments_map(issue_id)
+
+        new_comments = []
+        rows = []
+        for comment in comments:
+            try:
+                key = self._comment_key(comment, issue_id)
+                if key in stored:
+                    continue
+                row = (issue_id, unicode(comment.comment),
+                       self._get_people_id(comment.submitted_by),
+                       comment.submitted_on, key)
+            except UnicodeError:
+                printerr("UnicodeEncodeError: one of the comments of the "
+                         "issue_id %s couldn't be stored" % issue_id)
+                continue
+            stored[key] = None
+            new_comments.append(comment)
+            rows.append(row)
+
+        self._bulk_insert(DBComment.__storm_table__,
+                          ('issue_id', 'text', 'submitted_by', 'submitted_on',
+                           'hash'),
+                          rows)
+
+        if new_comments and self.backend is not None:
+            stored = self._get_db_comments_map(issue_id)
+            for comment in new_comments:
+                comment_id = stored[self._comment_key(comment, issue_id)]
+                self.backend.insert_comment_ext(self.store, comment, comment_id)
+
+    def _insert_attachments(self, attachments, issue_id, tracker_id):
         """
-        Insert an attachment for the issue X{issue_id}
+        Insert, in bulk, the attachments of the issue X{issue_id} not
+        stored yet.
 
-        @param attachment: attachment to insert
-        @type attachment: L{Attachment}
+        @param attachments: attachments to insert
+        @type attachments: C{list} of L{Attachment}
         @param issue_id: issue identifier
         @type issue_id: C{int}
         @param tracker_id: identifier of the tracker
         @type tracker_id: C{int}
-
-        @return: the inserted attachment
-        @rtype: L{DBAttachment}
         """
-        if attachment.submitted_by is not None:
-            submitter = self.insert_people(attachment.submitted_by)
-            submitted_by = submitter.id
-        else:
-            submitted_by = None
-
-        db_attachment = DBAttachment(attachment.name, attachment.description,
-                                     attachment.url, submitted_by,
-                                     attachment.submitted_on, issue_id)
-        self.store.add(db_attachment)
-        self.store.flush()
-        return db_attachment
-
-    def _insert_change(self, change, issue_id, tracker_id):
+        if not attachments:
+            return
+
+        stored = self._get_db_attachments_map(issue_id)
+
+        new_attachments = []
+        rows = []
+        for attachment in attachments:
+            try:
+                key = self._attachment_key(attachment)
+                if key in stored:
+                    continue
+                if attachment.submitted_by is not None:
+                    submitted_by = self._get_people_id(attachment.submitted_by)
+                else:
+                    submitted_by = None
+                row = (issue_id, unicode(attachment.name),
+                       unicode(attachment.description),
+                       unicode(attachment.url), submitted_by,
+                       attachment.submitted_on)
+            except UnicodeError:
+                printerr("UnicodeEncodeError: one of the attachments of the "
+                         "issue_id %s couldn't be stored" % issue_id)
+                continue
+            stored[key] = None
+            new_attachments.append(attachment)
+            rows.append(row)
+
+        self._bulk_insert(DBAttachment.__storm_table__,
+                          ('issue_id', 'name', 'description', 'url',
+                           'submitted_by', 'submitted_on'),
+                          rows)
+
+        if new_attachments and self.backend is not None:
+            stored = self._get_db_attachments_map(issue_id)
+            for attachment in new_attachments:
+                attch_id = stored[self._attachment_key(attachment)]
+                self.backend.insert_attachment_ext(self.store, attachment, attch_id)
+
+    def _insert_changes(self, changes, issue_id, tracker_id):
         """
-        Insert a change for the issue X{issue_id}
+        Insert, in bulk, the changes of the issue X{issue_id} not
+        stored yet.
 
-        @param change: change to insert
-        @type change: L{Change}
+        @param changes: changes to insert
+        @type changes: C{list} of L{Change}
         @param issue_id: issue identifier
         @type issue_id: C{int}
         @param tracker_id: identifier of the tracker
         @type tracker_id: C{int}
-
-        @return: the inserted change
-        @rtype: L{DBChange}
         """
-        if not change.changed_by:
-            changed_by_id = -1
-        else:
-            changed_by = self.insert_people(change.changed_by)
-            changed_by_id = changed_by.id
-
-        db_change = DBChange(change.field, change.old_value, change.new_value,
-                             changed_by_id, change.changed_on, issue_id)
-        self.store.add(db_change)
-        self.store.flush()
-        return db_change
-
-    def _insert_issues_watchers(self, people, issue_id, tracker_id):
+        if not changes:
+            return
+
+        stored = self._get_db_changes_map(issue_id)
+
+        new_changes = []
+        rows = []
+        for change in changes:
+            try:
+                key = self._change_key(change, issue_id)
+                if key in stored:
+                    continue
+                if not change.changed_by:
+                    changed_by_id = self.ANONYMOUS_ID
+                else:
+                    changed_by_id = self._get_people_id(change.changed_by)
+                row = (issue_id, unicode(change.field),
+                       unicode(change.old_value), unicode(change.new_value),
+                       changed_by_id, change.changed_on, key)
+            except UnicodeError:
+                printerr("UnicodeEncodeError: one of the changes of the "
+                         "issue_id %s couldn't be stored" % issue_id)
+                continue
+            stored[key] = None
+            new_changes.append(change)
+            rows.append(row)
+
+        self._bulk_insert(DBChange.__storm_table__,
+                          ('issue_id', 'field', 'old_value', 'new_value',
+                           'changed_by', 'changed_on', 'hash'),
+                          rows)
+
+        if new_changes and self.backend is not None:
+            stored = self._get_db_changes_map(issue_id)
+            for change in new_changes:
+                change_id = stored[self._change_key(change, issue_id)]
+                self.backend.insert_change_ext(self.store, change, change_id)
+
+    def _bulk_insert(self, table, columns, rows):
         """
-        Insert watchers for the issue X{issue_id}
-
-        @return: the inserted watcher
-        @rtype: L{DBIssuesWatchers}
+        Insert the given rows into X{table} using multi-row INSERT
+        statements of, at most, L{BULK_INSERT_SIZE} rows each. The
+        size of the statements is reduced to not exceed
+        L{MAX_QUERY_PARAMS}, when the engine sets it.
+
+        @param table: name of the table
+        @type table: C{str}
+        @param columns: names of the columns to fill
+        @type columns: C{tuple} of C{str}
+        @param rows: values of each row, in the same order as X{columns}
+        @type rows: C{list} of C{tuple}
         """
-        watcher = self.insert_people(people)
+        row_marks = '(' + ', '.join(['?'] * len(columns)) + ')'
 
-        db_issues_watchers = DBIssuesWatchers(issue_id, watcher.id)
+        size = BULK_INSERT_SIZE
+        if self.MAX_QUERY_PARAMS:
+            size = max(1, min(size, self.MAX_QUERY_PARAMS // len(columns)))
 
-        self.store.add(db_issues_watchers)
-        self.store.flush()
-        return db_issues_watchers
+        for i in range(0, len(rows), size):
+            chunk = rows[i:i + size]
+            query = 'INSERT INTO %s (%s) VALUES %s' % \
+                (table, ', '.join(columns), ', '.join([row_marks] * len(chunk)))
+            params = [value for row in chunk for value in row]
+            self.store.execute(query, params, noresult=True)
 
-    def _remove_issues_watchers(self, issue_id, tracker_id):
+    def _sync_issues_watchers(self, watchers, issue_id, tracker_id):
         """
-        Remove watchers from the issue X{issue_id}
+        Update the watchers of the issue X{issue_id}, removing those
+        who are not in X{watchers} and adding the new ones.
+
+        @param watchers: identities watching the issue
+        @type watchers: C{list} of L{People}
+        @param issue_id: issue identifier
+        @type issue_id: C{int}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
         """
-        result = self._get_db_watchers(issue_id, tracker_id)
+        current = set([self._get_people_id(person) for person in watchers])
+        stored = set(self._get_db_watchers(issue_id, tracker_id).
+                     values(DBIssuesWatchers.person_id))
 
-        for r in result:
-            self.store.remove(r)
-        self.store.flush()
+        removed = stored - current
+        if removed:
+            self.store.find(DBIssuesWatchers,
+                            DBIssuesWatchers.issue_id == issue_id,
+                            DBIssuesWatchers.person_id.is_in(removed)).remove()
+
+        rows = [(issue_id, person_id) for person_id in sorted(current - stored)]
+        self._bulk_insert(DBIssuesWatchers.__storm_table__,
+                          ('issue_id', 'person_id'), rows)
 
     def _get_db_supported_tracker(self, name, version):
         """
@@ -489,79 +869,83 @@ class DBDatabase:
 
         return db_issue
 
-    def _get_db_comment(self,comment, issue_id, tracker_id):
+    def _get_db_comments_map(self, issue_id):
         """
-        Search a comment for the issue X{issue_id}
+        Return the comments stored for the issue X{issue_id} as a
+        C{dict} that maps comment fingerprints to their identifiers.
 
-        @param comment: comment to insert
-        @type comment: L{Comment}
         @param issue_id: issue identifier
         @type issue_id: C{int}
-        @param tracker_id: identifier of the tracker
-        @type tracker_id: C{int}
-
         """
-        db_comment = self.store.find(DBComment,
-                                     DBComment.issue_id == issue_id,
-                                     DBComment.text == unicode(comment.comment),
-                                     DBComment.submitted_on == comment.submitted_on).one()
-
-        if not db_comment:
-            #if comment is not stored, return -1 to know it's a new one
-            db_comment = -1
+        result = self.store.find((DBComment.hash, DBComment.id),
+                                 DBComment.issue_id == issue_id)
+        return dict(result)
 
-        return db_comment
-
-    def _get_db_change(self,change, issue_id, tracker_id):
+    def _get_db_attachments_map(self, issue_id):
         """
-        Search a change for the issue X{issue_id}
+        Return the attachments stored for the issue X{issue_id} as a
+        C{dict} that maps attachment keys to their identifiers.
 
-        @param change: change to insert
-        @type change: L{Change}
         @param issue_id: issue identifier
         @type issue_id: C{int}
-        @param tracker_id: identifier of the tracker
-        @type tracker_id: C{int}
-
         """
-        #source forge don't have new_value so we recived
-        #a string that must be unicode
-        if change.new_value == "unknown":
-            change.new_value = unicode(change.new_value)
-
-        db_change = self.store.find(DBChange,
-                                    DBChange.issue_id == issue_id,
-                                    DBChange.field == change.field,
-                                    DBChange.changed_on == change.changed_on,
-                                    DBChange.old_value == change.old_value,
-                                    DBChange.new_value == change.new_value).one()
-        if not db_change:
-            #if change is not stored, return -1 to know it's a new one
-            db_change = -1
+        result = self.store.find((DBAttachment.id, DBAttachment.url,
+                                  DBAttachment.submitted_on),
+                                 DBAttachment.issue_id == issue_id)
+        return dict([((url, self._db_datetime(submitted_on)), id)
+                     for id, url, submitted_on in result])
 
-        return db_change
-
-    def _get_db_attachment(self, attachment, issue_id, tracker_id):
+    def _get_db_changes_map(self, issue_id):
         """
-        Search an attachment for the issue X{issue_id}
+        Return the changes stored for the issue X{issue_id} as a
+        C{dict} that maps change fingerprints to their identifiers.
 
-        @param attachment: attachment to insert
-        @type attachment: L{Attachment}
         @param issue_id: issue identifier
         @type issue_id: C{int}
-        @param tracker_id: identifier of the tracker
-        @type tracker_id: C{int}
+        """
+        result = self.store.find((DBChange.hash, DBChange.id),
+                                 DBChange.issue_id == issue_id)
+        return dict(result)
 
+    def _get_db_temp_rels_map(self, issues):
         """
-        db_attachment = self.store.find(DBAttachment,
-                                    DBAttachment.issue_id == issue_id,
-                                    DBAttachment.url == attachment.url,
-                                    DBAttachment.submitted_on == attachment.submitted_on).one()
-        if not db_attachment:
-            #if attachment is not stored, return -1 to know it's a new one
-            db_attachment = -1
+        Return the temporal relationships stored for the given issues
+        as a C{dict} that maps relationship keys to their identifiers.
 
-        return db_attachment
+        @param issues: issue identifiers in the tracker
+        @type issues: C{set}
+        """
+        result = self.store.find((DBIssueTempRelationship.id,
+                                  DBIssueTempRelationship.issue_id,
+                                  DBIssueTempRelationship.type,
+                                  DBIssueTempRelationship.related_to),
+                                 DBIssueTempRelationship.issue_id.is_in(issues))
+        return dict([((issue_id, type, related_to), id)
+                     for id, issue_id, type, related_to in result])
+
+    def _comment_key(self, comment, issue_id):
+        return comment_hash(issue_id, comment.submitted_on, comment.comment)
+
+    def _attachment_key(self, attachment):
+        return (unicode(attachment.url),
+                self._db_datetime(attachment.submitted_on))
+
+    def _change_key(self, change, issue_id):
+        return change_hash(issue_id, change.field, change.old_value,
+                           change.new_value, change.changed_on)
+
+    def _temp_rel_key(self, relationship):
+        return (int(relationship.issue), unicode(relationship.type),
+                unicode(relationship.related_to))
+
+    def _db_datetime(self, dt):
+        """
+        Return X{dt} as it is stored in the database, without
+        microseconds, so it can be compared to the stored dates.
+        """
+        if dt is None:
+            return None
+        return dt.replace(microsecond=0)
 
     def _get_db_watchers(self, issue_id, tracker_id):
         """
@@ -576,35 +960,6 @@ class DBDatabase:
                                       DBIssuesWatchers.issue_id == issue_id)
         return db_watchers
 
-    def _get_db_temp_rel(self, t_relationship, issue_id):
-        """
-        """
-        #DBIssueTempRelationship
-        db_temp_rel = self.store.find(DBIssueTempRelationship,
-                                      DBIssueTempRelationship.issue_id == issue_id,
-                                      DBIssueTempRelationship.type == t_relationship.type,
-                                      DBIssueTempRelationship.related_to == t_relationship.related_to).one()
-
-        if not db_temp_rel:
-            db_temp_rel = -1
-
-        return db_temp_rel
-
-    def _get_db_rel(self, issue_id, type, related_to):
-        """
-        """
-        #DBIssueRelationship
-        db_rel = self.store.find(DBIssueRelationship,
-                                 DBIssueRelationship.issue_id == issue_id,
-                                 DBIssueRelationship.type == type,
-                                 DBIssueRelationship.related_to == related_to).one()
-
-        if not db_rel:
-            db_rel = -1
-
-        return db_rel
-
-
 class DBSupportedTracker(object):
     """
     Maps elements from X{supported_trackers} table.
@@ -930,6 +1285,8 @@ class DBComment(object):
     @type submitted: L{storm.locals.Reference}
     @ivar issue_id: Issue identifier.
     @type issue_id: L{storm.locals.Int}
+    @ivar hash: Fingerprint of the issue, date and text of the comment.
+    @type hash: L{storm.locals.Unicode}
     """
     __storm_table__ = 'comments'
 
@@ -938,6 +1295,7 @@ class DBComment(object):
     submitted_by = Int()
     submitted_on = DateTime()
     issue_id = Int()
+    hash = Unicode()
 
     issue = Reference(issue_id, DBIssue.id)
     submitted = Reference(submitted_by, DBPeople.id)
@@ -947,6 +1305,7 @@ class DBComment(object):
         self.submitted_by = submitted_by
         self.submitted_on = submitted_on
         self.issue_id = issue_id
+        self.hash = comment_hash(issue_id, submitted_on, self.text)
 
 
 class DBAttachment(object):
@@ -1045,6 +1404,8 @@ class DBChange(object):
     @type issue: L{storm.locals.Reference}
     @ivar people: Reference to L{DBPeople} object.
     @type people: L{storm.locals.Reference}
+    @ivar hash: Fingerprint of the issue, field, values and date of the change.
+    @type hash: L{storm.locals.Unicode}
     """
     __storm_table__ = 'changes'
 
@@ -1055,6 +1416,7 @@ class DBChange(object):
     changed_by = Int()
     changed_on = DateTime()
     issue_id = Int()
+    hash = Unicode()
 
     issue = Reference(issue_id, DBIssue.id)
     people = Reference(changed_by, DBPeople.id)
@@ -1066,6 +1428,8 @@ class DBChange(object):
         self.changed_by = changed_by
         self.changed_on = changed_on
         self.issue_id = issue_id
+        self.hash = change_hash(issue_id, self.field, self.old_value,
+                                self.new_value, changed_on)
 
 
 class DBBackend:
@@ -1104,6 +1468,13 @@ class DBBackend:
         """
         raise NotImplementedError
 
+    def get_issues_activity_dates(self, store, trk_id, issues):
+        """
+        Abstract method for obtaining the modification date and the
+        last change stored for a set of issues
+        """
+        raise NotImplementedError
+
 
 def get_database(backend=None):
     """
@@ -1115,3 +1486,9 @@ def get_database(backend=None):
     if opts.db_driver_out == "mysql":
         from bicho.db.mysql import DBMySQL
         return DBMySQL(backend)
+    elif opts.db_driver_out == "sqlite":
+        from bicho.db.sqlite import DBSQLite
+        return DBSQLite(backend)
+    elif opts.db_driver_out == "postgresql":
+        from bicho.db.postgresql import DBPostgreSQL
+        return DBPostgreSQL(backend)
@@ -28,9 +28,10 @@ import warnings
 from storm.locals import Store, create_database
 
 from bicho.config import Config
+from bicho.utils import printout
 from bicho.db.database import DBDatabase, DBTracker, DBPeople, \
     DBIssue, DBIssuesWatchers, DBIssueRelationship, DBComment, DBAttachment, \
-    DBChange, DBSupportedTracker, DBIssueTempRelationship
+    DBChange, DBSupportedTracker, DBIssueTempRelationship, DuplicatedRowsError
 
 
 class DBMySQL(DBDatabase):
@@ -59,10 +60,76 @@ class DBMySQL(DBDatabase):
 
         self.suppress_warnings()
         self.create_tables(clsl)
+        self.upgrade_tables()
+        self.warm_people_cache()
 
     def suppress_warnings(self):
         warnings.filterwarnings("ignore", message="Table .* already exists")
 
+    def upgrade_tables(self):
+        """
+        Add the fingerprint columns and their unique indexes to
+        comments and changes tables created by older versions.
+
+        Duplicated rows found while filling the fingerprints in are
+        only removed, keeping the first stored one, when the option
+        to remove them is set.
+
+        @raise DuplicatedRowsError: when there are duplicated rows
+            and the option to remove them is not set.
+        """
+        tables = [t for t in ('comments', 'changes')
+                  if not self._has_index(t, '%s_hash_idx' % t)]
+        if not tables:
+            return
+
+        printout("Upgrading tables %s. This may take a while" % ', '.join(tables))
+
+        for table in tables:
+            if not self._has_column(table, 'hash'):
+                self.store.execute('ALTER TABLE %s ADD COLUMN hash CHAR(40) NULL' % table)
+        self.store.commit()
+
+        self.fill_hashes()
+
+        duplicates = {}
+        for table in tables:
+            result = self.store.execute('SELECT COUNT(*) - \
+                                         COUNT(DISTINCT issue_id, hash) \
+                                         FROM %s' % table)
+            duplicates[table] = result.get_one()[0]
+
+        found = ', '.join(['%s %s' % (n, table)
+                           for table, n in sorted(duplicates.items()) if n])
+        if found and not getattr(Config, 'remove_duplicates', False):
+            raise DuplicatedRowsError("Duplicated rows found (%s). Run again "
+                                      "with --remove-duplicates to remove them "
+                                      "and upgrade the tables" % found)
+
+        for table in tables:
+            if duplicates[table]:
+                self.store.execute('DELETE t1 FROM %s t1 JOIN %s t2 \
+                                    ON t1.issue_id = t2.issue_id \
+                                    AND t1.hash = t2.hash AND t1.id > t2.id'
+                                   % (table, table))
+                printout("%s duplicated rows removed from %s"
+                         % (duplicates[table], table))
+            self.store.execute('ALTER TABLE %s \
+                                MODIFY hash CHAR(40) NOT NULL, \
+                                ADD UNIQUE KEY %s_hash_idx(issue_id, hash)'
+                               % (table, table))
+        self.store.commit()
+
+    def _has_column(self, table, column):
+        result = self.store.execute('SHOW COLUMNS FROM %s LIKE ?' % table,
+                                    (column,))
+        return result.get_one() is not None
+
+    def _has_index(self, table, index):
+        result = self.store.execute('SHOW INDEX FROM %s WHERE Key_name = ?'
+                                    % table, (index,))
+        return result.get_one() is not None
+
 
 class DBSupportedTracker(DBSupportedTracker):
     """
@@ -221,7 +288,9 @@ class DBCommentMySQL(DBComment):
                      text TEXT NOT NULL, \
                      submitted_by INTEGER UNSIGNED NOT NULL, \
                      submitted_on DATETIME NOT NULL, \
+                     hash CHAR(40) NOT NULL, \
                      PRIMARY KEY(id), \
+                     UNIQUE KEY comments_hash_idx(issue_id, hash), \
                      INDEX comments_submitted_idx(submitted_by), \
                      INDEX comments_issue_idx(issue_id), \
                      FOREIGN KEY(submitted_by) \
@@ -273,7 +342,9 @@ class DBChangeMySQL(DBChange):
                      new_value TEXT NOT NULL, \
                      changed_by INTEGER UNSIGNED NOT NULL, \
                      changed_on DATETIME NOT NULL, \
+                     hash CHAR(40) NOT NULL, \
                      PRIMARY KEY(id), \
+                     UNIQUE KEY changes_hash_idx(issue_id, hash), \
                      INDEX changes_issue_idx(issue_id), \
                      INDEX changes_changed_idx(changed_by), \
                      FOREIGN KEY(issue_id) \
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+PostgreSQL database module
+"""
+
+import datetime
+from cStringIO import StringIO
+
+from storm.locals import Store, create_database
+
+from bicho.config import Config
+from bicho.db.database import DBDatabase, DBTracker, DBPeople, \
+    DBIssue, DBIssuesWatchers, DBIssueRelationship, DBComment, DBAttachment, \
+    DBChange, DBSupportedTracker, DBIssueTempRelationship
+
+
+# Minimum number of rows to load using COPY instead of INSERT
+COPY_MIN_ROWS = 20
+
+
+def copy_value(value):
+    """
+    Format a value using the text format of COPY.
+
+    @param value: value to format
+    @type value: C{object}
+
+    @return: the formatted value, encoded in UTF-8
+    @rtype: C{str}
+    """
+    if value is None:
+        return '\\N'
+    elif isinstance(value, bool):
+        return value and 't' or 'f'
+    elif isinstance(value, datetime.datetime):
+        return value.isoformat(' ')
+    elif isinstance(value, str):
+        value = value.decode('utf-8')
+    elif not isinstance(value, unicode):
+        value = unicode(value)
+
+    value = value.replace(u'\\', u'\\\\').replace(u'\t', u'\\t') \
+                 .replace(u'\n', u'\\n').replace(u'\r', u'\\r')
+    return value.encode('utf-8')
+
+
+class DBPostgreSQL(DBDatabase):
+    """
+    PostgreSQL database adapter.
+
+    Comments, changes, attachments and the rest of rows inserted in
+    bulk are loaded using C{COPY ... FROM STDIN} when there are, at
+    least, L{COPY_MIN_ROWS} of them.
+
+    Foreign keys to people are enforced, so issues not assigned to
+    anyone and changes without author are stored with C{NULL}.
+    """
+
+    UNASSIGNED_ID = None
+    ANONYMOUS_ID = None
+
+    def __init__(self, backend=None):
+        DBDatabase.__init__(self, backend)
+        opts = Config()
+
+        self.database = create_database('postgres://' + opts.db_user_out + ':'
+                                        + opts.db_password_out + '@'
+                                        + opts.db_hostname_out + ':'
+                                        + opts.db_port_out + '/'
+                                        + opts.db_database_out)
+        self.store = Store(self.database)
+
+        clsl = [DBSupportedTrackerPostgreSQL, DBTrackerPostgreSQL,
+                DBPeoplePostgreSQL, DBIssuePostgreSQL,
+                DBIssueRelationshipPostgreSQL, DBCommentPostgreSQL,
+                DBAttachmentPostgreSQL, DBChangePostgreSQL,
+                DBIssuesWatchersPostgreSQL, DBIssueTempRelationshipPostgreSQL]
+
+        if backend is not None:
+            clsl.extend([cls for cls in backend.POSTGRESQL_EXT])
+
+        self.create_tables(clsl)
+        self.upgrade_tables()
+        self.store.commit()
+        self.warm_people_cache()
+
+    def upgrade_tables(self):
+        """
+        Allow C{NULL} people on tables created by older versions.
+        """
+        self.store.execute('ALTER TABLE issues \
+                            ALTER COLUMN assigned_to DROP NOT NULL')
+        self.store.execute('ALTER TABLE changes \
+                            ALTER COLUMN changed_by DROP NOT NULL')
+
+    def _get_people_id(self, people):
+        # A failed INSERT aborts the whole transaction on PostgreSQL,
+        # so identities are looked up before trying to insert them
+        user_id = unicode(people.user_id)
+
+        if user_id not in self.people_cache:
+            people_id = self.store.find(DBPeople.id,
+                                        DBPeople.user_id == user_id).one()
+            if people_id is not None:
+                self.people_cache.set(user_id, people_id)
+
+        return DBDatabase._get_people_id(self, people)
+
+    def _bulk_insert(self, table, columns, rows):
+        if len(rows) < COPY_MIN_ROWS:
+            DBDatabase._bulk_insert(self, table, columns, rows)
+            return
+
+        data = StringIO()
+        for row in rows:
+            data.write('\t'.join([copy_value(value) for value in row]))
+            data.write('\n')
+        data.seek(0)
+
+        # COPY runs on the raw connection, so pending objects
+        # have to be written before
+        self.store.flush()
+        cursor = self.store._connection.build_raw_cursor()
+        try:
+            cursor.copy_expert('COPY %s (%s) FROM STDIN' %
+                               (table, ', '.join(columns)), data)
+        finally:
+            cursor.close()
+
+    def _cast_to_text(self, expr):
+        return 'CAST(%s AS TEXT)' % expr
+
+
+class DBSupportedTrackerPostgreSQL(DBSupportedTracker):
+    """
+    PostgreSQL subclass of L{DBSupportedTracker}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS supported_trackers ( \
+                     id SERIAL PRIMARY KEY, \
+                     name TEXT NOT NULL, \
+                     version TEXT NOT NULL, \
+                     UNIQUE(name, version) \
+                     )'
+
+
+class DBTrackerPostgreSQL(DBTracker):
+    """
+    PostgreSQL subclass of L{DBTracker}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS trackers ( \
+                     id SERIAL PRIMARY KEY, \
+                     url TEXT NOT NULL, \
+                     type INTEGER NOT NULL, \
+                     retrieved_on TIMESTAMP NOT NULL, \
+                     UNIQUE(url), \
+                     FOREIGN KEY(type) \
+                       REFERENCES supported_trackers (id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     )'
+
+
+class DBPeoplePostgreSQL(DBPeople):
+    """
+    PostgreSQL subclass of L{DBPeople}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS people ( \
+                     id SERIAL PRIMARY KEY, \
+                     name TEXT NULL, \
+                     email TEXT NULL, \
+                     user_id TEXT NOT NULL, \
+                     UNIQUE(user_id) \
+                     )'
+
+
+class DBIssuePostgreSQL(DBIssue):
+    """
+    PostgreSQL subclass of L{DBIssue}.
+    """
+    __sql_table__ = ['CREATE TABLE IF NOT EXISTS issues ( \
+                      id SERIAL PRIMARY KEY, \
+                      tracker_id INTEGER NOT NULL, \
+                      issue TEXT NOT NULL, \
+                      type TEXT NULL, \
+                      summary TEXT NOT NULL, \
+                      description TEXT NOT NULL, \
+                      status TEXT NOT NULL, \
+                      resolution TEXT NULL, \
+                      priority TEXT NULL, \
+                      submitted_by INTEGER NOT NULL, \
+                      submitted_on TIMESTAMP NOT NULL, \
+                      assigned_to INTEGER NULL, \
+                      UNIQUE(issue, tracker_id), \
+                      FOREIGN KEY(submitted_by) \
+                        REFERENCES people(id) \
+                          ON DELETE SET NULL \
+                          ON UPDATE CASCADE, \
+                      FOREIGN KEY(assigned_to) \
+                        REFERENCES people(id) \
+                          ON DELETE SET NULL \
+                          ON UPDATE CASCADE, \
+                      FOREIGN KEY(tracker_id) \
+                        REFERENCES trackers(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE \
+                      )',
+                     'CREATE INDEX IF NOT EXISTS issues_submitted_idx \
+                      ON issues (submitted_by)',
+                     'CREATE INDEX IF NOT EXISTS issues_assigned_idx \
+                      ON issues (assigned_to)',
+                     'CREATE INDEX IF NOT EXISTS issues_tracker_idx \
+                      ON issues (tracker_id)']
+
+
+class DBIssuesWatchersPostgreSQL(DBIssuesWatchers):
+    """
+    PostgreSQL subclass of L{DBIssuesWatchers}
+    """
+    __sql_table__ = ['CREATE TABLE IF NOT EXISTS issues_watchers ( \
+                      id SERIAL PRIMARY KEY, \
+                      issue_id INTEGER NOT NULL, \
+                      person_id INTEGER NOT NULL, \
+                      UNIQUE(issue_id, person_id), \
+                      FOREIGN KEY(issue_id) \
+                        REFERENCES issues(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE, \
+                      FOREIGN KEY(person_id) \
+                        REFERENCES people(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE \
+                      )',
+                     'CREATE INDEX IF NOT EXISTS issue_person_idx2 \
+                      ON issues_watchers (person_id)']
+
+
+class DBIssueRelationshipPostgreSQL(DBIssueRelationship):
+    """
+    PostgreSQL subclass of L{DBIssueRelationship}.
+    """
+    __sql_table__ = ['CREATE TABLE IF NOT EXISTS related_to ( \
+                      id SERIAL PRIMARY KEY, \
+                      issue_id INTEGER NOT NULL, \
+                      related_to INTEGER NOT NULL, \
+                      type TEXT NOT NULL, \
+                      UNIQUE(issue_id, related_to, type), \
+                      FOREIGN KEY(issue_id) \
+                        REFERENCES issues(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE, \
+                      FOREIGN KEY(related_to) \
+                        REFERENCES issues(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE \
+                      )',
+                     'CREATE INDEX IF NOT EXISTS issues_related_idx2 \
+                      ON related_to (related_to)']
+
+
+class DBIssueTempRelationshipPostgreSQL(DBIssueTempRelationship):
+    """
+    PostgreSQL subclass of L{DBIssueTempRelationship}.
+
+    X{issue_id} is the identifier of the issue on the tracker,
+    so it cannot reference the issues table.
+    """
+    __sql_table__ = 'CREATE TEMPORARY TABLE IF NOT EXISTS temp_related_to ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     related_to TEXT NOT NULL, \
+                     type TEXT NOT NULL, \
+                     tracker_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id, related_to, type, tracker_id) \
+                     )'
+
+
+class DBCommentPostgreSQL(DBComment):
+    """
+    PostgreSQL subclass of L{DBComment}.
+    """
+    __sql_table__ = ['CREATE TABLE IF NOT EXISTS comments ( \
+                      id SERIAL PRIMARY KEY, \
+                      issue_id INTEGER NOT NULL, \
+                      comment_id INTEGER, \
+                      text TEXT NOT NULL, \
+                      submitted_by INTEGER NOT NULL, \
+                      submitted_on TIMESTAMP NOT NULL, \
+                      hash CHAR(40) NOT NULL, \
+                      UNIQUE(issue_id, hash), \
+                      FOREIGN KEY(submitted_by) \
+                        REFERENCES people(id) \
+                          ON DELETE SET NULL \
+                          ON UPDATE CASCADE, \
+                      FOREIGN KEY(issue_id) \
+                        REFERENCES issues(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE \
+                      )',
+                     'CREATE INDEX IF NOT EXISTS comments_submitted_idx \
+                      ON comments (submitted_by)']
+
+
+class DBAttachmentPostgreSQL(DBAttachment):
+    """
+    PostgreSQL subclass of L{DBAttachment}.
+    """
+    __sql_table__ = ['CREATE TABLE IF NOT EXISTS attachments ( \
+                      id SERIAL PRIMARY KEY, \
+                      issue_id INTEGER NOT NULL, \
+                      name TEXT NOT NULL, \
+                      description TEXT NOT NULL, \
+                      url TEXT NOT NULL, \
+                      submitted_by INTEGER, \
+                      submitted_on TIMESTAMP, \
+                      FOREIGN KEY(submitted_by) \
+                        REFERENCES people(id) \
+                          ON DELETE SET NULL \
+                          ON UPDATE CASCADE, \
+                      FOREIGN KEY(issue_id) \
+                        REFERENCES issues(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE \
+                      )',
+                     'CREATE INDEX IF NOT EXISTS attachments_submitted_idx \
+                      ON attachments (submitted_by)',
+                     'CREATE INDEX IF NOT EXISTS attachments_issue_idx \
+                      ON attachments (issue_id)']
+
+
+class DBChangePostgreSQL(DBChange):
+    """
+    PostgreSQL subclass of L{DBChange}.
+    """
+    __sql_table__ = ['CREATE TABLE IF NOT EXISTS changes ( \
+                      id SERIAL PRIMARY KEY, \
+                      issue_id INTEGER NOT NULL, \
+                      field TEXT NOT NULL, \
+                      old_value TEXT NOT NULL, \
+                      new_value TEXT NOT NULL, \
+                      changed_by INTEGER NULL, \
+                      changed_on TIMESTAMP NOT NULL, \
+                      hash CHAR(40) NOT NULL, \
+                      UNIQUE(issue_id, hash), \
+                      FOREIGN KEY(issue_id) \
+                        REFERENCES issues(id) \
+                          ON DELETE CASCADE \
+                          ON UPDATE CASCADE, \
+                      FOREIGN KEY(changed_by) \
+                        REFERENCES people(id) \
+                          ON DELETE SET NULL \
+                          ON UPDATE CASCADE \
+                      )',
+                     'CREATE INDEX IF NOT EXISTS changes_changed_idx \
+                      ON changes (changed_by)']
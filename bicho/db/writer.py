@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Write-behind storage of issues
+"""
+
+import sys
+import threading
+import Queue
+
+from bicho.config import Config
+from bicho.utils import printdbg, printerr
+
+
+# Maximum number of issues waiting to be stored
+WRITER_QUEUE_SIZE = 50
+
+# Queue markers to commit and to stop the writer thread
+_COMMIT = object()
+_STOP = object()
+
+
+class DBWriter:
+    """
+    Store issues on a dedicated thread, so fetching the next issues
+    from the tracker overlaps with storing the previous ones.
+
+    Issues are queued by L{insert_issue}, which blocks while the queue
+    is full. The database must not be used directly until L{flush} or
+    L{close} return, because the writer thread may be using it.
+
+    When the queue size is 0 or the connection of the database cannot
+    be shared between threads, issues are stored synchronously.
+
+    Once storing an issue fails, the rest of queued issues are
+    discarded and the error is raised by every later call to the
+    methods of the writer.
+
+    The writer can be used in a C{with} statement, which closes it at
+    the end of the block. When the block raises an exception, errors
+    of the writer are only logged, so they do not hide the exception.
+    """
+
+    def __init__(self, db, size=None):
+        """
+        @param db: database where the issues will be stored
+        @type db: L{DBDatabase}
+        @param size: maximum number of issues on the queue
+        @type size: C{int}
+        """
+        if size is None:
+            size = getattr(Config, 'writer_queue_size', None)
+            if size is None:
+                size = WRITER_QUEUE_SIZE
+
+        self.db = db
+        self.thread = None
+        self._error = None
+
+        if size > 0 and db.CONNECTION_THREAD_SAFE:
+            self.queue = Queue.Queue(size)
+            self.thread = threading.Thread(target=self._run,
+                                           name='bicho-db-writer')
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            printdbg("Issues will be stored synchronously")
+
+    def insert_issue(self, issue, tracker_id):
+        """
+        Queue the given issue to be stored. The issue must not be
+        modified after calling this method.
+
+        @param issue: issue to insert
+        @type issue: L{Issue}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        """
+        self._check_error()
+
+        if self.thread is None:
+            self._store_issue(issue, tracker_id)
+        else:
+            self.queue.put((issue, tracker_id))
+
+    def flush(self):
+        """
+        Wait until the queued issues are stored and committed.
+        """
+        if self.thread is not None:
+            self.queue.put(_COMMIT)
+            self.queue.join()
+        else:
+            self.db.commit()
+        self._check_error()
+
+    def close(self):
+        """
+        Store the queued issues, commit them and stop the writer thread.
+        """
+        if self.thread is not None:
+            self.queue.put(_STOP)
+            self.thread.join()
+            self.thread = None
+        else:
+            self.db.commit()
+        self._check_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+            return False
+
+        try:
+            self.close()
+        except Exception, e:
+            printerr("Error storing issues: %s" % e)
+        return False
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if self._error is not None:
+                    pass
+                elif item is _COMMIT or item is _STOP:
+                    self.db.commit()
+                else:
+                    self._store_issue(*item)
+            except:
+                self._error = sys.exc_info()
+            finally:
+                self.queue.task_done()
+
+            if item is _STOP:
+                break
+
+    def _store_issue(self, issue, tracker_id):
+        try:
+            self.db.insert_issue(issue, tracker_id)
+            printdbg("Issue #%s stored " % issue.issue)
+        except UnicodeEncodeError:
+            printerr("UnicodeEncodeError: the issue %s couldn't be stored"
+                     % issue.issue)
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
@@ -0,0 +1,844 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+HTTP client shared by the backends.
+
+All the requests are sent through a single session, so connections
+to the same host are kept alive and reused, and the cookies set by
+the trackers (i.e, after a login) are sent on the next requests.
+
+Responses to GET requests are stored on disk. Next time they are
+requested, the stored body is returned right away while it is younger
+than the maximum age set on the configuration (i.e, to resume a run
+that was interrupted). Older entries are revalidated sending their
+ETag or Last-Modified header and, when the server replies 304 Not
+Modified, the stored body is returned; entries without validators are
+requested again. Entries not used for longer than the maximum age are
+removed when the client is created.
+
+Requests to each host are rate limited by a token bucket that slows
+down when the server throttles and speeds up again while it is healthy.
+"""
+
+import email.utils
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import urlparse
+import zlib
+from cStringIO import StringIO
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bicho import info
+from bicho.config import Config
+from bicho.utils import bicho_dot_dir, create_dir, printdbg
+
+
+# Seconds to wait for connecting to and for reading from the server
+HTTP_TIMEOUT = 120
+
+# Hosts with a pool of connections and connections per host
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+
+USER_AGENT = 'Bicho/%s' % info.VERSION
+
+# Bytes read from the connection at once when streaming
+CHUNK_SIZE = 64 * 1024
+
+# Requests that can be sent in a row before the rate applies
+RATE_BURST = 3
+
+# Lowest rate, in requests per second, after being throttled
+MIN_RATE = 1.0 / 60
+
+# Rate given to unlimited hosts when they throttle for first time
+THROTTLED_RATE = 1.0
+
+# Unlimited hosts recover their unlimited rate above this one
+UNLIMITED_RATE = 50.0
+
+# Factor of rate increase on each healthy response
+RATE_INCREASE = 1.1
+
+# Seconds to wait when the server throttles without saying for how long;
+# it doubles for each consecutive failure up to MAX_BACKOFF
+BACKOFF = 30
+MAX_BACKOFF = 600
+
+# Times a throttled request is sent again
+MAX_RETRIES = 5
+
+# Response codes of servers that are throttling
+THROTTLE_CODES = (429, 503)
+
+# Errors raised by the client
+HTTPError = requests.exceptions.HTTPError
+ConnectionError = requests.exceptions.ConnectionError
+Timeout = requests.exceptions.Timeout
+RequestException = requests.exceptions.RequestException
+
+
+class HostBucket:
+    """
+    Token bucket of a host.
+
+    @ivar rate: requests per second; C{None} when unlimited
+    @type rate: C{float}
+    @ivar tokens: requests that can be sent right now
+    @type tokens: C{float}
+    @ivar blocked_until: time until no request can be sent
+    @type blocked_until: C{float}
+    @ivar failures: consecutive throttled requests
+    @type failures: C{int}
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = RATE_BURST
+        self.last = time.time()
+        self.blocked_until = 0
+        self.failures = 0
+
+
+class RateLimiter:
+    """
+    Rate limiter of requests per host.
+
+    Each host starts with the maximum rate. When it throttles (429 and
+    503 responses, I{Retry-After} headers, exhausted I{X-RateLimit}
+    quotas or connection errors) no more requests are sent to it for a
+    while and its rate is halved. Healthy responses increase the rate
+    back up to the maximum.
+
+    I{X-RateLimit} quotas belong to the credentials of the requests,
+    so once a quota is exhausted only the requests sent with the same
+    credentials wait until it is reset.
+
+    @ivar max_rate: maximum requests per second to a host;
+        C{None} for no limit
+    @type max_rate: C{float}
+    """
+
+    def __init__(self, max_rate=None):
+        self.max_rate = max_rate
+        self.hosts = {}
+        self.quotas = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, url, scope=None):
+        """
+        Wait until a request to the host of X{url} can be sent.
+
+        @param url: URL to request
+        @type url: C{str}
+        @param scope: credentials of the request
+        @type scope: C{str}
+        """
+        host = urlparse.urlsplit(url).netloc
+
+        while True:
+            self.lock.acquire()
+            try:
+                bucket = self._bucket(host)
+                now = time.time()
+                wait = max(bucket.blocked_until,
+                           self.quotas.get((host, scope), 0)) - now
+
+                if wait <= 0:
+                    if bucket.rate is None:
+                        return
+                    bucket.tokens = min(RATE_BURST, bucket.tokens +
+                                        (now - bucket.last) * bucket.rate)
+                    bucket.last = now
+                    if bucket.tokens >= 1:
+                        bucket.tokens -= 1
+                        return
+                    wait = (1 - bucket.tokens) / bucket.rate
+            finally:
+                self.lock.release()
+
+            printdbg("Waiting %.2f seconds for %s" % (wait, host))
+            time.sleep(wait)
+
+    def update(self, url, response, scope=None):
+        """
+        Adapt the rate of the host to the given response.
+
+        @param url: URL requested
+        @type url: C{str}
+        @param response: response of the server
+        @type response: C{requests.Response}
+        @param scope: credentials of the request
+        @type scope: C{str}
+
+        @return: whether the server is throttling the requests
+            and the request should be sent again
+        @rtype: C{bool}
+        """
+        host = urlparse.urlsplit(url).netloc
+        headers = response.headers
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+
+        self.lock.acquire()
+        try:
+            bucket = self._bucket(host)
+
+            if remaining == '0' and reset:
+                # Quota exhausted, i.e, GitHub; wait until it is reset
+                key = (host, scope)
+                self.quotas[key] = max(self.quotas.get(key, 0), float(reset))
+                printdbg("Rate limit of %s exhausted until %s" %
+                         (host, time.ctime(float(reset))))
+                if response.status_code == 403:
+                    return True
+
+            # Secondary rate limits of GitHub respond 403 with the
+            # time to wait, as any other throttling response
+            throttled = response.status_code in THROTTLE_CODES or \
+                (response.status_code == 403 and 'Retry-After' in headers)
+
+            if throttled:
+                wait = self._retry_after(headers)
+                self._throttle(bucket, wait)
+                printdbg("%s throttled the request (%s); waiting %s seconds" %
+                         (host, response.status_code,
+                          bucket.blocked_until - time.time()))
+                return True
+
+            bucket.failures = 0
+            if bucket.rate is not None:
+                bucket.rate *= RATE_INCREASE
+                if self.max_rate is not None:
+                    bucket.rate = min(bucket.rate, self.max_rate)
+                elif bucket.rate >= UNLIMITED_RATE:
+                    bucket.rate = None
+            return False
+        finally:
+            self.lock.release()
+
+    def backoff(self, url):
+        """
+        Slow down the requests to the host of X{url}, which
+        could not be reached.
+        """
+        host = urlparse.urlsplit(url).netloc
+
+        self.lock.acquire()
+        try:
+            self._throttle(self._bucket(host))
+        finally:
+            self.lock.release()
+
+    def _bucket(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = HostBucket(self.max_rate)
+        return self.hosts[host]
+
+    def _throttle(self, bucket, wait=None):
+        bucket.failures += 1
+        if wait is None:
+            wait = min(MAX_BACKOFF, BACKOFF * 2 ** (bucket.failures - 1))
+
+        bucket.blocked_until = max(bucket.blocked_until, time.time() + wait)
+        if bucket.rate is None:
+            bucket.rate = THROTTLED_RATE
+        else:
+            bucket.rate = max(MIN_RATE, bucket.rate / 2)
+        bucket.tokens = 0
+
+    def _retry_after(self, headers):
+        # Retry-After can be given in seconds or as a date
+        value = headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0, int(value))
+        except ValueError:
+            date = email.utils.parsedate_tz(value)
+            if date is None:
+                return None
+            return max(0, email.utils.mktime_tz(date) - time.time())
+
+
+class CacheEntryWriter:
+    """
+    Writer of a cache entry. The file is written first with a
+    temporary name and renamed once closed, so readers never find
+    partial entries.
+    """
+
+    def __init__(self, filename, validators):
+        self.filename = filename
+        dirname = os.path.dirname(filename)
+        create_dir(dirname)
+
+        self.fd, self.tmpname = tempfile.mkstemp(dir=dirname)
+        self.compressor = zlib.compressobj()
+        self.write(json.dumps(validators) + '\n')
+
+    def write(self, data):
+        """
+        Append X{data} to the body of the entry.
+        """
+        os.write(self.fd, self.compressor.compress(data))
+
+    def close(self):
+        """
+        Store the entry.
+        """
+        try:
+            os.write(self.fd, self.compressor.flush())
+        finally:
+            os.close(self.fd)
+        os.rename(self.tmpname, self.filename)
+
+    def discard(self):
+        """
+        Remove the entry written so far, i.e, when the
+        body could not be read completely.
+        """
+        os.close(self.fd)
+        os.remove(self.tmpname)
+
+
+class ResponseCache:
+    """
+    On-disk cache of HTTP responses.
+
+    Each entry is stored in its own file, named after the hash of
+    the request, with the body and the validators of the response
+    compressed with zlib.
+
+    @ivar path: directory where the entries are stored
+    @type path: C{str}
+    @ivar max_age: seconds an entry is kept without being used;
+        C{None} to keep them forever
+    @type max_age: C{int}
+    """
+
+    def __init__(self, path, max_age=None):
+        self.path = path
+        self.max_age = max_age
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, 0700)
+
+    def key(self, url, params=None, scope=None):
+        """
+        Return the key of a request.
+
+        @param url: URL requested
+        @type url: C{str}
+        @param params: query parameters of the request
+        @type params: C{dict} or C{list} of C{tuple}
+        @param scope: credentials of the request, so responses
+            to different users are not mixed
+        @type scope: C{str}
+
+        @rtype: C{str}
+        """
+        if isinstance(params, dict):
+            params = sorted(params.items())
+        return hashlib.sha1(repr((url, params, scope))).hexdigest()
+
+    def get(self, key):
+        """
+        Return the entry stored with X{key}, or C{None} when
+        there is not a valid one.
+
+        @return: a tuple with the validators and the body
+        @rtype: C{tuple} of (C{dict}, C{str})
+        """
+        entry = self.open_entry(key)
+        if entry is None:
+            return None
+
+        validators, chunks = entry
+        try:
+            return validators, ''.join(chunks)
+        except zlib.error:
+            printdbg("Invalid cache entry %s" % key)
+            return None
+
+    def open_entry(self, key):
+        """
+        Return the entry stored with X{key}, with its body read
+        from disk in chunks as it is consumed, or C{None} when
+        there is not a valid one.
+
+        @return: a tuple with the validators and the chunks of the body
+        @rtype: C{tuple} of (C{dict}, iterator of C{str})
+        """
+        filename = self._filename(key)
+        try:
+            fd = open(filename, 'rb')
+        except IOError:
+            return None
+
+        # The modification time is the last time the entry was used
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+
+        decompressor = zlib.decompressobj()
+        data = ''
+        try:
+            while '\n' not in data:
+                chunk = fd.read(CHUNK_SIZE)
+                if not chunk:
+                    raise ValueError("Cache entry without header")
+                data += decompressor.decompress(chunk)
+            header, data = data.split('\n', 1)
+            validators = json.loads(header)
+        except (zlib.error, ValueError):
+            fd.close()
+            printdbg("Invalid cache entry %s" % key)
+            return None
+
+        return validators, self._read_body(fd, decompressor, data)
+
+    def set(self, key, validators, body):
+        """
+        Store an entry.
+
+        @param key: key of the request
+        @type key: C{str}
+        @param validators: ETag, Last-Modified, Link and encoding of the
+            response, and the time when it was stored
+        @type validators: C{dict}
+        @param body: body of the response
+        @type body: C{str}
+        """
+        writer = self.writer(key, validators)
+        try:
+            writer.write(body)
+        except:
+            writer.discard()
+            raise
+        writer.close()
+
+    def writer(self, key, validators):
+        """
+        Return a writer to store an entry whose body is given
+        in chunks. See L{set} for the parameters.
+
+        @rtype: L{CacheEntryWriter}
+        """
+        return CacheEntryWriter(self._filename(key), validators)
+
+    def prune(self):
+        """
+        Remove the entries not used for longer than the maximum
+        age, and the partial ones left by interrupted runs.
+
+        @return: number of entries removed
+        @rtype: C{int}
+        """
+        if not self.max_age:
+            return 0
+
+        oldest = time.time() - self.max_age
+        removed = 0
+
+        # Entries are stored in subdirectories named after the first
+        # characters of their keys
+        for subdir in os.listdir(self.path):
+            dirname = os.path.join(self.path, subdir)
+            if len(subdir) != 2 or not os.path.isdir(dirname):
+                continue
+            for name in os.listdir(dirname):
+                filename = os.path.join(dirname, name)
+                try:
+                    if os.path.getmtime(filename) < oldest:
+                        os.remove(filename)
+                        removed += 1
+                except OSError:
+                    # Removed or replaced meanwhile by another run
+                    pass
+
+        printdbg("%d cache entries not used in %d seconds removed"
+                 % (removed, self.max_age))
+        return removed
+
+    def _read_body(self, fd, decompressor, data):
+        try:
+            if data:
+                yield data
+            while True:
+                chunk = fd.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+            data = decompressor.flush()
+            if data:
+                yield data
+        finally:
+            fd.close()
+
+    def _filename(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+
+class HTTPClient:
+    """
+    HTTP client with persistent connections.
+
+    @ivar session: session used to send the requests
+    @type session: C{requests.Session}
+    @ivar timeout: default timeout of the requests, in seconds
+    @type timeout: C{int}
+    @ivar cache: cache of responses; C{None} when disabled
+    @type cache: L{ResponseCache}
+    @ivar limiter: rate limiter of the requests
+    @type limiter: L{RateLimiter}
+    @ivar max_age: seconds a cached response is returned without
+        requesting it again; C{None} to always revalidate
+    @type max_age: C{int}
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT, pool_maxsize=POOL_MAXSIZE,
+                 cache=None, limiter=None, max_age=None):
+        self.timeout = timeout
+        self.cache = cache
+        self.max_age = max_age
+        self.limiter = limiter or RateLimiter()
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                              pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request. Keyword arguments are the ones accepted
+        by C{requests.Session.request}.
+
+        Responses are cached by the credentials of the request. When
+        several credentials can retrieve the same data (i.e, a set of
+        API tokens used in turns), X{cache_scope} can be given to share
+        the cached responses among them. Responses requested with
+        X{stream} are not cached here; L{iter_content} caches them.
+
+        @param method: HTTP method
+        @type method: C{str}
+        @param url: URL to request
+        @type url: C{str}
+
+        @return: the response of the server
+        @rtype: C{requests.Response}
+
+        @raise HTTPError: when the server responds with an error code.
+        @raise ConnectionError: when the server cannot be reached.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        cache_scope = kwargs.pop('cache_scope', None)
+
+        if self.cache is None or method != 'GET' or kwargs.get('stream'):
+            response = self._send(method, url, **kwargs)
+            response.raise_for_status()
+            return response
+
+        key, entry = self._lookup(url, cache_scope, kwargs)
+
+        if entry is not None:
+            validators, chunks = entry
+            if self._is_fresh(validators):
+                printdbg("Using cached response of %s" % url)
+                return self._cached_response(requests.Response(), url,
+                                             validators, ''.join(chunks))
+
+        response = self._send(method, url, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            printdbg("Not modified, using cached response")
+            return self._cached_response(response, url, validators,
+                                         ''.join(chunks))
+        if entry is not None:
+            chunks.close()
+
+        response.raise_for_status()
+        self.cache.set(key, self._validators(response), response.content)
+
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def urlopen(self, url, data=None, **kwargs):
+        """
+        Retrieve the given URL, sending X{data} using POST when it
+        is given, and return the body as a file-like object.
+
+        @param url: URL to request
+        @type url: C{str}
+        @param data: data to post
+        @type data: C{dict} or C{str}
+
+        @return: the body of the response
+        @rtype: file-like object
+        """
+        if data is None:
+            response = self.get(url, **kwargs)
+        else:
+            response = self.post(url, data=data, **kwargs)
+        return StringIO(response.content)
+
+    def iter_content(self, url, chunk_size=CHUNK_SIZE, **kwargs):
+        """
+        Retrieve the given URL and return an iterator over the body,
+        which is read from the connection in chunks as it is consumed.
+
+        Responses are cached as in L{request}. The body is written to
+        the cache as it is read and the entry is stored once the whole
+        body was read; cached bodies are read back in chunks too.
+
+        @param url: URL to request
+        @type url: C{str}
+        @param chunk_size: maximum size of each chunk
+        @type chunk_size: C{int}
+
+        @return: chunks of the body
+        @rtype: iterator of C{str}
+
+        @raise HTTPError: when the server responds with an error code.
+        @raise ConnectionError: when the server cannot be reached.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        cache_scope = kwargs.pop('cache_scope', None)
+
+        if self.cache is None:
+            response = self._send('GET', url, stream=True, **kwargs)
+            response.raise_for_status()
+            return self._iter_chunks(response, chunk_size)
+
+        key, entry = self._lookup(url, cache_scope, kwargs)
+
+        if entry is not None:
+            validators, chunks = entry
+            if self._is_fresh(validators):
+                printdbg("Using cached response of %s" % url)
+                return chunks
+
+        response = self._send('GET', url, stream=True, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            printdbg("Not modified, using cached response")
+            response.close()
+            return chunks
+        if entry is not None:
+            chunks.close()
+
+        try:
+            response.raise_for_status()
+        except HTTPError:
+            response.close()
+            raise
+
+        writer = self.cache.writer(key, self._validators(response))
+        return self._iter_chunks(response, chunk_size, writer)
+
+    def _iter_chunks(self, response, chunk_size, writer=None):
+        # The entry is stored only when the whole body was read
+        try:
+            try:
+                for chunk in response.iter_content(chunk_size):
+                    if writer is not None:
+                        writer.write(chunk)
+                    yield chunk
+            except:
+                if writer is not None:
+                    writer.discard()
+                raise
+            if writer is not None:
+                writer.close()
+        finally:
+            response.close()
+
+    def _lookup(self, url, cache_scope, kwargs):
+        # Return the key of the request and its cached entry. Stale
+        # entries are revalidated, adding their validators to the
+        # headers of the request
+        if cache_scope is None:
+            cache_scope = self._scope(kwargs)
+        else:
+            cache_scope = self._hash_scope(cache_scope)
+
+        key = self.cache.key(url, kwargs.get('params'), cache_scope)
+        entry = self.cache.open_entry(key)
+
+        if entry is not None and not self._is_fresh(entry[0]):
+            validators = entry[0]
+            headers = dict(kwargs.get('headers') or {})
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+            kwargs['headers'] = headers
+
+        return key, entry
+
+    def _validators(self, response):
+        return {'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'link': response.headers.get('Link'),
+                'encoding': response.encoding,
+                'stored_on': time.time()}
+
+    def _is_fresh(self, validators):
+        # Entries stored by older versions have no date
+        stored_on = validators.get('stored_on')
+        if not self.max_age or stored_on is None:
+            return False
+        return time.time() - stored_on < self.max_age
+
+    def _cached_response(self, response, url, validators, body):
+        response.status_code = 200
+        response.url = url
+        response.encoding = validators.get('encoding')
+        response._content = body
+        # Pages of paginated resources link to the next one
+        if validators.get('link') and 'Link' not in response.headers:
+            response.headers['Link'] = validators['link']
+        return response
+
+    def _send(self, method, url, **kwargs):
+        # Send the request when the rate limiter allows it,
+        # sending it again while the server throttles
+        retries = 0
+        scope = self._scope(kwargs)
+
+        while True:
+            self.limiter.acquire(url, scope)
+            printdbg("%s %s" % (method, url))
+
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (ConnectionError, Timeout):
+                self.limiter.backoff(url)
+                raise
+
+            if not self.limiter.update(url, response, scope) or retries == MAX_RETRIES:
+                return response
+            retries += 1
+
+    def _scope(self, kwargs):
+        # Hash of the user and the token sent with the request, so
+        # credentials are not kept in keys. Cookies are not included
+        # because they change on each session
+        auth = kwargs.get('auth') or self.session.auth
+        if isinstance(auth, (tuple, list)):
+            user = auth[0]
+        elif isinstance(auth, basestring):
+            user = auth
+        else:
+            user = getattr(Config, 'backend_user', None)
+        headers = kwargs.get('headers') or {}
+        return self._hash_scope(user, headers.get('Authorization'))
+
+    def _hash_scope(self, *values):
+        # Text and byte strings of the same value give the same hash
+        encoded = []
+        for value in values:
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            encoded.append(value or '')
+        return hashlib.sha1('\n'.join(encoded)).hexdigest()
+
+    def set_cookie(self, name, value):
+        """
+        Set a cookie to send on every request.
+        """
+        self.session.cookies.set(name, value)
+
+    def get_cookies(self):
+        """
+        Return the cookies of the session.
+
+        @rtype: C{dict}
+        """
+        return self.session.cookies.get_dict()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Return the client shared by all the backends.
+
+    @rtype: L{HTTPClient}
+    """
+    global _client
+
+    _client_lock.acquire()
+    try:
+        if _client is None:
+            cache = None
+            if not getattr(Config, 'no_cache', False):
+                path = getattr(Config, 'path', None) or \
+                    os.path.join(bicho_dot_dir(), 'cache')
+                cache = ResponseCache(path, getattr(Config, 'cache_max_age', None))
+                cache.prune()
+
+            max_rate = getattr(Config, 'max_rate', None)
+            if max_rate is None and getattr(Config, 'delay', None):
+                max_rate = 1.0 / Config.delay
+
+            # Each worker of the pool needs its own connection
+            pool_maxsize = max(POOL_MAXSIZE,
+                               getattr(Config, 'workers', None) or 1)
+
+            _client = HTTPClient(pool_maxsize=pool_maxsize, cache=cache,
+                                 limiter=RateLimiter(max_rate),
+                                 max_age=getattr(Config, 'cache_max_age', None))
+        return _client
+    finally:
+        _client_lock.release()
+
+
+def get(url, **kwargs):
+    return get_client().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return get_client().post(url, **kwargs)
+
+
+def urlopen(url, data=None, **kwargs):
+    return get_client().urlopen(url, data, **kwargs)
+
+
+def iter_content(url, chunk_size=CHUNK_SIZE, **kwargs):
+    return get_client().iter_content(url, chunk_size, **kwargs)
@@ -29,6 +29,7 @@ import sys
 from config import Config, ErrorLoadingConfig, InvalidConfig
 
 from backends import Backend
+from db.database import DuplicatedRowsError
 from utils import printerr, printdbg
 
 from post_processing import IssueLogger
@@ -53,7 +54,11 @@ def main():
         printerr("Backend ''" + Config.backend + "'' doesn't exist. " + str(e))
         sys.exit(2)
     printdbg("Bicho object created, options and backend initialized")
-    backend.run()
+    try:
+        backend.run()
+    except DuplicatedRowsError, e:
+        printerr(str(e))
+        sys.exit(1)
 
     if Config.logtable:
         try:
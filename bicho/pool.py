@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Pool of workers to fetch the details of several issues at once.
+
+Backends usually need one or more requests per issue to retrieve its
+comments and changes. Those requests are sent by the workers of the
+pool while the backend parses and stores the issues, in the same order
+they were submitted. Lists of issues split in pages are retrieved one
+page ahead, while the issues of the previous page are stored, even when
+there is only one worker. Requests
+of the workers go through the shared HTTP client, so they are rate
+limited per host as any other request.
+"""
+
+import collections
+import sys
+import threading
+import Queue
+
+from bicho.config import Config
+from bicho.utils import printdbg
+
+
+# Default number of workers; with one worker jobs are run
+# synchronously, by the thread that asks for the result
+WORKERS = 1
+
+# Results fetched in advance per worker
+LOOKAHEAD = 2
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class Job:
+    """
+    Call to run by a worker.
+
+    @ivar deferred: whether the call is run when its result
+        is requested instead of by a worker
+    @type deferred: C{bool}
+    """
+
+    def __init__(self, func, args, deferred=False):
+        self.func = func
+        self.args = args
+        self.deferred = deferred
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except:
+            self.error = sys.exc_info()
+        finally:
+            self.done.set()
+
+    def get(self):
+        """
+        Wait for the job to finish and return its result, raising
+        the exception of the call when it failed.
+        """
+        if self.deferred and not self.done.is_set():
+            self.run()
+
+        # Waiting with a timeout allows to stop with Ctrl+C
+        while not self.done.wait(1):
+            pass
+
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.result
+
+
+class OrderedResults:
+    """
+    Iterator over the results of applying a function to a list of
+    items, in the same order of the items.
+
+    Items are submitted to the pool as results are consumed, so at most
+    C{workers * LOOKAHEAD} results are pending at any time.
+
+    When a call fails, its exception is raised when its result is
+    requested. The iterator can still be used to get the next results.
+    """
+
+    def __init__(self, pool, func, items):
+        self.pool = pool
+        self.func = func
+        self.items = iter(items)
+        self.pending = collections.deque()
+        self.size = max(1, pool.workers * LOOKAHEAD)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        self._fill()
+
+        if not self.pending:
+            raise StopIteration
+        return self.pending.popleft().get()
+
+    def _fill(self):
+        while len(self.pending) < self.size:
+            try:
+                item = self.items.next()
+            except StopIteration:
+                break
+            self.pending.append(self.pool.submit(self.func, item))
+
+
+class Pages:
+    """
+    Iterator over the pages of a paginated resource, in order.
+
+    Pages are retrieved by X{fetch}, a function that takes the cursor
+    of a page (an offset, a page number, a marker, ...) and returns
+    a tuple with the page and the cursor of the next one, or C{None}
+    when there are no more pages to retrieve. The next page is
+    submitted to the pool as soon as the current one is returned, so
+    it is retrieved while the current one is processed. Pools without
+    worker threads would run it only when it is requested, so it is
+    retrieved by a thread of its own instead.
+
+    X{fetch} must return C{None} as the next cursor as soon as it
+    finds that the remaining pages are not needed (i.e, they have
+    issues older than the ones already stored), so no page is
+    requested beyond that point.
+
+    When a call fails, its exception is raised and the iteration ends.
+    """
+
+    def __init__(self, pool, fetch, cursor):
+        self.pool = pool
+        self.fetch = fetch
+        self.pending = self._submit(cursor)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.pending is None:
+            raise StopIteration
+
+        job = self.pending
+        self.pending = None
+
+        page, cursor = job.get()
+
+        if cursor is not None:
+            self.pending = self._submit(cursor)
+        return page
+
+    def _submit(self, cursor):
+        if self.pool.threads:
+            return self.pool.submit(self.fetch, cursor)
+
+        job = Job(self.fetch, (cursor,))
+        t = threading.Thread(target=job.run, name='bicho-prefetch')
+        t.daemon = True
+        t.start()
+        return job
+
+
+class WorkerPool:
+    """
+    Pool of threads that run jobs concurrently.
+
+    @ivar workers: number of worker threads; with one or less, jobs
+        are run by the thread that waits for their results
+    @type workers: C{int}
+    """
+
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self.jobs = Queue.Queue()
+        self.threads = []
+
+        if workers <= 1:
+            return
+
+        for i in range(workers):
+            t = threading.Thread(target=self._run,
+                                 name='bicho-worker-%d' % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+        printdbg("Pool of %d workers started" % workers)
+
+    def submit(self, func, *args):
+        """
+        Run X{func} with the given arguments on a worker.
+
+        @return: job running the call
+        @rtype: L{Job}
+        """
+        job = Job(func, args, deferred=not self.threads)
+
+        if self.threads:
+            self.jobs.put(job)
+        return job
+
+    def imap(self, func, items):
+        """
+        Apply X{func} to each item, returning the results in order.
+
+        @param func: function of one argument
+        @type func: C{function}
+        @param items: items to process
+        @type items: C{iterable}
+
+        @return: iterator over the results
+        @rtype: L{OrderedResults}
+        """
+        return OrderedResults(self, func, items)
+
+    def pages(self, fetch, cursor):
+        """
+        Iterate over the pages retrieved by X{fetch}, starting
+        from the given cursor, one page ahead.
+
+        @param fetch: function that returns a tuple with the page
+            of the given cursor and the cursor of the next page
+        @type fetch: C{function}
+        @param cursor: cursor of the first page
+        @type cursor: C{object}
+
+        @return: iterator over the pages
+        @rtype: L{Pages}
+        """
+        return Pages(self, fetch, cursor)
+
+    def close(self):
+        """
+        Stop the workers once the submitted jobs are done.
+        """
+        for t in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            job.run()
+
+
+def get_pool():
+    """
+    Return the pool shared by all the backends, creating it on
+    first use with the number of workers set on the configuration.
+
+    @rtype: L{WorkerPool}
+    """
+    global _pool
+
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            workers = getattr(Config, 'workers', None) or WORKERS
+            _pool = WorkerPool(workers)
+        return _pool
+    finally:
+        _pool_lock.release()
+
+
+def imap(func, items):
+    """
+    Apply X{func} to each item using the shared pool.
+
+    @see: L{WorkerPool.imap}
+    """
+    return get_pool().imap(func, items)
+
+
+def pages(fetch, cursor):
+    """
+    Iterate over the pages retrieved by X{fetch} using the shared pool.
+
+    @see: L{WorkerPool.pages}
+    """
+    return get_pool().pages(fetch, cursor)
@@ -22,9 +22,11 @@
 #
 
 import cgi
+import collections
 import errno
 import os
 import random
+import re
 import sys
 import time
 import urllib
@@ -100,6 +102,46 @@ def rdelay():
         printdbg("delay")
         time.sleep(random.randint(0,20))
 
+
+class LRUCache:
+    """
+    Mapping that keeps, at most, X{size} entries, discarding the
+    least recently used ones first. Hits and misses are counted.
+
+    @param size: maximum number of entries
+    @type size: C{int}
+    """
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._entries[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def remove(self, key):
+        self._entries.pop(key, None)
+
 _dirs = {}
 
 def create_dir(dir):
@@ -136,3 +178,62 @@ def valid_XML_char_ordinal(i):
             or 0xE000 <= i <= 0xFFFD
             or 0x10000 <= i <= 0x10FFFF
     )
+
+
+# Control characters not allowed in XML 1.0 documents. In UTF-8 they
+# never appear inside multibyte sequences, so encoded documents can be
+# cleaned byte by byte.
+_INVALID_XML_BYTES = ''.join(chr(i) for i in range(0x20)
+                             if not valid_XML_char_ordinal(i))
+_INVALID_XML_CHARS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+# U+FFFE and U+FFFF are not allowed either; in UTF-8 they are
+# encoded as EF BF BE and EF BF BF
+_INVALID_XML_SEQUENCES = re.compile('\xef\xbf[\xbe\xbf]')
+
+
+def remove_invalid_XML_chars(data):
+    """
+    Remove the characters not allowed in XML documents.
+
+    @param data: UTF-8 encoded or unicode string to clean
+    @type data: C{str} or C{unicode}
+
+    @return: the string without the invalid characters
+    @rtype: C{str} or C{unicode}
+    """
+    if isinstance(data, unicode):
+        return _INVALID_XML_CHARS.sub(u'', data)
+    return _INVALID_XML_SEQUENCES.sub('', data.translate(None, _INVALID_XML_BYTES))
+
+
+def iter_valid_XML_chunks(chunks):
+    """
+    Remove the characters not allowed in XML documents from a UTF-8
+    encoded document read in chunks. Invalid characters split between
+    two chunks are removed too.
+
+    @param chunks: chunks of the document
+    @type chunks: iterator of C{str}
+
+    @return: chunks of the document without the invalid characters
+    @rtype: iterator of C{str}
+    """
+    pending = ''
+    for chunk in chunks:
+        data = pending + chunk
+
+        # Keep the start of a sequence that could end in the next chunk
+        if data.endswith('\xef\xbf'):
+            data, pending = data[:-2], data[-2:]
+        elif data.endswith('\xef'):
+            data, pending = data[:-1], data[-1:]
+        else:
+            pending = ''
+
+        data = remove_invalid_XML_chars(data)
+        if data:
+            yield data
+
+    if pending:
+        yield remove_invalid_XML_chars(pending)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import datetime, glob, json, os, StringIO, sys, unittest, urlparse, xml.sax, xmlrpclib
+from dateutil import tz
+sys.path.insert(0, "..")
+from bicho.config import Config
+from bicho.backends.bg import BugzillaActivityParser, BugzillaHistoryParser, \
+    BugsHandler, BGBackend, BuglistWindow, BuglistLimitError
+from bicho.utils import iter_valid_XML_chunks
+
+
+class BugzillaActivityTest(unittest.TestCase):
+    """
+    Compares the changes parsed from the activity pages on data/bugzilla/
+    with the ones stored on their .changes files, which were obtained
+    with the former parser based on BeautifulSoup.
+    """
+
+    tests_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'data', 'bugzilla')
+
+    def read_changes(self, html_file):
+        f = open(html_file)
+        html = f.read()
+        f.close()
+
+        parser = BugzillaActivityParser(html, os.path.basename(html_file))
+        changes = []
+        for c in parser.parse_changes():
+            changes.append({'field': c.field,
+                            'old_value': c.old_value,
+                            'new_value': c.new_value,
+                            'changed_by': c.changed_by.user_id,
+                            'email': c.changed_by.email,
+                            'changed_on': c.changed_on.isoformat()})
+        return changes
+
+    def read_expected_changes(self, html_file):
+        f = open(html_file[:-len('.html')] + '.changes')
+        changes = json.load(f)
+        f.close()
+        return changes
+
+    def testActivityPages(self):
+        html_files = sorted(glob.glob(os.path.join(self.tests_data_dir, '*.html')))
+        self.assertTrue(html_files)
+
+        for html_file in html_files:
+            expected = self.read_expected_changes(html_file)
+            received = self.read_changes(html_file)
+            self.assertEqual(expected, received,
+                             "Changes differ for %s" % os.path.basename(html_file))
+
+    def testTypes(self):
+        html_file = os.path.join(self.tests_data_dir, 'activity-3.0.html')
+        f = open(html_file)
+        parser = BugzillaActivityParser(f.read(), '1234')
+        f.close()
+
+        for c in parser.parse_changes():
+            self.assertTrue(isinstance(c.field, unicode))
+            self.assertTrue(isinstance(c.old_value, unicode))
+            self.assertTrue(isinstance(c.new_value, unicode))
+            self.assertTrue(isinstance(c.changed_by.user_id, unicode))
+
+    def testNoActivity(self):
+        html_file = os.path.join(self.tests_data_dir, 'activity-empty.html')
+        self.assertEqual([], self.read_changes(html_file))
+
+
+class BugzillaHistoryTest(unittest.TestCase):
+    """
+    Checks the changes parsed from a response of the Bug.history
+    method of the webservice.
+    """
+
+    response = """<?xml version="1.0" encoding="UTF-8"?>
+<methodResponse><params><param><value><struct>
+<member><name>bugs</name><value><array><data><value><struct>
+<member><name>id</name><value><int>1234</int></value></member>
+<member><name>history</name><value><array><data><value><struct>
+<member><name>when</name><value><dateTime.iso8601>20120605T14:21:39</dateTime.iso8601></value></member>
+<member><name>who</name><value><string>jdoe@example.com</string></value></member>
+<member><name>changes</name><value><array><data>
+<value><struct>
+<member><name>field_name</name><value><string>bug_status</string></value></member>
+<member><name>removed</name><value><string>NEW</string></value></member>
+<member><name>added</name><value><string>RESOLVED</string></value></member>
+</struct></value>
+<value><struct>
+<member><name>field_name</name><value><string>flagtypes.name</string></value></member>
+<member><name>removed</name><value><string></string></value></member>
+<member><name>added</name><value><string>review?</string></value></member>
+<member><name>attachment_id</name><value><int>601822</int></value></member>
+</struct></value>
+</data></array></value></member>
+</struct></value></data></array></value></member>
+</struct></value></data></array></value></member>
+</struct></value></param></params></methodResponse>"""
+
+    field_names = {'bug_status': 'Status', 'flagtypes.name': 'Flags'}
+
+    def read_changes(self, tzinfo=None):
+        result = xmlrpclib.loads(self.response, use_datetime=True)[0][0]
+        history = result['bugs'][0]['history']
+        parser = BugzillaHistoryParser(history, self.field_names, tzinfo)
+        return parser.parse_changes()
+
+    def testChanges(self):
+        changes = self.read_changes()
+        self.assertEqual(2, len(changes))
+
+        self.assertEqual(u'status', changes[0].field)
+        self.assertEqual(u'NEW', changes[0].old_value)
+        self.assertEqual(u'RESOLVED', changes[0].new_value)
+        self.assertEqual(u'jdoe@example.com', changes[0].changed_by.user_id)
+        self.assertEqual(u'jdoe@example.com', changes[0].changed_by.email)
+
+        self.assertEqual(u'Attachment #601822 Flags', changes[1].field)
+        self.assertEqual(u'', changes[1].old_value)
+        self.assertEqual(u'review?', changes[1].new_value)
+
+    def testTimeZone(self):
+        changes = self.read_changes()
+        self.assertEqual(datetime.datetime(2012, 6, 5, 14, 21, 39),
+                         changes[0].changed_on)
+
+        changes = self.read_changes(tz.tzoffset(None, -7 * 3600))
+        self.assertEqual(datetime.datetime(2012, 6, 5, 7, 21, 39),
+                         changes[0].changed_on)
+
+    def testDaylightSaving(self):
+        # Changes on both sides of the DST change of 2012-03-11
+        history = []
+        for when in (datetime.datetime(2012, 3, 11, 9, 30),
+                     datetime.datetime(2012, 3, 11, 10, 30)):
+            history.append({'when': when, 'who': 'jdoe@example.com',
+                            'changes': [{'field_name': 'bug_status',
+                                         'removed': 'NEW',
+                                         'added': 'RESOLVED'}]})
+
+        parser = BugzillaHistoryParser(history, self.field_names,
+                                       tz.gettz('America/Los_Angeles'))
+        changes = parser.parse_changes()
+        self.assertEqual(datetime.datetime(2012, 3, 11, 1, 30),
+                         changes[0].changed_on)
+        self.assertEqual(datetime.datetime(2012, 3, 11, 3, 30),
+                         changes[1].changed_on)
+
+
+class BugzillaXMLTest(unittest.TestCase):
+    """
+    Parses the XML of a bug with characters not allowed in XML,
+    fed to the parser in chunks as when it is downloaded.
+    """
+
+    xml_file = os.path.join(BugzillaActivityTest.tests_data_dir,
+                            'bug-invalid-chars.xml')
+
+    def read_issue(self, data, chunk_size):
+        handler = BugsHandler()
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(handler)
+
+        chunks = [data[i:i + chunk_size]
+                  for i in range(0, len(data), chunk_size)]
+        for chunk in iter_valid_XML_chunks(chunks):
+            parser.feed(chunk)
+        parser.close()
+
+        self.assertEqual(1, len(handler.get_issues()))
+        return handler.get_issues()[0]
+
+    def testInvalidChars(self):
+        f = open(self.xml_file, 'rb')
+        data = f.read()
+        f.close()
+        self.assertTrue('\xef\xbf\xbe' in data)
+        self.assertTrue('\xef\xbf\xbf' in data)
+
+        # Invalid characters are split between chunks of every size
+        for chunk_size in range(1, len(data) + 1):
+            issue = self.read_issue(data, chunk_size)
+            self.assertEqual(u'Crash when the log contains noncharacters',
+                             issue.summary)
+            self.assertEqual(u'The log has a form feed, a U+FFFE and a '
+                             u'U+FFFF, which are not allowed in XML: '
+                             u'\xf1 is.', issue.description)
+            self.assertEqual(u'Confirmed.', issue.comments[0].comment)
+
+
+class FakeBuglistBackend(BGBackend):
+    """
+    Backend whose buglists are served from a list of bugs, cut by
+    the limit of a fake server.
+    """
+
+    def __init__(self, nbugs, server_limit, offsets=True, max_results=None):
+        self.url = 'http://example.com/buglist.cgi'
+        self.version = '4.4'
+        self.max_results = max_results
+        self.server_limit = server_limit
+        self.offsets = offsets
+        self.bugs = [str(i) for i in range(1, nbugs + 1)]
+        self.urls = []
+
+    def _urlopen_auth(self, url, stream=False):
+        self.urls.append(url)
+        query = urlparse.parse_qs(urlparse.urlparse(url).query)
+        limit = int(query['limit'][0]) or self.server_limit
+        offset = 0
+        if self.offsets and 'offset' in query:
+            offset = int(query['offset'][0])
+
+        lines = ['bug_id,"product","component","assigned_to","bug_status",'
+                 '"resolution","short_desc","changeddate"']
+        for bug_id in self.bugs[offset:offset + min(limit, self.server_limit)]:
+            lines.append('%s,"P","C","jdoe","NEW","---","Bug",'
+                         '"2012-06-05 10:00:%02d"' % (bug_id, int(bug_id)))
+        return StringIO.StringIO('\n'.join(lines) + '\n')
+
+
+class BugzillaBuglistTest(unittest.TestCase):
+    """
+    Checks whether the buglists of the windows were cut by the limit
+    of the server, asking for the bug one row past them.
+    """
+
+    def retrieve_window(self, backend):
+        window = BuglistWindow(datetime.datetime(2012, 6, 5))
+        return backend._retrieve_window(window)
+
+    def testTruncated(self):
+        backend = FakeBuglistBackend(5, 3)
+        window = self.retrieve_window(backend)
+
+        self.assertEqual(['1', '2', '3'], window.ids)
+        self.assertTrue(window.truncated)
+        self.assertTrue('offset=3' in backend.urls[1])
+
+        # The limit of the server is known from now on
+        self.assertEqual(3, backend.max_results)
+        self.assertTrue(self.retrieve_window(backend).truncated)
+        self.assertEqual(3, len(backend.urls))
+
+    def testComplete(self):
+        backend = FakeBuglistBackend(5, 10)
+        window = self.retrieve_window(backend)
+
+        self.assertEqual(['1', '2', '3', '4', '5'], window.ids)
+        self.assertFalse(window.truncated)
+        self.assertEqual(None, backend.max_results)
+
+    def testOffsetsNotSupported(self):
+        backend = FakeBuglistBackend(5, 3, offsets=False)
+        self.assertRaises(BuglistLimitError, self.retrieve_window, backend)
+
+        # The limit given is trusted without asking for more bugs
+        backend = FakeBuglistBackend(5, 3, offsets=False, max_results=3)
+        self.assertTrue(self.retrieve_window(backend).truncated)
+        self.assertEqual(1, len(backend.urls))
+
+
+if __name__ == '__main__':
+    Config.debug = False
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(BugzillaActivityTest))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(BugzillaHistoryTest))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(BugzillaXMLTest))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(BugzillaBuglistTest))
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import datetime, os, shutil, sys, tempfile, unittest
+sys.path.insert(0, "..")
+from bicho.config import Config
+from bicho.common import Tracker, Issue, People, Comment, TempRelationship
+from bicho.db.database import DBBackend, DBIssue, DBComment, \
+    DBIssueRelationship, DBIssueTempRelationship
+from bicho.db.sqlite import DBSQLite
+
+
+class FailingBackend(DBBackend):
+    """
+    Backend whose extra data of some issues cannot be stored.
+    """
+
+    def __init__(self, failing):
+        self.SQLITE_EXT = []
+        self.failing = failing
+
+    def insert_issue_ext(self, store, issue, issue_id):
+        # Part of the data is written before failing
+        store.execute('UPDATE issues SET summary = ? WHERE id = ?',
+                      (u'Updated', issue_id))
+        if issue.issue in self.failing:
+            raise ValueError(issue.issue)
+
+    def insert_comment_ext(self, store, comment, comment_id):
+        pass
+
+    def insert_attachment_ext(self, store, attch, attch_id):
+        pass
+
+    def insert_change_ext(self, store, change, change_id):
+        pass
+
+    def insert_temp_rel(self, store, temp_relationship, trel_id, tracker_id):
+        pass
+
+
+class DatabaseBatchTest(unittest.TestCase):
+    """
+    Stores batches of issues in a SQLite database, failing partway
+    through them or on some of their comments.
+    """
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        Config.db_database_out = os.path.join(self.path, 'bicho.db')
+        Config.commit_every = 10
+
+    def tearDown(self):
+        del Config.commit_every
+        shutil.rmtree(self.path)
+
+    def new_db(self, failing=()):
+        db = DBSQLite(FailingBackend(failing))
+        db.insert_supported_traker(u'test', u'1.0')
+        tracker = db.insert_tracker(Tracker(u'http://example.com/',
+                                            u'test', u'1.0'))
+        return db, tracker.id
+
+    def new_issue(self, issue_id):
+        issue = Issue(issue_id, u'bug', u'Summary', u'Description',
+                      People(u'jdoe'), datetime.datetime(2012, 6, 5))
+        issue.status = u'NEW'
+        return issue
+
+    def stored_issues(self, db):
+        db.store.rollback()
+        return sorted(db.store.find(DBIssue.issue))
+
+    def testFailingExt(self):
+        db, tracker_id = self.new_db(failing=[u'3'])
+
+        for issue_id in (u'1', u'2', u'3', u'4'):
+            try:
+                db.insert_issue(self.new_issue(issue_id), tracker_id)
+            except ValueError, e:
+                self.assertEqual(u'3', e.args[0])
+        db.commit()
+
+        # Only the failing issue is discarded
+        self.assertEqual([u'1', u'2', u'4'], self.stored_issues(db))
+
+    def testFailingWrite(self):
+        db, tracker_id = self.new_db()
+
+        for issue_id in (u'1', u'2'):
+            db.insert_issue(self.new_issue(issue_id), tracker_id)
+
+        def write(store, value):
+            store.execute('DELETE FROM issues')
+            raise ValueError(value)
+
+        self.assertRaises(ValueError, db.write, write, u'x')
+        db.commit()
+
+        self.assertEqual([u'1', u'2'], self.stored_issues(db))
+
+    def testUndecodableComment(self):
+        db, tracker_id = self.new_db()
+
+        issue = self.new_issue(u'1')
+        for text in (u'First', 'Caf\xe9', u'Third'):
+            issue.add_comment(Comment(text, People(u'jdoe'),
+                                      datetime.datetime(2012, 6, 6)))
+        db.insert_issue(issue, tracker_id)
+        db.commit()
+
+        # Only the comment that cannot be decoded is skipped
+        self.assertEqual([u'1'], self.stored_issues(db))
+        self.assertEqual([u'First', u'Third'],
+                         sorted(db.store.find(DBComment.text)))
+
+    def testLateRelationship(self):
+        db, tracker_id = self.new_db()
+
+        issue = self.new_issue(u'1')
+        issue.add_temp_relationship(TempRelationship(u'1', u'duplicate_of', u'2'))
+        db.insert_issue(issue, tracker_id)
+        db.commit()
+
+        # Issue 2 is not stored yet, so it is kept to be resolved later
+        db.store_final_relationships()
+        self.assertTrue(db.store.find(DBIssueRelationship).is_empty())
+        self.assertEqual(1, db.store.find(DBIssueTempRelationship).count())
+
+        db.insert_issue(self.new_issue(u'2'), tracker_id)
+        db.commit()
+        db.store_final_relationships()
+
+        rels = [(db.store.get(DBIssue, rel.issue_id).issue,
+                 db.store.get(DBIssue, rel.related_to).issue, rel.type)
+                for rel in db.store.find(DBIssueRelationship)]
+        self.assertEqual([(u'1', u'2', u'duplicate_of')], rels)
+        self.assertTrue(db.store.find(DBIssueTempRelationship).is_empty())
+
+
+if __name__ == '__main__':
+    Config.debug = False
+    suite = unittest.TestLoader().loadTestsFromTestCase(DatabaseBatchTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import os, shutil, sys, tempfile, time, unittest
+sys.path.insert(0, "..")
+import requests
+from cStringIO import StringIO
+from bicho.config import Config
+from bicho.http import HTTPClient, ResponseCache
+
+
+class HTTPCacheTest(unittest.TestCase):
+    """
+    Checks the responses returned from the cache of the HTTP
+    client, without sending requests to any server.
+    """
+
+    url = 'http://bugzilla.example.com/show_bug.cgi?id=1234&ctype=xml'
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.requests = []
+        self.body = '<bugzilla><bug/></bugzilla>'
+        self.headers = {}
+        self.status_code = 200
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def new_client(self, max_age=None):
+        client = HTTPClient(cache=ResponseCache(self.path), max_age=max_age)
+        client.session.request = self.send
+        return client
+
+    def send(self, method, url, **kwargs):
+        self.requests.append(dict(kwargs.get('headers') or {}))
+
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.url = url
+        response.encoding = 'utf-8'
+        response.headers.update(self.headers)
+        response._content = self.body
+        if kwargs.get('stream'):
+            response.raw = StringIO(self.body)
+            response._content = False
+        return response
+
+    def testNoValidatorsFresh(self):
+        self.new_client(max_age=3600).get(self.url)
+
+        # Served from the cache on a new run
+        self.body = 'changed'
+        response = self.new_client(max_age=3600).get(self.url)
+        self.assertEqual(1, len(self.requests))
+        self.assertEqual('<bugzilla><bug/></bugzilla>', response.content)
+
+    def testNoValidatorsStale(self):
+        self.new_client().get(self.url)
+
+        # Without a maximum age, it is requested again, with a plain GET
+        self.body = 'changed'
+        response = self.new_client().get(self.url)
+        self.assertEqual(2, len(self.requests))
+        self.assertFalse('If-None-Match' in self.requests[1])
+        self.assertFalse('If-Modified-Since' in self.requests[1])
+        self.assertEqual('changed', response.content)
+
+    def testValidators(self):
+        self.headers = {'ETag': '"abc"'}
+        self.new_client().get(self.url)
+        self.new_client().get(self.url)
+        self.assertEqual('"abc"', self.requests[1]['If-None-Match'])
+
+    def testStreamed(self):
+        chunks = self.new_client(max_age=3600).iter_content(self.url,
+                                                            chunk_size=4)
+        self.assertEqual(self.body, ''.join(chunks))
+
+        # The body read in chunks is stored, and read back in chunks
+        self.body = 'changed'
+        chunks = list(self.new_client(max_age=3600).iter_content(self.url))
+        self.assertEqual(1, len(self.requests))
+        self.assertEqual('<bugzilla><bug/></bugzilla>', ''.join(chunks))
+
+    def testStreamedNotModified(self):
+        self.headers = {'ETag': '"abc"'}
+        ''.join(self.new_client().iter_content(self.url))
+
+        self.body = ''
+        self.status_code = 304
+        chunks = self.new_client().iter_content(self.url)
+        self.assertEqual('"abc"', self.requests[1]['If-None-Match'])
+        self.assertEqual('<bugzilla><bug/></bugzilla>', ''.join(chunks))
+
+    def testStreamedIncomplete(self):
+        chunks = self.new_client(max_age=3600).iter_content(self.url,
+                                                            chunk_size=4)
+        chunks.next()
+        chunks.close()
+
+        # Partial bodies are not stored
+        self.new_client(max_age=3600).get(self.url)
+        self.assertEqual(2, len(self.requests))
+
+    def testPrune(self):
+        cache = ResponseCache(self.path, max_age=3600)
+        old_key = cache.key(self.url + '&old')
+        used_key = cache.key(self.url + '&used')
+        for key in (old_key, used_key, cache.key(self.url)):
+            cache.set(key, {}, self.body)
+
+        # Entries stored two hours ago, one of them used since then
+        past = time.time() - 7200
+        for key in (old_key, used_key):
+            os.utime(cache._filename(key), (past, past))
+        cache.get(used_key)
+
+        self.assertEqual(1, cache.prune())
+        self.assertEqual(None, cache.get(old_key))
+        self.assertNotEqual(None, cache.get(used_key))
+        self.assertNotEqual(None, cache.get(cache.key(self.url)))
+
+    def testScope(self):
+        client = self.new_client()
+        scope = client._scope({'auth': (u'jdoe', u'secret')})
+
+        # The same credentials give the same scope, whatever their types
+        self.assertEqual(scope, client._scope({'auth': ['jdoe', 'secret']}))
+        self.assertNotEqual(scope, client._scope({'auth': ('jsmith', 'secret')}))
+        self.assertFalse('jdoe' in scope)
+
+        token = {'headers': {'Authorization': 'token abc'}}
+        self.assertEqual(client._scope(token),
+                         client._scope({'headers': {'Authorization': u'token abc'}}))
+        self.assertFalse('abc' in client._scope(token))
+
+
+if __name__ == '__main__':
+    Config.debug = False
+    suite = unittest.TestLoader().loadTestsFromTestCase(HTTPCacheTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
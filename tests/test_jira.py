@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import sys, unittest
+sys.path.insert(0, "..")
+from bicho.config import Config
+from bicho.backends.jira import SoupHtmlParser, JiraRESTParser
+from bicho.db.database import change_hash
+
+
+class JiraChangesTest(unittest.TestCase):
+    """
+    Compares the changes parsed from a change history page with
+    the ones parsed from the changelog of the REST API.
+    """
+
+    html = """<html><body>
+<div class="actionContainer">
+  <div class="action-details">
+    <a class="user-hover user-avatar" rel="jdoe" href="/secure/ViewProfile.jspa?name=jdoe">John Doe</a>
+    made changes - <span class="date"><time datetime="2011-11-19T00:27-0800">19/Nov/11 12:27 AM</time></span>
+  </div>
+  <div class="changehistory action-body">
+    <table>
+      <tr>
+        <td class="activity-name">Status</td>
+        <td class="activity-old-val">Open</td>
+        <td class="activity-new-val">Resolved</td>
+      </tr>
+    </table>
+  </div>
+</div>
+</body></html>"""
+
+    raw_issue = {
+        'changelog': {
+            'histories': [{
+                'author': {'name': 'jdoe', 'displayName': 'John Doe',
+                           'emailAddress': 'jdoe@example.com'},
+                'created': '2011-11-19T00:27:43.000-0800',
+                'items': [{'field': 'status', 'fieldId': 'status',
+                           'fromString': 'Open', 'toString': 'Resolved'}]
+            }]
+        }
+    }
+
+    def hashes(self, changes):
+        return [change_hash(u'1', c.field, c.old_value, c.new_value,
+                            c.changed_on) for c in changes]
+
+    def testSameChanges(self):
+        html_changes = SoupHtmlParser(self.html, u'TEST-1').parse_changes()
+        parser = JiraRESTParser('https://jira.example.com',
+                                {'status': 'Status'})
+        rest_changes = parser.parse_changes(self.raw_issue)
+
+        self.assertEqual(1, len(rest_changes))
+        self.assertEqual(html_changes[0].changed_on, rest_changes[0].changed_on)
+        self.assertEqual(html_changes[0].changed_by.user_id,
+                         rest_changes[0].changed_by.user_id)
+        self.assertEqual(self.hashes(html_changes), self.hashes(rest_changes))
+
+
+if __name__ == '__main__':
+    Config.debug = False
+    suite = unittest.TestLoader().loadTestsFromTestCase(JiraChangesTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
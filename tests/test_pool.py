@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+
+import sys, threading, unittest
+sys.path.insert(0, "..")
+from bicho.config import Config
+from bicho.pool import WorkerPool
+
+
+class PagesTest(unittest.TestCase):
+    """
+    Iterates over the pages of a fake paginated resource, checking
+    that the next page is requested before the current one is
+    consumed, with and without worker threads.
+    """
+
+    npages = 3
+
+    def setUp(self):
+        self.requested = []
+        self.fetched = dict([(i, threading.Event()) for i in range(self.npages)])
+
+    def fetch(self, cursor):
+        self.requested.append(cursor)
+        self.fetched[cursor].set()
+
+        next_cursor = cursor + 1
+        if next_cursor == self.npages:
+            next_cursor = None
+        return 'page %d' % cursor, next_cursor
+
+    def check_prefetch(self, pool):
+        pages = pool.pages(self.fetch, 0)
+
+        for i in range(self.npages):
+            self.assertEqual('page %d' % i, pages.next())
+
+            # The next page is requested while this one is processed
+            if i + 1 < self.npages:
+                self.fetched[i + 1].wait(5)
+                self.assertTrue(self.fetched[i + 1].is_set())
+
+        self.assertRaises(StopIteration, pages.next)
+        self.assertEqual(range(self.npages), self.requested)
+
+    def testOneWorker(self):
+        self.check_prefetch(WorkerPool(1))
+
+    def testWorkers(self):
+        pool = WorkerPool(2)
+        try:
+            self.check_prefetch(pool)
+        finally:
+            pool.close()
+
+    def testError(self):
+        def fetch(cursor):
+            if cursor == 1:
+                raise ValueError(cursor)
+            return 'page %d' % cursor, cursor + 1
+
+        pages = WorkerPool(1).pages(fetch, 0)
+        self.assertEqual('page 0', pages.next())
+        self.assertRaises(ValueError, pages.next)
+        self.assertRaises(StopIteration, pages.next)
+
+
+if __name__ == '__main__':
+    Config.debug = False
+    suite = unittest.TestLoader().loadTestsFromTestCase(PagesTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2012 GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+
+import datetime, sys, unittest
+sys.path.insert(0, "..")
+from bicho.config import Config
+from bicho.common import Tracker, Issue, People, Change
+from bicho.db.database import DBIssue, DBChange
+from bicho.db.postgresql import DBPostgreSQL, COPY_MIN_ROWS
+
+# Tables are dropped, so use a database only for testing
+DB_USER = 'postgres'
+DB_PASSWORD = ''
+DB_HOSTNAME = 'localhost'
+DB_PORT = '5432'
+DB_DATABASE = 'bicho_tests'
+
+TABLES = ['issues_watchers', 'temp_related_to', 'related_to',
+          'comments', 'attachments', 'changes', 'issues',
+          'people', 'trackers', 'supported_trackers']
+
+
+class PostgreSQLTest(unittest.TestCase):
+    """
+    Stores issues through the PostgreSQL adapter, which
+    enforces the foreign keys to people.
+    """
+
+    def setUp(self):
+        Config.db_user_out = DB_USER
+        Config.db_password_out = DB_PASSWORD
+        Config.db_hostname_out = DB_HOSTNAME
+        Config.db_port_out = DB_PORT
+        Config.db_database_out = DB_DATABASE
+
+        self.db = DBPostgreSQL()
+        self.db.insert_supported_traker(u'test', u'1.0')
+        self.tracker = self.db.insert_tracker(Tracker(u'http://example.com/',
+                                                      u'test', u'1.0'))
+
+    def tearDown(self):
+        for table in TABLES:
+            self.db.store.execute('DROP TABLE IF EXISTS %s CASCADE' % table)
+        self.db.store.commit()
+
+    def new_issue(self, issue_id, nchanges):
+        issue = Issue(issue_id, u'bug', u'Summary', u'Description',
+                      People(u'jdoe'), datetime.datetime(2012, 6, 5))
+        issue.status = u'NEW'
+
+        for i in range(nchanges):
+            issue.add_change(Change(u'status', u'NEW', u'RESOLVED', None,
+                                    datetime.datetime(2012, 6, 6, 0, i)))
+        return issue
+
+    def read_issue(self, issue_id):
+        db_issue = self.db.store.find(DBIssue, DBIssue.issue == issue_id).one()
+        changes = self.db.store.find(DBChange, DBChange.issue_id == db_issue.id)
+        return db_issue, list(changes)
+
+    def testUnassignedIssue(self):
+        self.db.insert_issue(self.new_issue(u'1', 1), self.tracker.id)
+        self.db.commit()
+
+        db_issue, changes = self.read_issue(u'1')
+        self.assertEqual(None, db_issue.assigned_to)
+        self.assertEqual(1, len(changes))
+        self.assertEqual(None, changes[0].changed_by)
+
+    def testAnonymousChangesCopy(self):
+        # Enough changes to be loaded with COPY
+        self.db.insert_issue(self.new_issue(u'2', COPY_MIN_ROWS),
+                             self.tracker.id)
+        self.db.commit()
+
+        db_issue, changes = self.read_issue(u'2')
+        self.assertEqual(COPY_MIN_ROWS, len(changes))
+        for change in changes:
+            self.assertEqual(None, change.changed_by)
+
+
+if __name__ == '__main__':
+    Config.debug = False
+    suite = unittest.TestLoader().loadTestsFromTestCase(PostgreSQLTest)
+    unittest.TextTestRunner(verbosity=2).run(suite)